@@ -0,0 +1,263 @@
+from collections import deque
+import numpy as np
+from jobs import JobBatch
+from simulation import count_ticks
+from metrics.default import PowerMetricsCollector, JobDelayMetricsCollector
+
+
+class AnalyticEngine:
+    """Simulation engine for static configurations computed over whole columns of jobs.
+
+    Without a SA strategy, the workers never change and the simple dispatcher is deterministic, so the start times
+    of the jobs can be computed directly. A single active queue follows the Lindley recursion
+    start = max(spawn, prev_finish), which is evaluated block-wise by NumPy (busy periods of the queue are found
+    by a cumulative sum of durations and a cumulative maximum, the finish times are then accumulated in the order
+    of the queue); multiple queues are replayed by a lean loop over plain lists of timestamps.
+    Periodic snapshots of the metrics are replayed only at the MAPE-K ticks (including the fast-forwarding).
+
+    The job objects are not updated (start_ts and finish_ts remain unset) and the finished jobs are reported
+    to the collectors in bulk. The jobs are reported in the same order as by the other engines (at the first
+    time step after they have finished, in the order of workers), so the results are exactly the same.
+    """
+
+    # only these metrics are understood by the engine (derived classes may change the behavior),
+    # dispatchers declare the support by the analytic flag (see AbstractDispatcher)
+    METRICS = (PowerMetricsCollector, JobDelayMetricsCollector)
+
+    # number of jobs computed at once
+    BLOCK_SIZE = 65536
+
+    @staticmethod
+    def is_supported(simulation):
+        """Check whether the components of the simulation can be computed analytically."""
+        return simulation.sa_strategy is None and vars(type(simulation.dispatcher)).get("analytic", False) \
+            and all(type(metric) in AnalyticEngine.METRICS for metric in simulation.metrics)
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.workers = simulation.workers
+        self.active = [idx for idx, worker in enumerate(self.workers) if worker.get_attribute("active")]
+        self.queues = [deque() for _ in self.active]  # finish timestamps of jobs in active queues
+        self.period = simulation.sa_period
+
+        self.started = False
+        self.ts = 0.0  # spawn time of the last job
+        self.next_mapek_ts = 0.0
+        self.jobs = 0  # number of jobs processed so far (used as sequential numbers)
+        self.busy_until = float("-inf")  # max. finish time of all jobs processed so far
+
+        # jobs that were added but not processed yet (spawn and duration arrays)
+        self.buffer = [[], []]
+        self.buffered = 0
+
+        # jobs that are finished but not reported yet (the time step when they are reported is not known yet)
+        self.pending = [np.zeros(0), np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)]
+        self.ticks = []  # MAPE-K ticks replayed while the current block is processed
+
+    def _accumulate_busy_periods(self, spawn, duration, previous):
+        """Finish times of the jobs of one queue, where previous holds (estimated) finish times of preceding jobs.
+
+        A job that waits for its predecessor finishes at prev_finish + duration, the others at spawn + duration;
+        the durations of each busy period are accumulated sequentially (the same way the queue adds them up).
+        """
+        queued = previous > spawn
+        finish = spawn + duration
+        waiting = np.flatnonzero(queued)
+        if len(waiting):
+            # runs of waiting jobs (each one follows the job that started its busy period)
+            breaks = np.flatnonzero(np.diff(waiting) != 1) + 1
+            starts = waiting[np.concatenate(([0], breaks))].tolist()
+            ends = (waiting[np.concatenate((breaks, [len(waiting)])) - 1] + 1).tolist()
+            for start, end in zip(starts, ends):
+                head = finish[start - 1] if start > 0 else self.busy_until
+                finish[start:end] = np.add.accumulate(np.concatenate(([head], duration[start:end])))[1:]
+        return finish
+
+    def _compute_single_queue(self, spawn, duration):
+        """Lindley recursion for one queue, returns finish times and delays."""
+        # finish_i = cumsum_i + max(prev_finish, max_k<=i (spawn_k - cumsum_k-1)) estimates the finish times,
+        # timestamps are taken relative to the first spawn of the block to keep the magnitudes small
+        base = spawn[0]
+        cumsum = np.cumsum(duration)
+        offsets = np.maximum.accumulate((spawn - base) - (cumsum - duration))
+        finish = (np.maximum(offsets, self.busy_until - base) + cumsum) + base
+
+        # the busy periods are refined until the exact finish times agree with them
+        for _ in range(4):
+            previous = np.concatenate(([self.busy_until], finish[:-1]))
+            exact = self._accumulate_busy_periods(spawn, duration, previous)
+            if np.array_equal(exact, finish):
+                return finish, np.maximum(previous - spawn, 0.0)
+            finish = exact
+
+        # the estimates have not converged (should not happen), the recursion is evaluated job by job
+        finish = []
+        last = self.busy_until
+        for s, d in zip(spawn.tolist(), duration.tolist()):
+            last = (last if last > s else s) + d
+            finish.append(last)
+        finish = np.array(finish)
+        previous = np.concatenate(([self.busy_until], finish[:-1]))
+        return finish, np.maximum(previous - spawn, 0.0)
+
+    def _compute_shortest_queue(self, spawn, duration):
+        """Replay dispatching into the shortest active queue, returns finish times, delays, and chosen queues."""
+        queues = self.queues
+        finish = []
+        delays = []
+        targets = []
+        for s, d in zip(spawn.tolist(), duration.tolist()):
+            best = None
+            for idx, queue in enumerate(queues):
+                while queue and queue[0] <= s:
+                    queue.popleft()  # jobs finished before the new one was spawned
+                if best is None or len(queue) < len(queues[best]):
+                    best = idx
+
+            queue = queues[best]
+            start = queue[-1] if queue else s
+            queue.append(start + d)
+            finish.append(start + d)
+            delays.append(start - s)
+            targets.append(best)
+        return np.array(finish), np.array(delays), np.array(targets, dtype=int)
+
+    def _replay_ticks(self, spawn, busy, end_ts=None):
+        """Take the snapshots by the metrics at MAPE-K ticks the same way the simulation does.
+
+        A tick is processed when the time advances to the first job spawned after it (busy holds the max. finish
+        time of the jobs dispatched up to each job), ticks after the last known job wait for the next block
+        unless the end_ts of the simulation is given. The processed ticks are recorded (finished jobs are reported
+        at them).
+        """
+        metrics = self.simulation.metrics
+        while True:
+            ts = self.next_mapek_ts
+            if end_ts is None:
+                next_job = int(np.searchsorted(spawn, ts, side="right"))
+                if next_job >= len(spawn):
+                    return
+                target_ts = float(spawn[next_job])
+                busy_until = float(busy[next_job - 1]) if next_job > 0 else self.busy_until
+            else:
+                if ts >= end_ts:
+                    return
+                target_ts = end_ts
+                busy_until = self.busy_until
+
+            self.ticks.append(ts)
+            if self.simulation.fast_forward and busy_until <= ts:
+                ticks = count_ticks(ts, target_ts, self.period)
+                if ticks >= 2:
+                    for metric in metrics:
+                        metric.fast_forward(ts, ticks, self.period, self.workers)
+                    self.next_mapek_ts = ts + (ticks - 1) * self.period + self.period
+                    continue
+
+            for metric in metrics:
+                metric.snapshot(ts, self.workers)
+            self.next_mapek_ts += self.period
+
+    def _report_finished(self, finish, targets, delays, spawn=None, end_ts=None):
+        """Pass delays of the jobs to the collectors in the same order as the other engines do.
+
+        The simulation reports finished jobs whenever the time advances -- before each job is dispatched (to its
+        spawn time) and at each MAPE-K tick (a tick at the spawn time is processed after the jobs spawned then).
+        A job is reported at the first such step after it was dispatched and finished, the jobs reported at the
+        same step are ordered by workers. Spawn times of the current block (spawn) and the replayed ticks are the
+        known steps; the jobs finished after them are kept pending, unless the simulation ends at end_ts.
+        """
+        sequence = np.arange(self.jobs - len(finish), self.jobs)
+        finish, targets, sequence, delays = [np.concatenate((pending, values)) for pending, values
+                                             in zip(self.pending, (finish, targets, sequence, delays))]
+
+        # the nearest step (time, kind, index of the job spawned at that step) when each job is reported,
+        # the time is infinite if the step is not known yet
+        ticks = np.append(np.array(self.ticks, dtype=float), np.inf)
+        step_ts = ticks[np.searchsorted(ticks[:-1], finish, side="left")]
+        kind = np.ones(len(finish), dtype=int)
+        job_idx = np.zeros(len(finish), dtype=int)
+        if spawn is not None:
+            first = self.jobs - len(spawn)  # sequential number of the first job of the block
+            job_idx = np.minimum(np.maximum(sequence - first + 1, np.searchsorted(spawn, finish, side="left")),
+                                 len(spawn))
+            spawn_ts = np.append(spawn, np.inf)[job_idx]
+            at_spawn = spawn_ts <= step_ts
+            step_ts = np.where(at_spawn, spawn_ts, step_ts)
+            kind[at_spawn] = 0
+        if end_ts is not None:
+            kind[np.isinf(step_ts)] = 2  # the final step of the simulation
+            step_ts = np.where(np.isinf(step_ts), end_ts, step_ts)
+
+        done = np.flatnonzero(np.isfinite(step_ts))
+        order = done[np.lexsort((sequence[done], targets[done], job_idx[done], kind[done], step_ts[done]))]
+        remaining = np.flatnonzero(np.isinf(step_ts))
+        self.pending = [values[remaining] for values in (finish, targets, sequence, delays)]
+
+        delays = delays[order]
+        if len(delays):
+            for metric in self.simulation.metrics:
+                if isinstance(metric, JobDelayMetricsCollector):
+                    metric.add_delays(delays)
+
+    def _process_block(self, spawn, duration):
+        """Compute the jobs of one block and pass the results to the metrics collectors."""
+        if not self.started:
+            self.started = True
+            self.ts = float(spawn[0])
+            self.next_mapek_ts = self.ts + self.period
+            for metric in self.simulation.metrics:
+                metric.snapshot(self.ts, self.workers)
+
+        if len(self.active) == 1:
+            finish, delays = self._compute_single_queue(spawn, duration)
+            targets = np.zeros(len(spawn), dtype=int)
+        else:
+            finish, delays, targets = self._compute_shortest_queue(spawn, duration)
+        self.jobs += len(spawn)
+
+        busy = np.maximum.accumulate(np.maximum(finish, self.busy_until))
+        self.ticks = []
+        self._replay_ticks(spawn, busy)
+        self.busy_until = float(busy[-1])
+        self.ts = float(spawn[-1])
+        self._report_finished(finish, targets, delays, spawn)
+
+    def _flush(self, final=False):
+        """Process buffered jobs in blocks of fixed size (the last block may be shorter if final is set)."""
+        spawn = np.concatenate(self.buffer[0])
+        duration = np.concatenate(self.buffer[1])
+        start = 0
+        while len(spawn) - start >= self.BLOCK_SIZE or (final and start < len(spawn)):
+            end = start + self.BLOCK_SIZE
+            self._process_block(spawn[start:end], duration[start:end])
+            start = end
+        self.buffer = [[spawn[start:]], [duration[start:]]]
+        self.buffered = len(spawn) - start
+
+    def add_jobs(self, jobs):
+        """Add a chunk of jobs (list or JobBatch sorted by spawn_ts) to the simulation."""
+        if len(jobs) == 0:
+            return
+        if not self.active:
+            raise RuntimeError("No active workers available, unable to dispatch job.")
+
+        if isinstance(jobs, JobBatch):
+            self.buffer[0].append(np.asarray(jobs.get_column("spawn_ts"), dtype=float))
+            self.buffer[1].append(np.asarray(jobs.get_column("duration"), dtype=float))
+        else:
+            self.buffer[0].append(np.array([job.spawn_ts for job in jobs], dtype=float))
+            self.buffer[1].append(np.array([job.duration for job in jobs], dtype=float))
+        self.buffered += len(jobs)
+        if self.buffered >= self.BLOCK_SIZE:
+            self._flush()
+
+    def finish(self):
+        """Conclude the simulation (all jobs are finished and the remaining ticks are replayed)."""
+        self._flush(final=True)
+        if not self.started:
+            return
+        end_ts = max(self.ts, self.busy_until) + self.period
+        self.ticks = []
+        self._replay_ticks(None, None, end_ts)
+        self._report_finished(np.zeros(0), np.zeros(0, dtype=int), np.zeros(0), end_ts=end_ts)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+#
+# Capacity planning -- finds the minimal configuration that meets the service level objectives (SLO, see slo.py).
+#
+# The candidates are either worker counts (numbers of active workers; the active items of the workers list are
+# truncated or extended by copies of the last active item, the inactive items are kept) or values of a configuration parameter (addressed by a dotted path as in sweep.py).
+# The candidates are assumed to be ordered by capacity (if a candidate meets the objectives, all the following
+# ones do too), so the minimal one is found by bisection. The runs that violate the objectives are aborted
+# as soon as the violation is certain, which saves most of the time spent on the insufficient configurations.
+#
+#   python3 capacity.py data.csv --config experiments/simple-no-sa-4worker.yaml \
+#       --slo JobDelayMetricsCollector.avg_delay=30 --workers 1 8
+#
+
+import sys
+import copy
+import time
+import argparse
+from main import get_configuration, load_reference_jobs, get_job_fields, simulate
+from sweep import set_parameter
+from dataset_cache import ensure_cache, count_jobs, intern_dataset
+from jobs import JobReader, InternRegistry
+from simulation import Simulation
+from results_cache import ResultCache, get_run_key, get_entry
+
+
+def set_workers(configuration, count):
+    """Set the number of active workers in the configuration.
+
+    Active items of a list are truncated or extended by copies of the last active item, inactive items are kept
+    (they add no capacity unless a SA strategy activates them).
+    """
+    workers = configuration.get("workers", 1)
+    if isinstance(workers, list):
+        is_active = [isinstance(worker, dict) and bool(worker.get("active")) for worker in workers]
+        if not any(is_active):
+            raise RuntimeError("There is no active worker in the configuration (to be used as a template).")
+        template = workers[len(is_active) - 1 - is_active[::-1].index(True)]
+        result = []
+        for worker, active in zip(workers, is_active):
+            if active:
+                if count <= 0:
+                    continue
+                count -= 1
+            result.append(copy.deepcopy(worker))
+        result.extend(copy.deepcopy(template) for _ in range(count))
+        configuration["workers"] = result
+    else:
+        configuration["workers"] = count
+
+
+def get_candidates(base, args):
+    """Generate list of (label, configuration) pairs ordered by capacity."""
+    candidates = []
+    if args.workers:
+        low, high = args.workers
+        for count in range(low, high + 1):
+            configuration = copy.deepcopy(base)
+            set_workers(configuration, count)
+            candidates.append(("workers = {}".format(count), configuration))
+    else:
+        for value in args.values:
+            configuration = copy.deepcopy(base)
+            for path in args.parameter.split(","):
+                set_parameter(configuration, path.strip(), value)
+            candidates.append(("{} = {}".format(args.parameter, value), configuration))
+    return candidates
+
+
+class CapacityPlanner:
+    """Evaluates candidate configurations (with early aborts) and finds the minimal one by bisection."""
+
+    def __init__(self, args, ref_jobs, registry):
+        self.args = args
+        self.ref_jobs = ref_jobs
+        self.registry = registry
+        self.cache = ResultCache(args.result_cache) if args.result_cache else None
+        total_jobs = count_jobs(args.input_file, args.from_ts, args.to_ts)
+        self.total_jobs = min(total_jobs, args.limit) if total_jobs is not None else None
+        self.saved_time = 0.0  # estimated time saved by early aborts
+
+    def _simulate(self, configuration):
+        """Run one simulation, returns the cache entry and the number of jobs read before it finished."""
+        simulation = Simulation(configuration, self.ref_jobs, self.registry)
+        intern_dataset(self.args.input_file, self.registry, get_job_fields([simulation]))
+        if self.total_jobs is not None:
+            simulation.set_total_jobs(self.total_jobs)
+        reader = JobReader(fields=get_job_fields([simulation]), registry=self.registry)
+        reader.open(self.args.input_file, from_ts=self.args.from_ts)
+        jobs = simulate([simulation], reader, self.args.limit, self.args.to_ts)
+        simulation.run(None)
+        reader.close()
+        return get_entry(simulation), jobs
+
+    def evaluate(self, label, configuration):
+        """Run the simulation of a candidate, returns True if it meets the objectives."""
+        key = None
+        entry = None
+        if self.cache:
+            key = get_run_key(configuration, self.args.input_file, self.args.refs, self.args.limit,
+                              self.args.from_ts, self.args.to_ts)
+            entry = self.cache.get(key) if not self.args.refresh else None
+            if entry is not None:
+                print("{}: {} (cached)".format(label, entry.get("slo_violation") or "OK"), file=sys.stderr)
+                return not entry.get("slo_violation")
+
+        start_time = time.perf_counter()
+        entry, jobs = self._simulate(configuration)
+        wall_time = time.perf_counter() - start_time
+        if self.cache:
+            self.cache.put(key, entry)
+
+        violation = entry.get("slo_violation")
+        if violation is None:
+            print("{}: OK ({:.1f} s)".format(label, wall_time), file=sys.stderr)
+            return True
+
+        print("{}: {} after {} jobs ({:.1f} s)".format(label, violation, jobs, wall_time), file=sys.stderr)
+        if self.total_jobs and 0 < jobs < self.total_jobs:
+            # the rest of the run is estimated by the pace of the aborted part
+            self.saved_time += wall_time * (self.total_jobs - jobs) / jobs
+        return False
+
+    def find_minimal(self, candidates):
+        """Bisect the candidates (ordered by capacity), returns index of the first that meets the objectives or None."""
+        low, high = 0, len(candidates) - 1
+        if not self.evaluate(*candidates[high]):
+            return None
+        while low < high:
+            middle = (low + high) // 2
+            if self.evaluate(*candidates[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        return high
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the minimal configuration that meets given SLO.")
+    parser.add_argument("input_file", type=str, help="Path to the input .csv or .csv.gz file with jobs log.")
+    parser.add_argument("--config", type=str, required=True, help="Path to yaml file with the base configuration.")
+    parser.add_argument("--refs", type=str, required=False,
+                        help="Path to .csv or .csv.gz file with log with jobs of reference solutions.")
+    parser.add_argument("--limit", type=int, default=1000000000,
+                        help="Maximal number of jobs to be read from the input file.")
+    parser.add_argument("--from-ts", type=float, required=False,
+                        help="Only jobs spawned at or after this unix timestamp are simulated.")
+    parser.add_argument("--to-ts", type=float, required=False,
+                        help="Only jobs spawned before this unix timestamp are simulated.")
+    parser.add_argument("--slo", type=str, action="append", default=[],
+                        help="Objective in the form CollectorClass.result_key=bound (bound may be given in percents "
+                        "of jobs, e.g., 5%%), added to the objectives of the configuration. The option may be repeated.")
+    parser.add_argument("--workers", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="Range of worker counts to be searched.")
+    parser.add_argument("--parameter", type=str, required=False,
+                        help="Dotted path of the configuration parameter to be searched (see sweep.py).")
+    parser.add_argument("--values", type=float, nargs="+",
+                        help="Values of the parameter ordered by capacity (the last one is the most generous).")
+    parser.add_argument("--result-cache", type=str, required=False,
+                        help="Path to a directory where results of runs are cached (see main.py).")
+    parser.add_argument("--refresh", default=False, action="store_true",
+                        help="If present, cached results are ignored (the simulations are executed again).")
+    args = parser.parse_args()
+    if bool(args.workers) == bool(args.parameter):
+        parser.error("either --workers or --parameter (with --values) must be given")
+    if args.parameter and not args.values:
+        parser.error("--parameter requires --values")
+    if args.workers and not 1 <= args.workers[0] <= args.workers[1]:
+        parser.error("--workers range must be non-empty and start at 1 or more")
+
+    base = get_configuration(args.config)
+    for objective in args.slo:
+        if "=" not in objective:
+            parser.error("--slo must be in the form CollectorClass.result_key=bound")
+        name, bound = objective.split("=", 1)
+        base.setdefault("slo", {})[name.strip()] = bound.strip()
+    if not base.get("slo"):
+        parser.error("no SLO given (use --slo or slo section of the configuration)")
+
+    # the jobs are counted in the cache, so the guards of averages and ratios may abort the runs early
+    for path in [args.input_file, args.refs]:
+        if path and ensure_cache(path):
+            print("Cache of {} was built.".format(path), file=sys.stderr)
+
+    registry = InternRegistry()
+    ref_jobs = load_reference_jobs(args.refs, registry=registry) if args.refs else None
+    candidates = get_candidates(base, args)
+    planner = CapacityPlanner(args, ref_jobs, registry)
+
+    start_time = time.perf_counter()
+    minimal = planner.find_minimal(candidates)
+    if minimal is None:
+        print("No configuration meets the objectives (not even {}).".format(candidates[-1][0]))
+    else:
+        print("Minimal configuration: {}".format(candidates[minimal][0]))
+    print("Total time: {:.1f} s, estimated time saved by early aborts: {:.1f} s".format(
+        time.perf_counter() - start_time, planner.saved_time))
@@ -0,0 +1,77 @@
+#
+# Checkpoints of the simulation state saved on disk.
+#
+# A checkpoint file holds two pickles. The header holds the arguments of the run, the position in the data
+# (number of simulated jobs and the spawn time of the last one), and the ID translation tables (InternRegistry).
+# The state holds the simulations (worker queues and their attributes, dispatchers, strategies, metrics).
+# Injected values (ref. jobs, registry) are not stored in the state, they are replaced by their names
+# (persistent IDs), so the ref. jobs are loaded again when the checkpoint is restored. Components that hold
+# objects which cannot be pickled (e.g., TensorFlow models) must implement __getstate__ and __setstate__.
+#
+
+import io
+import os
+import pickle
+
+CHECKPOINT_VERSION = 3
+
+
+class _StatePickler(pickle.Pickler):
+    """Pickler that replaces injected values by their names."""
+
+    def __init__(self, fp, injections):
+        super().__init__(fp, protocol=pickle.HIGHEST_PROTOCOL)
+        self.injections = [(name, value) for name, value in injections.items() if value is not None]
+
+    def persistent_id(self, obj):
+        for name, value in self.injections:
+            if obj is value:
+                return name
+        return None
+
+
+class _StateUnpickler(pickle.Unpickler):
+    """Unpickler that restores injected values by their names."""
+
+    def __init__(self, fp, injections):
+        super().__init__(fp)
+        self.injections = injections
+
+    def persistent_load(self, pid):
+        if pid not in self.injections:
+            raise RuntimeError("Unknown injected value '{}' in the checkpoint.".format(pid))
+        return self.injections[pid]
+
+
+def dumps_state(state, injections):
+    """Pickle the state into bytes (injected values are replaced by names, see load_state)."""
+    fp = io.BytesIO()
+    _StatePickler(fp, injections).dump(state)
+    return fp.getvalue()
+
+
+def loads_state(data, injections):
+    """Unpickle the state from bytes, injected values are restored from given dict (name -> value)."""
+    return _StateUnpickler(io.BytesIO(data), injections).load()
+
+
+def save_checkpoint(path, header, state, injections):
+    """Save a checkpoint (header is a dict, state is an object where injected values are replaced by names)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fp:
+        pickle.dump(dict(header, version=CHECKPOINT_VERSION), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        _StatePickler(fp, injections).dump(state)
+    os.replace(tmp_path, path)  # an interrupted save does not damage the previous checkpoint
+
+
+def load_checkpoint(path, get_injections):
+    """Load a checkpoint, returns a tuple (header, state).
+
+    The get_injections is a callback that gets the header and returns a dict with values of injected arguments.
+    """
+    with open(path, "rb") as fp:
+        header = pickle.load(fp)
+        if header.get("version") != CHECKPOINT_VERSION:
+            raise RuntimeError("Checkpoint {} has unsupported version.".format(path))
+        state = _StateUnpickler(fp, get_injections(header)).load()
+    return header, state
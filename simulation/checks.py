@@ -0,0 +1,778 @@
+#!/usr/bin/env python3
+
+#
+# Consistency checks executed by CI. The alternative ways of running a simulation must yield the same results
+# as the plain run. Besides the sample data (where nearly all jobs start on time), the simulations are run on
+# a congested variant of the sample (spawn gaps are squeezed), so the queues are long and many jobs finish
+# at the same ticks. Invoke from the simulation directory:
+#
+#   python3 ./checks.py [check ...]   (all checks if none is given)
+#
+# A failed check raises RuntimeError (the script ends with a non-zero exit code). The checks of the NN strategy
+# are skipped if TensorFlow is not installed.
+#
+
+import io
+import os
+import sys
+import json
+import math
+import pickle
+import shutil
+import tempfile
+import argparse
+import contextlib
+import subprocess
+import numpy as np
+from dataclasses import fields, replace
+from main import JobFeeder, get_configuration, get_scenarios, load_reference_jobs, simulate
+from jobs import JobReader, RefJobReader, InternRegistry, JobBatch, RefJob, RefJobStore, JobDurationIndex
+from partitioned import PartitionedSimulation, create_simulation
+from analytic import AnalyticEngine
+from capacity import CapacityPlanner, get_candidates
+from dataset_cache import ensure_cache, intern_dataset
+from metrics.sketch import QuantileSketch
+from interfaces import AbstractMetricsCollector
+
+DATA_DIR = os.path.join("..", "data", "release01-2021-12-29")
+DATA = os.path.join(DATA_DIR, "data-sample.csv")
+REFS = os.path.join(DATA_DIR, "ref-solutions.csv")
+
+NN_SKIPPED = "skipped (TensorFlow is not installed)"
+
+# configurations of the experiments (whether they need ref. jobs)
+EXPERIMENTS = [
+    ("simple-no-sa-1worker", False),
+    ("simple-no-sa-4worker", False),
+    ("simple-self-adaptive", False),
+    ("user_experience-no-sa", True),
+    ("user_experience-oracle", True),
+    ("user_experience", True),
+]
+
+
+def run_main(args, data=DATA):
+    """Run main.py with given arguments (in machine mode), returns the list of printed JSON records."""
+    command = [sys.executable, "main.py", "--machine"] + args + [data]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError("Command {} failed:\n{}".format(" ".join(command), result.stderr))
+    return [json.loads(line) for line in result.stdout.splitlines() if line.strip()]
+
+
+def compare(expected, actual, what, rel_tol=0.0):
+    """Compare results (nested lists and dicts of numbers), numbers may differ by given relative tolerance."""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        if set(expected) != set(actual):
+            raise RuntimeError("{}: keys {} differ from {}".format(what, sorted(actual), sorted(expected)))
+        for key in expected:
+            compare(expected[key], actual[key], "{}.{}".format(what, key), rel_tol)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            raise RuntimeError("{}: {} records instead of {}".format(what, len(actual), len(expected)))
+        for idx, (left, right) in enumerate(zip(expected, actual)):
+            compare(left, right, "{}[{}]".format(what, idx), rel_tol)
+    elif isinstance(expected, float) or isinstance(actual, float):
+        if not math.isclose(expected, actual, rel_tol=rel_tol, abs_tol=rel_tol):
+            raise RuntimeError("{}: {} differs from {}".format(what, actual, expected))
+    elif expected != actual:
+        raise RuntimeError("{}: {} differs from {}".format(what, actual, expected))
+
+
+def simulate_file(configuration, data, refs=None):
+    """Simulate given configuration in this process (without dataset caches), returns the concluded simulation."""
+    registry = InternRegistry()
+    ref_jobs = load_reference_jobs(refs, False, registry) if refs else None
+    simulation = create_simulation(configuration, ref_jobs, registry)
+    reader = JobReader(fields=simulation.get_job_fields(), registry=registry)
+    reader.open(data, False)
+    simulate([simulation], reader)
+    reader.close()
+    simulation.run(None)
+    return simulation
+
+
+def get_results(simulation):
+    return [metric.get_results() for metric in simulation.metrics]
+
+
+def write_configuration(directory, name, configuration):
+    """Save a configuration into a temporary file (JSON is valid YAML), returns its path."""
+    path = os.path.join(directory, name + ".yaml")
+    with open(path, "w") as fp:
+        json.dump(configuration, fp)
+    return path
+
+
+def read_rows(path):
+    """Read a data file (CSV), returns its header line and a list of rows (lists of values)."""
+    with open(path, "r") as fp:
+        header = fp.readline()
+        rows = [line.rstrip("\r\n").split(";") for line in fp if line.strip()]
+    return header, rows
+
+
+def write_rows(path, header, rows):
+    with open(path, "w") as fp:
+        fp.write(header)
+        fp.writelines(";".join(row) + "\n" for row in rows)
+    return path
+
+
+def write_congested(directory, factor=300.0):
+    """Write a congested variant of the sample data (gaps between spawn times are divided by factor and rounded
+    to whole seconds like the original timestamps), returns its path."""
+    header, rows = read_rows(DATA)
+    ts_column = header.rstrip("\r\n").split(";").index("spawn_ts")
+    first_ts = float(rows[0][ts_column])
+    for row in rows:
+        row[ts_column] = repr(float(round(first_ts + (float(row[ts_column]) - first_ts) / factor)))
+    return write_rows(os.path.join(directory, "congested.csv"), header, rows)
+
+
+def check_engines(directory):
+    """The event engine yields the same results as the scan engine (also when many jobs finish at once)."""
+    congested = write_congested(directory)
+    for name, refs in EXPERIMENTS:
+        configuration = get_configuration(os.path.join("experiments", name + ".yaml"))
+        for data in [DATA, congested]:
+            results = {}
+            for engine in ["scan", "event"]:
+                path = write_configuration(directory, "{}-{}".format(name, engine), dict(configuration, engine=engine))
+                results[engine] = run_main(["--config", path] + (["--refs", REFS] if refs else []), data)
+            compare(results["scan"], results["event"], "{} on {} (event engine)".format(name, data))
+
+
+def check_analytic(directory):
+    """The analytic engine yields the same results as the scan engine (regardless of the size of its blocks)."""
+    congested = write_congested(directory)
+    block_size = AnalyticEngine.BLOCK_SIZE
+    for name in ["simple-no-sa-1worker", "simple-no-sa-4worker"]:
+        configuration = get_configuration(os.path.join("experiments", name + ".yaml"))
+        for data in [DATA, congested]:
+            expected = get_results(simulate_file(dict(configuration, engine="scan"), data))
+            for size in [block_size, 100, 7]:
+                AnalyticEngine.BLOCK_SIZE = size  # small blocks leave finished jobs pending across the blocks
+                try:
+                    simulation = simulate_file(dict(configuration, engine="analytic"), data)
+                finally:
+                    AnalyticEngine.BLOCK_SIZE = block_size
+                if simulation.engine != "analytic":
+                    raise RuntimeError("{} is not simulated by the analytic engine.".format(name))
+                compare(expected, get_results(simulation), "{} on {} (analytic engine, blocks of {})".format(
+                    name, data, size))
+
+
+def check_window(directory):
+    """A window selected by --from-ts and --to-ts (using the seek index) is the same as a file with the window only."""
+    for data in [DATA, write_congested(directory)]:
+        header, rows = read_rows(data)
+        ts_column = header.rstrip("\r\n").split(";").index("spawn_ts")
+        from_ts = float(rows[len(rows) // 4][ts_column])
+        to_ts = float(rows[3 * len(rows) // 4][ts_column])
+        window = write_rows(os.path.join(directory, "window.csv"), header,
+                            [row for row in rows if from_ts <= float(row[ts_column]) < to_ts])
+        copy = write_rows(os.path.join(directory, "data.csv"), header, rows)  # seek index is built next to the copy
+
+        for name in ["simple-self-adaptive", "user_experience"]:
+            args = ["--config", os.path.join("experiments", name + ".yaml"), "--refs", REFS, "--no-cache"]
+            expected = run_main(args, window)
+            actual = run_main(args + ["--from-ts", repr(from_ts), "--to-ts", repr(to_ts)], copy)
+            compare(expected, actual, "{} on {} (window)".format(name, data))
+        if not os.path.isfile(copy + ".idx"):
+            raise RuntimeError("Seek index of {} was not built.".format(copy))
+        os.remove(copy + ".idx")
+
+
+def check_scenarios(directory):
+    """Scenarios simulated in one pass yield the same results as separate runs."""
+    scenarios_file = os.path.join("experiments", "simple-scenarios.yaml")
+    for data in [DATA, write_congested(directory)]:
+        records = run_main(["--config", scenarios_file], data)
+        for idx, (name, configuration) in enumerate(get_scenarios([scenarios_file])):
+            path = write_configuration(directory, "scenario-{}".format(idx), configuration)
+            expected = [dict(record, scenario=name) for record in run_main(["--config", path], data)]
+            compare(expected, [record for record in records if record["scenario"] == name],
+                    "{} on {} (scenario)".format(name, data))
+
+        # the simulations share the ref. jobs (each component reads them by its own cursor)
+        configs = [os.path.join("experiments", name + ".yaml") for name, refs in EXPERIMENTS if refs]
+        records = run_main(sum([["--config", config] for config in configs], []) + ["--refs", REFS], data)
+        for config in configs:
+            expected = [dict(record, scenario=config) for record in run_main(["--config", config, "--refs", REFS], data)]
+            compare(expected, [record for record in records if record["scenario"] == config],
+                    "{} on {} (scenario)".format(config, data))
+
+
+def check_checkpoint(directory):
+    """A run resumed from a checkpoint yields the same results as an uninterrupted run."""
+    for data in [DATA, write_congested(directory)]:
+        header, rows = read_rows(data)
+        checkpoint_ts = rows[len(rows) // 2][header.rstrip("\r\n").split(";").index("spawn_ts")]
+        for name, refs in EXPERIMENTS:
+            args = ["--config", os.path.join("experiments", name + ".yaml")] + (["--refs", REFS] if refs else [])
+            expected = run_main(args, data)
+            for point in [["--checkpoint-at-jobs", "400"], ["--checkpoint-at-ts", checkpoint_ts]]:
+                checkpoint = os.path.join(directory, name + ".pkl")
+                what = "{} on {} ({} {})".format(name, data, *point)
+                compare(expected, run_main(args + ["--checkpoint", checkpoint] + point, data), what + " with checkpoint")
+                compare(expected, run_main(["--resume", checkpoint] + (["--refs", REFS] if refs else []), data),
+                        what + " resumed")
+
+
+class FinishedJobsCollector(AbstractMetricsCollector):
+    """Records the order in which the jobs are reported as finished."""
+
+    def __init__(self):
+        self.finished = []
+
+    def job_finished(self, job):
+        self.finished.append([job.solution_id, job.start_ts, job.finish_ts])
+
+    def get_results(self):
+        return {"finished": self.finished}
+
+
+def check_run_batch(directory):
+    """Jobs passed to run_batch (in groups spawned at the same time) yield the same results as run() of each job,
+    the finished jobs are reported in the same order (also the jobs that take no time)."""
+    header, rows = read_rows(write_congested(directory))
+    duration_column = header.rstrip("\r\n").split(";").index("duration")
+    for idx in range(0, len(rows), 5):
+        rows[idx][duration_column] = "0.0"
+    instant = write_rows(os.path.join(directory, "instant.csv"), header, rows)
+
+    for name, refs in EXPERIMENTS:
+        configuration = get_configuration(os.path.join("experiments", name + ".yaml"))
+        for data in [DATA, instant]:
+            for engine in ["scan", "event"]:
+                results = []
+                for batch in [True, False]:
+                    registry = InternRegistry()
+                    ref_jobs = load_reference_jobs(REFS, False, registry) if refs else None
+                    simulation = create_simulation(dict(configuration, engine=engine), ref_jobs, registry)
+                    simulation.register_metrics(FinishedJobsCollector())
+                    reader = JobReader(fields=simulation.get_job_fields(), registry=registry)
+                    reader.open(data, False)
+                    if batch:
+                        simulate([simulation], reader)
+                    else:
+                        for job in reader:
+                            simulation.run(job)
+                    reader.close()
+                    simulation.run(None)
+                    results.append(get_results(simulation))
+                compare(results[1], results[0], "{} on {} ({} engine, run_batch)".format(name, data, engine))
+
+
+def check_fork(directory):
+    """A fork of the simulation may be run forward without affecting the original (copy-on-write queues)."""
+
+    def get_state(simulation):
+        queues = [(worker.jobs[worker.head:], worker.finish_ts[worker.head:], worker.limits_sum,
+                   dict(worker.attributes)) for worker in simulation.workers]
+        jobs = [(job.start_ts, job.finish_ts) for queue in queues for job in queue[0]]
+        return [simulation.ts, simulation.next_mapek_ts, queues, jobs, get_results(simulation)]
+
+    for data in [DATA, write_congested(directory)]:
+        for name in ["simple-no-sa-4worker", "simple-self-adaptive"]:
+            for engine in ["scan", "event"]:
+                configuration = dict(get_configuration(os.path.join("experiments", name + ".yaml")), engine=engine)
+                results = []
+                for forked in [False, True]:
+                    registry = InternRegistry()
+                    simulation = create_simulation(configuration, None, registry)
+                    reader = JobReader(registry=registry)
+                    reader.open(data, False)
+                    feeder = JobFeeder([simulation], reader)
+                    feeder.feed(500)
+                    if forked:
+                        # the fork gets the following jobs (fresh objects) spawned every second, so its queues grow
+                        fork_reader = JobReader(registry=registry)
+                        fork_reader.open(data, False)
+                        jobs = list(fork_reader)[500:700]
+                        fork_reader.close()
+                        state = get_state(simulation)
+                        fork = simulation.fork()
+                        fork.run_batch([replace(job, spawn_ts=simulation.ts + idx + 1.0)
+                                        for idx, job in enumerate(jobs)])
+                        fork.advance(simulation.ts + 100.0)
+                        fork.run(None)
+                        if get_results(fork) == state[-1]:
+                            raise RuntimeError("{} ({} engine): the fork did not simulate any jobs".format(name, engine))
+                        compare(state, get_state(simulation), "{} on {} ({} engine) after fork".format(
+                            name, data, engine))
+                    feeder.feed()
+                    reader.close()
+                    simulation.run(None)
+                    results.append(get_results(simulation))
+                compare(results[0], results[1], "{} on {} ({} engine) forked".format(name, data, engine))
+
+
+def check_slo(directory):
+    """An objective that cannot be met aborts the simulation early, the one that is met does not change the results."""
+    congested = write_congested(directory)
+    ensure_cache(congested)  # the jobs are counted in the cache, so the average delay is bounded early
+    configuration = get_configuration(os.path.join("experiments", "simple-no-sa-1worker.yaml"))
+    for engine in ["scan", "event"]:
+        base = dict(configuration, engine=engine)
+        expected = run_main(["--config", write_configuration(directory, "base", base)], congested)
+        for key in ["avg_delay", "max_delay"]:
+            what = "{} SLO on {} ({} engine)".format(key, congested, engine)
+            slo = {"JobDelayMetricsCollector." + key: 100.0}
+            records = run_main(["--config", write_configuration(directory, "fail", dict(base, slo=slo))], congested)
+            violations = [record["slo_violation"] for record in records if "slo_violation" in record]
+            if len(violations) != 1 or not violations[0].endswith("(at least)"):
+                raise RuntimeError("{}: the violation was not detected before the end ({})".format(what, violations))
+            if records[0]["jobs"] >= expected[0]["jobs"]:
+                raise RuntimeError("{}: the simulation was not aborted early".format(what))
+
+            slo = {"JobDelayMetricsCollector." + key: 1e9}
+            records = run_main(["--config", write_configuration(directory, "pass", dict(base, slo=slo))], congested)
+            compare(expected, records, what + " (met)")
+
+
+def check_capacity(directory):
+    """Capacity planning finds the minimal number of workers that meets the objective (known from all the runs)."""
+    congested = write_congested(directory)
+    ensure_cache(congested)
+    base = dict(get_configuration(os.path.join("experiments", "simple-no-sa-4worker.yaml")), engine="scan")
+    candidates = get_candidates(base, argparse.Namespace(workers=[1, 8]))
+    delays = [get_results(simulate_file(configuration, congested))[0]["avg_delay"] for _, configuration in candidates]
+    if any(left <= right for left, right in zip(delays, delays[1:])):
+        raise RuntimeError("Average delays {} do not decrease with the number of workers.".format(delays))
+
+    # bounds between the delays of consecutive worker counts (and below all of them)
+    bounds = [delays[0] + 1.0] + [(left + right) / 2.0 for left, right in zip(delays, delays[1:])] + [delays[-1] / 2.0]
+    for minimal, bound in enumerate(bounds):
+        args = argparse.Namespace(input_file=congested, refs=None, limit=1000000000, from_ts=None, to_ts=None,
+                                  result_cache=None, refresh=False)
+        planner = CapacityPlanner(args, None, InternRegistry())
+        slo_candidates = [(label, dict(configuration, slo={"JobDelayMetricsCollector.avg_delay": bound}))
+                          for label, configuration in candidates]
+        with contextlib.redirect_stderr(io.StringIO()):
+            found = planner.find_minimal(slo_candidates)
+        expected = minimal if minimal < len(candidates) else None
+        if found != expected:
+            raise RuntimeError("Capacity planning with avg. delay bound {} found {} instead of {}.".format(
+                bound, found, expected))
+
+
+def check_partitions(directory):
+    """Partitions simulated in separate processes yield the same results as the sequential run, and the merged
+    counters are the sums of the runs of the particular partitions."""
+    config = os.path.join("experiments", "simple-partitioned.yaml")
+    configuration = get_configuration(config)
+    for data in [DATA, write_congested(directory)]:
+        header, rows = read_rows(data)
+        copy = write_rows(os.path.join(directory, "data.csv"), header, rows)  # the cache is built next to the copy
+        expected = run_main(["--config", config], copy)
+        compare(expected, run_main(["--config", config, "--partition-processes", "2"], copy),
+                "{} on {} (partition processes)".format(config, data))
+
+        # each partition is simulated alone (as in a pool process)
+        partitions = []
+        for idx in range(len(PartitionedSimulation(configuration).partitions)):
+            registry = InternRegistry()
+            simulation = PartitionedSimulation(configuration, None, registry, partitions=[idx])
+            reader = JobReader(fields=simulation.get_job_fields(), registry=registry)
+            reader.open(data, False)
+            simulate([simulation], reader)
+            reader.close()
+            simulation.simulations[idx].run(None)
+            partitions.append(get_results(simulation.simulations[idx]))
+
+        delays = [results[0] for results in partitions]
+        what = "{} on {} (merged partitions)".format(config, data)
+        compare(sum(delay["jobs"] for delay in delays), expected[0]["jobs"], what + " jobs")
+        total_delay = expected[0]["avg_delay"] * expected[0]["jobs"]
+        compare(total_delay, sum(delay["avg_delay"] * delay["jobs"] for delay in delays), what + " total delay", 1e-12)
+        compare(max(delay["max_delay"] for delay in delays), expected[0]["max_delay"], what + " max delay")
+        compare(sum(results[2]["jobs"] for results in partitions), expected[2]["jobs"], what + " sketch jobs")
+        for results in partitions:
+            for group, counts in results[2]["worker_group_id"].items():
+                compare(counts["jobs"], expected[2]["worker_group_id"][group]["jobs"], what + " jobs of " + group)
+
+
+def import_nn_strategy():
+    """Import the module of the NN strategy, None if TensorFlow is not installed."""
+    try:
+        import tensorflow  # noqa: F401
+    except ImportError:
+        return None
+    from experiments.user_experience_nn import sa_strategy
+    return sa_strategy
+
+
+def create_nn_strategy(nn, layers_widths=[16], batch_epochs=2, domain_sizes=[40, 6], **args):
+    """Create the NN strategy with a small model (without ref. jobs, the training batches are set directly)."""
+    strategy = nn.CategorySelfAdaptingStrategy(layers_widths=layers_widths, batch_size=100, batch_epochs=batch_epochs,
+                                               **args)
+    strategy.domain_sizes = list(domain_sizes)
+    strategy.model = nn._create_model(strategy.layers_widths, strategy.domain_sizes)
+    return strategy
+
+
+def get_nn_columns(seed, count, exercises=40, runtimes=6):
+    random = np.random.RandomState(seed)
+    return {
+        "exercise_id": random.randint(1, exercises, count),
+        "runtime_id": random.randint(1, runtimes, count),
+        "duration": random.exponential(10.0, count),
+        "compilation_ok": np.ones(count, dtype=bool),
+    }
+
+
+def get_nn_predictions(model, jobs):
+    """Predictions of the model for given jobs (computed directly, without memoization)."""
+    pairs = np.array([[job.exercise_id, job.runtime_id] for job in jobs], dtype="int32")
+    return model(pairs, training=False)[:, 0].numpy().tolist()
+
+
+def check_nn_predictor(directory):
+    """Memoized predictions of the NN strategy match the model, also after the model is retrained."""
+    nn = import_nn_strategy()
+    if nn is None:
+        return NN_SKIPPED
+
+    strategy = create_nn_strategy(nn)
+    strategy.predictor = nn.DurationPredictor(strategy)
+    probes = JobBatch(RefJob, get_nn_columns(1, 300, 60, 9))  # some IDs are beyond the domain sizes (table grows)
+    before = [strategy.predictor(job) for job in probes]
+    compare(get_nn_predictions(strategy.model, probes), before, "NN predictions", 1e-5)
+    compare(before, [strategy.predictor(job) for job in probes], "NN predictions (memoized)")
+
+    strategy.buffer = list(JobBatch(RefJob, get_nn_columns(2, 500)))
+    strategy._train_batch(0.0)
+    if strategy.buffer:
+        raise RuntimeError("NN model was not trained on the batch.")
+    after = [strategy.predictor(job) for job in probes]
+    compare(get_nn_predictions(strategy.model, probes), after, "NN predictions after training", 1e-5)
+    if before == after:
+        raise RuntimeError("NN predictions did not change after training.")
+
+
+def check_nn_async(directory):
+    """Weights trained in background are swapped in when due (not sooner) and the memoized predictions follow them."""
+    nn = import_nn_strategy()
+    if nn is None:
+        return NN_SKIPPED
+
+    strategy = create_nn_strategy(nn, async_training=True, swap_delay=120.0)
+    strategy.predictor = nn.DurationPredictor(strategy)
+    initial = nn._get_model_state(strategy.model)
+    strategy.trainer = nn.BackgroundTrainer(strategy.layers_widths, strategy.domain_sizes, strategy.batch_epochs,
+                                            initial)
+    reference = nn._create_model(strategy.layers_widths, strategy.domain_sizes)  # trained synchronously
+    nn._set_model_state(reference, initial)
+
+    probes = JobBatch(RefJob, get_nn_columns(1, 300))
+    before = [strategy.predictor(job) for job in probes]
+    jobs = list(JobBatch(RefJob, get_nn_columns(2, 500)))
+    strategy.buffer = list(jobs)
+    strategy._train_batch(1000.0)
+    x, y = nn._jobs_to_tensors(jobs)
+    reference.fit(x, y, batch_size=len(jobs), epochs=strategy.batch_epochs, verbose=False)
+
+    strategy._swap_weights(1060.0)
+    compare(before, [strategy.predictor(job) for job in probes], "NN predictions before the swap")
+    strategy._swap_weights(1120.0)
+    if strategy.swaps:
+        raise RuntimeError("Weights trained in background were not swapped in when due.")
+    after = [strategy.predictor(job) for job in probes]
+    compare(get_nn_predictions(reference, probes), after, "NN predictions after the swap", 1e-4)
+    if before == after:
+        raise RuntimeError("NN predictions did not change after the swap.")
+
+
+def check_nn_cache(directory):
+    """Cached weights of the initial training are keyed by everything that affects them (and loaded on a hit)."""
+    nn = import_nn_strategy()
+    if nn is None:
+        return NN_SKIPPED
+
+    cache = os.path.join(directory, "weights")
+    columns = get_nn_columns(2, 500)
+    ts = 1000.0
+
+    def get_key(jobs_columns=columns, cutoff_ts=ts, **args):
+        x, y = nn._jobs_to_tensors(list(JobBatch(RefJob, jobs_columns)))
+        return create_nn_strategy(nn, weights_cache=cache, **args)._get_cache_path(cutoff_ts, x, y)
+
+    key = get_key()
+    if get_key() != key:
+        raise RuntimeError("The key of cached NN weights is not stable.")
+    variants = {
+        "layers widths": get_key(layers_widths=[32]),
+        "epochs": get_key(batch_epochs=3),
+        "domain sizes": get_key(domain_sizes=[41, 6]),
+        "cutoff": get_key(cutoff_ts=ts + 60.0),
+        "inputs": get_key(dict(columns, exercise_id=columns["exercise_id"] + 1)),
+        "durations": get_key(dict(columns, duration=columns["duration"] * 2.0)),
+    }
+    for what, other in variants.items():
+        if other == key:
+            raise RuntimeError("The key of cached NN weights does not depend on the {}.".format(what))
+
+    def warm_up(jobs_columns=columns):
+        strategy = create_nn_strategy(nn, weights_cache=cache)
+        strategy.buffer = list(JobBatch(RefJob, jobs_columns))
+        strategy._warm_up(ts)
+        return strategy.model.get_weights(), sorted(os.listdir(cache))
+
+    trained, entries = warm_up()
+    if entries != [os.path.basename(key)]:
+        raise RuntimeError("NN weights were cached as {} instead of {}.".format(entries, key))
+    loaded, entries = warm_up()  # a fresh model is initialized randomly, the weights must come from the cache
+    if len(entries) != 1 or not all(np.array_equal(left, right) for left, right in zip(trained, loaded)):
+        raise RuntimeError("Cached NN weights were not loaded.")
+    _, entries = warm_up(dict(columns, duration=columns["duration"] * 2.0))
+    if len(entries) != 2:
+        raise RuntimeError("NN weights trained on different data were not cached separately.")
+
+
+def check_registry(directory):
+    """IDs of a saved registry are the same when it is loaded, and only a complete registry fixes the domain sizes."""
+    header, rows = read_rows(DATA)
+    data = write_rows(os.path.join(directory, "data.csv"), header, rows)  # no cache yet
+
+    def read_jobs(registry):
+        reader = JobReader(registry=registry)
+        reader.open(data, False)
+        jobs = [[job.exercise_id, job.runtime_id, job.user_id] for job in reader]
+        reader.close()
+        return jobs
+
+    registry = InternRegistry()
+    load_reference_jobs(REFS, False, registry)
+    expected = read_jobs(registry)
+    path = os.path.join(directory, "registry.json")
+    registry.save(path)
+
+    for refs in [False, True]:
+        loaded = InternRegistry()
+        if refs:
+            load_reference_jobs(REFS, False, loaded)  # a subset of the saved IDs (in the same order)
+        loaded.load(path)
+        compare(registry.get_domain_sizes(), loaded.get_domain_sizes(), "loaded registry sizes")
+        compare(expected, read_jobs(loaded), "IDs of loaded registry (refs loaded before: {})".format(refs))
+        loaded.merge(registry)
+        compare(registry.get_domain_sizes(), loaded.get_domain_sizes(), "merged registry sizes")
+
+    conflicting = InternRegistry()
+    conflicting.get_converter("exercise_id")("not-in-the-data")
+    for what, action in [("loaded", lambda: conflicting.load(path)), ("merged", lambda: conflicting.merge(registry))]:
+        try:
+            action()
+        except RuntimeError:
+            continue
+        raise RuntimeError("Registry with conflicting IDs was {} without an error.".format(what))
+
+    # the registry is complete only if all IDs of the data are interned in advance (from the cache)
+    fields = ["exercise_id", "runtime_id"]
+    columns = header.rstrip("\r\n").split(";")
+    incomplete = InternRegistry()
+    read_jobs(incomplete)
+    if incomplete.complete or intern_dataset(data, incomplete, fields) or incomplete.complete:
+        raise RuntimeError("Registry without interned data (no cache) is marked as complete.")
+    ensure_cache(data)
+    complete = InternRegistry()
+    if not intern_dataset(data, complete, fields) or not complete.complete:
+        raise RuntimeError("Registry with interned data is not marked as complete.")
+    for field in fields:
+        compare(len(set(row[columns.index(field)] for row in rows)), complete.get_domain_size(field),
+                "domain size of {}".format(field))
+
+    nn = import_nn_strategy()
+    if nn is not None:
+        # NN inputs fall back to the default sizes unless the registry is complete
+        strategy = nn.CategorySelfAdaptingStrategy(registry=incomplete)
+        compare(strategy.DEFAULT_DOMAIN_SIZES, strategy._get_domain_sizes(), "NN domain sizes (incomplete registry)")
+        strategy = nn.CategorySelfAdaptingStrategy(registry=complete)
+        compare([complete.get_domain_size(field) for field in fields], strategy._get_domain_sizes(),
+                "NN domain sizes (complete registry)")
+
+
+def check_job_batch(directory):
+    """Row views of JobBatch read the same values as Job objects, and their writes land in the batch columns."""
+    congested = write_congested(directory)
+    for data in [DATA, congested]:
+        registry = InternRegistry()
+        reader = JobReader(registry=registry)
+        reader.open(data, False)
+        batch = reader.read_batch()
+        reader.close()
+        reader = JobReader(registry=registry)
+        reader.open(data, False)
+        jobs = list(reader)
+        reader.close()
+        names = batch.view_class.field_names
+        compare([[getattr(job, name) for name in names] for job in jobs],
+                [[getattr(view, name) for name in names] for view in batch], "views of {}".format(data))
+        view = batch[len(batch) // 2]
+        compare([getattr(view, name) for name in names], [getattr(pickle.loads(pickle.dumps(view)), name)
+                                                          for name in names], "pickled view of {}".format(data))
+
+        # basic slices share the columns, index arrays copy them
+        part = batch[10:20]
+        part[3].start_ts, part[3].finish_ts = 1.5, 2.5
+        compare([1.5, 2.5], [float(batch.get_column("start_ts")[13]), float(batch.get_column("finish_ts")[13])],
+                "write through a slice of {}".format(data))
+        copy = batch[np.arange(10, 20)]
+        copy[3].start_ts = 3.5
+        compare(1.5, float(batch.get_column("start_ts")[13]), "write to a copy of {}".format(data))
+
+        # the simulation fills the start and finish times of the views in the columns
+        for name in ["simple-no-sa-4worker", "simple-self-adaptive"]:
+            configuration = dict(get_configuration(os.path.join("experiments", name + ".yaml")), engine="scan")
+            results = []
+            for jobs_sequence in [jobs, batch]:
+                simulation = create_simulation(configuration)
+                simulation.run_batch(jobs_sequence)
+                simulation.run(None)
+                results.append(get_results(simulation))
+            what = "{} on {} (views)".format(name, data)
+            compare(results[0], results[1], what)
+            compare([job.start_ts for job in jobs], batch.get_column("start_ts").tolist(), what + " start_ts")
+            compare([job.finish_ts for job in jobs], batch.get_column("finish_ts").tolist(), what + " finish_ts")
+
+
+def check_ref_jobs(directory):
+    """Cursors of RefJobStore yield the ref. jobs in the order of their completion (the same as a sorted list)."""
+    reader = RefJobReader()
+    reader.open(REFS, False)
+    jobs = list(reader)
+    reader.close()
+    expected = sorted(jobs, key=lambda job: job.spawn_ts + job.duration)  # stable (ties keep the file order)
+    names = [field.name for field in fields(RefJob)]
+
+    random = np.random.RandomState(42)
+    first_ts = expected[0].spawn_ts + expected[0].duration
+    last_ts = expected[-1].spawn_ts + expected[-1].duration
+    for source, store in [("list", RefJobStore(jobs)), ("batch", load_reference_jobs(REFS, False))]:
+        what = "ref. jobs from {}".format(source)
+        compare([[getattr(job, name) for name in names] for job in expected],
+                [[getattr(job, name) for name in names] for job in store.jobs], what)
+
+        # the cursors are independent, each one yields the jobs finished in (previous ts, ts]
+        cursors = [store.cursor(), store.cursor()]
+        ticks = [np.sort(random.uniform(first_ts - 1.0, last_ts + 1.0, count)) for count in [50, 2000]]
+        for cursor, cursor_ticks in zip(cursors, ticks):
+            yielded = []
+            previous = None
+            for ts in cursor_ticks.tolist() + [last_ts]:
+                chunk = cursor.advance(ts)
+                for job in chunk:
+                    completion_ts = job.spawn_ts + job.duration
+                    if completion_ts > ts or (previous is not None and completion_ts <= previous):
+                        raise RuntimeError("{}: job finished at {} was yielded at {}".format(what, completion_ts, ts))
+                yielded.extend(chunk)
+                previous = ts
+            compare([job.solution_id for job in expected], [job.solution_id for job in yielded],
+                    what + " (cursor of {} ticks)".format(len(cursor_ticks)))
+
+        try:
+            store.jobs[0].duration = 0.0
+        except ValueError:
+            continue
+        raise RuntimeError("{}: the store is not read-only".format(what))
+
+
+def check_duration_index(directory):
+    """Bulk updates and vectorized estimates of JobDurationIndex match adding the jobs one by one."""
+    random = np.random.RandomState(42)
+    jobs = JobBatch(RefJob, {
+        "exercise_id": random.randint(1, 40, 5000),
+        "runtime_id": random.randint(1, 6, 5000),
+        "duration": random.exponential(10.0, 5000),
+    })
+    exercise_ids, runtime_ids = random.randint(0, 50, 1000), random.randint(0, 8, 1000)
+    for decay in [None, 0.99]:
+        single, bulk, batch = JobDurationIndex(decay), JobDurationIndex(decay), JobDurationIndex(decay)
+        for job in jobs:
+            single.add(job)
+        bulk.add_many(list(jobs)[:1000])
+        bulk.add_many(list(jobs)[1000:])
+        batch.add_many(jobs)
+
+        # the sums are accumulated in the same order unless the decay is applied in bulk
+        rel_tol = 0.0 if decay is None else 1e-9
+        for index, source in [(bulk, "list"), (batch, "batch")]:
+            estimates = index.estimate_many(exercise_ids, runtime_ids)
+            for exercise_id, runtime_id, estimate in zip(exercise_ids, runtime_ids, estimates):
+                expected = single.estimate_duration(exercise_id, runtime_id)
+                what = "duration index ({}, {}), {}, decay {}".format(exercise_id, runtime_id, source, decay)
+                if expected is None:
+                    if not np.isnan(estimate):
+                        raise RuntimeError("{}: {} is estimated for unknown IDs".format(what, estimate))
+                else:
+                    compare(expected, float(estimate), what, rel_tol)
+                    compare(expected, index.estimate_duration(exercise_id, runtime_id), what, rel_tol)
+
+
+def check_sketch(directory):
+    """Quantile sketches are accurate when they are merged (and the high quantiles when the bins are collapsed)."""
+    random = np.random.RandomState(42)
+    values = np.concatenate([np.zeros(1000), random.lognormal(2.0, 1.5, 50000)])
+    random.shuffle(values)
+    ordered = np.sort(values)
+
+    def check_accuracy(sketch, quantiles, what):
+        for quantile, estimate in zip(quantiles, sketch.get_quantiles(quantiles)):
+            exact = ordered[int(math.floor(quantile * (len(values) - 1)))]
+            if abs(estimate - exact) > sketch.relative_accuracy * exact + 1e-12:
+                raise RuntimeError("{}: quantile {} estimated as {} is not within the accuracy of {}".format(
+                    what, quantile, estimate, exact))
+
+    # the values span about 500 bins, the lowest ones are collapsed in the smaller sketch
+    quantiles = [0.01, 0.5, 0.9, 0.95, 0.99, 0.999]
+    for max_bins, accurate in [(2048, quantiles), (256, [0.95, 0.99, 0.999])]:
+        whole, first, second = [QuantileSketch(max_bins=max_bins) for _ in range(3)]
+        for idx, value in enumerate(values.tolist()):
+            whole.add(value)
+            (first if idx % 2 else second).add(value)
+        first.merge(second)
+        what = "sketch of {} bins".format(max_bins)
+        compare(whole.get_quantiles(quantiles), first.get_quantiles(quantiles), what + " (merged)")
+        check_accuracy(first, accurate, what)
+
+
+CHECKS = {
+    "engines": check_engines,
+    "analytic": check_analytic,
+    "window": check_window,
+    "scenarios": check_scenarios,
+    "checkpoint": check_checkpoint,
+    "run_batch": check_run_batch,
+    "fork": check_fork,
+    "slo": check_slo,
+    "capacity": check_capacity,
+    "partitions": check_partitions,
+    "nn_predictor": check_nn_predictor,
+    "nn_async": check_nn_async,
+    "nn_cache": check_nn_cache,
+    "registry": check_registry,
+    "job_batch": check_job_batch,
+    "ref_jobs": check_ref_jobs,
+    "duration_index": check_duration_index,
+    "sketch": check_sketch,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run consistency checks of the simulator.")
+    parser.add_argument("checks", type=str, nargs="*",
+                        help="Names of the checks to be executed ({}), all if none is given.".format(", ".join(CHECKS)))
+    args = parser.parse_args()
+    for name in args.checks:
+        if name not in CHECKS:
+            parser.error("unknown check '{}'".format(name))
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # paths are relative to the simulation directory
+    for name in args.checks or list(CHECKS):
+        directory = tempfile.mkdtemp()
+        try:
+            skipped = CHECKS[name](directory)  # a check that cannot be executed returns the reason
+        finally:
+            shutil.rmtree(directory)
+        print("{}: {}".format(name, skipped or "OK"))
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+#
+# Binary columnar cache of parsed data files (job logs and ref. solutions).
+#
+# The cache is a directory placed next to the data file (with ".cache" suffix) that holds one NumPy array
+# per column (.npy files that can be memory-mapped) and a meta.json file. The meta file keeps the size,
+# modification time, and hash of the source file (so that outdated caches are detected, the file is hashed only
+# if its modification time has changed, or if the verification is requested explicitly), the type of the reader which parsed the file,
+# vocabularies of string columns (string values are interned into int IDs), and the identifiers translated
+# by the reader (so that the IDs can be remapped into the tables of a shared InternRegistry).
+#
+
+import os
+import sys
+import json
+import gzip
+import hashlib
+import argparse
+import numpy as np
+
+CACHE_VERSION = 2
+
+
+def get_file_hash(path):
+    """Compute SHA1 hash of the contents of given file (hex string)."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        chunk = fp.read(1 << 20)
+        while chunk:
+            h.update(chunk)
+            chunk = fp.read(1 << 20)
+    return h.hexdigest()
+
+
+def get_file_stamp(path):
+    """Cheap identification of the version of given file (size and modification time in ns)."""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def check_source(meta, path, verify=False):
+    """Check whether the meta data (of a cache or an index) were built from the current contents of the file.
+
+    The size and modification time are compared first, the file is hashed only if the modification time differs
+    (e.g., the file was copied) or verify is set. If the hash matches, the stamp in meta is updated (the caller
+    should save the meta data, so the file is not hashed next time).
+    """
+    stamp = get_file_stamp(path)
+    if meta.get("source_stamp") == stamp and not verify:
+        return True
+    if meta.get("source_stamp") is not None and meta["source_stamp"][0] != stamp[0]:
+        return False  # the size has changed
+    if meta.get("source_hash") != get_file_hash(path):
+        return False
+    meta["source_stamp"] = stamp
+    return True
+
+
+def get_cache_path(path):
+    """Path to the cache directory of given data file."""
+    return path + ".cache"
+
+
+def _load_meta(cache_path):
+    meta_file = os.path.join(cache_path, "meta.json")
+    if not os.path.isfile(meta_file):
+        return None
+    with open(meta_file, "r") as fp:
+        return json.load(fp)
+
+
+def get_source_hash(path):
+    """Get hash of the contents of given data file.
+
+    The hash is taken from the meta data of the cache if it is up to date (see check_source),
+    so the file is hashed only if it has no valid cache.
+    """
+    cache_path = get_cache_path(path)
+    meta = _load_meta(cache_path)
+    if meta is not None and meta.get("version") == CACHE_VERSION:
+        stamp = meta.get("source_stamp")
+        if check_source(meta, path):
+            if meta["source_stamp"] != stamp:
+                _save_meta(cache_path, meta)
+            return meta["source_hash"]
+    return get_file_hash(path)
+
+
+def build_cache(path, reader):
+    """Parse given data file by the reader and save all its (converted) columns into the cache.
+
+    The reader must be a fresh (unopened) instance of ReaderBase derived class.
+    Returns the number of rows stored in the cache.
+    """
+    reader.open(path, use_cache=False)
+    names = list(reader.converters)
+    values = {name: [] for name in names}
+    for row in reader.iter_rows():
+        for name in names:
+            values[name].append(row[name])
+    reader.close()
+
+    cache_path = get_cache_path(path)
+    os.makedirs(cache_path, exist_ok=True)
+    meta = {
+        "version": CACHE_VERSION,
+        "source_hash": get_file_hash(path),
+        "source_stamp": get_file_stamp(path),
+        "reader": type(reader).__name__,
+        "rows": len(values[names[0]]) if names else 0,
+        "columns": {},
+    }
+
+    for name in names:
+        column = values[name]
+        desc = {}
+        if column and isinstance(column[0], str):
+            # strings are interned, vocabulary is saved in meta file
+            vocabulary = {}
+            column = [vocabulary.setdefault(value, len(vocabulary)) for value in column]
+            desc["vocabulary"] = list(vocabulary)
+            array = np.array(column, dtype=np.int32)
+        elif column and isinstance(column[0], bool):
+            array = np.array(column, dtype=np.bool_)
+        elif column and isinstance(column[0], int):
+            array = np.array(column, dtype=np.int64)
+        else:
+            array = np.array(column, dtype=np.float64)
+
+        table = getattr(reader.converters[name], "table", None)
+        if table is not None:
+            # IDs were assigned by translation table, identifiers are saved so that the IDs can be remapped
+            desc["interned"] = list(table)
+
+        desc["dtype"] = array.dtype.name
+        meta["columns"][name] = desc
+        np.save(os.path.join(cache_path, name + ".npy"), array)
+
+    # meta file is written last, so an interrupted build does not leave a valid cache behind
+    _save_meta(cache_path, meta)
+    return meta["rows"]
+
+
+def _save_meta(cache_path, meta):
+    tmp_file = os.path.join(cache_path, "meta.json.{}.tmp".format(os.getpid()))
+    with open(tmp_file, "w") as fp:
+        json.dump(meta, fp)
+    os.replace(tmp_file, os.path.join(cache_path, "meta.json"))  # concurrent readers see the old or the new file
+
+
+def load_cache(path, reader, verify=False):
+    """Load (memory-map) cached columns of given data file.
+
+    Returns a tuple (columns, meta) where columns is a dict of NumPy arrays, or None if the cache does not exist
+    or it is outdated (the data file has changed or it was parsed by a different reader). The data file is hashed
+    only if its modification time has changed or verify is set (see check_source).
+    """
+    cache_path = get_cache_path(path)
+    meta = _load_meta(cache_path)
+    if meta is None or meta.get("version") != CACHE_VERSION or meta.get("reader") != type(reader).__name__:
+        return None
+    if set(meta["columns"]) != set(reader.converters):
+        return None
+    stamp = meta.get("source_stamp")
+    if not check_source(meta, path, verify):
+        return None
+    if meta["source_stamp"] != stamp:
+        _save_meta(cache_path, meta)
+
+    columns = {}
+    for name in meta["columns"]:
+        columns[name] = np.load(os.path.join(cache_path, name + ".npy"), mmap_mode='r')
+    return columns, meta
+
+
+def get_reader_for(path, fields=None, registry=None):
+    """Create a reader suitable for given data file (based on the columns in its header)."""
+    from jobs import JobReader, RefJobReader
+    reader = JobReader(fields=fields, registry=registry)
+    fp = gzip.open(path, 'rt') if path.endswith('.gz') else open(path, 'r')
+    header = fp.readline().rstrip("\r\n").split(reader.delimiter)
+    fp.close()
+    if all(col in header for col in reader.converters):
+        return reader
+    return RefJobReader(fields=fields, registry=registry)
+
+
+def count_jobs(path, from_ts=None, to_ts=None):
+    """Count rows of given data file spawned in [from_ts, to_ts) using its cache, None if there is no valid cache."""
+    cached = load_cache(path, get_reader_for(path))
+    if cached is None:
+        return None
+    spawn_ts = cached[0]["spawn_ts"]
+    start = int(np.searchsorted(spawn_ts, from_ts, side="left")) if from_ts is not None else 0
+    end = int(np.searchsorted(spawn_ts, to_ts, side="left")) if to_ts is not None else len(spawn_ts)
+    return max(end - start, 0)
+
+
+def intern_dataset(path, registry, fields=None):
+    """Intern identifiers of all rows of given data file into the registry (only the given fields, None = all).
+
+    The identifiers are taken from the cache (in the same order as the reader interns them), so the domain sizes
+    of the registry become final before the simulation starts (registry.complete is set). Returns False (nothing
+    is interned) if there is no valid cache.
+    """
+    reader = get_reader_for(path, fields, registry)
+    reader.open(path)
+    cached = reader.is_cached()
+    reader.close()
+    if cached:
+        registry.complete = True
+    return cached
+
+
+def ensure_cache(path, verify=False):
+    """Build the cache of given data file unless an up-to-date cache already exists.
+
+    If verify is set, the data file is hashed even if its size and modification time match the cache.
+    Returns True if the cache was built.
+    """
+    reader = get_reader_for(path)
+    if load_cache(path, reader, verify) is not None:
+        return False
+    build_cache(path, get_reader_for(path))
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert data files into binary columnar cache used by readers.")
+    parser.add_argument("input_files", type=str, nargs="+", help="Paths to .csv or .csv.gz data files.")
+    parser.add_argument("--verify", default=False, action="store_true",
+                        help="If present, existing caches are verified by hashing the data files (caches are checked "
+                        "only by file sizes and modification times otherwise) and only the outdated ones are rebuilt.")
+    args = parser.parse_args()
+
+    for input_file in args.input_files:
+        if args.verify:
+            built = ensure_cache(input_file, verify=True)
+            print("{}: cache {}".format(input_file, "was rebuilt" if built else "is up to date"))
+            sys.stdout.flush()
+            continue
+        reader = get_reader_for(input_file)
+        rows = build_cache(input_file, reader)
+        print("{}: {} rows cached in {}".format(input_file, rows, get_cache_path(input_file)))
+        sys.stdout.flush()
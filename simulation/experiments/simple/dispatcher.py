@@ -1,17 +1,18 @@
 from interfaces import AbstractDispatcher
+from workers import WorkerIndex
 
 
 class SimpleDispatcher(AbstractDispatcher):
     """Dispatches new jobs into the shortest active queue."""
 
+    job_fields = set()
+    analytic = True  # the analytic engine computes the shortest queue assignment directly
+
     def init(self, ts, workers):
-        pass
+        self.index = WorkerIndex(workers)
 
     def dispatch(self, job, workers):
-        active_workers = list(filter(lambda w: w.get_attribute("active"), workers))
-        if not active_workers:
+        target = self.index.get_shortest()
+        if target is None:
             raise RuntimeError("No active workers available, unable to dispatch job.")
-
-        active_workers.sort(key=lambda x: x.jobs_count())
-        target = active_workers[0]
         target.enqueue(job)
@@ -1,4 +1,7 @@
+from collections import deque
+from dataclasses import replace
 from interfaces import AbstractSelfAdaptingStrategy
+from metrics.default import JobDelayMetricsCollector
 
 
 class SimpleSelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
@@ -7,6 +10,8 @@ class SimpleSelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
     Activates suspended worker queues when the system gets staturated, deactivates queues that are idle.
     """
 
+    job_fields = set()
+
     def init(self, ts, dispatcher, workers):
         # At the beginning, make only the first worker active
         for worker in workers:
@@ -34,3 +39,66 @@ class SimpleSelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
             empty[0].set_attribute("active", False)  # put idle worker to sleep
         elif inactive and overloaded > 0:
             inactive[0].set_attribute("active", True)  # wake inactive worker
+
+    def fast_forward(self, ts, dispatcher, workers):
+        # all queues are empty, so do_adapt would only deactivate idle workers (until one remains active)
+        active = len(list(filter(lambda w: w.get_attribute("active"), workers)))
+        return active <= 1
+
+
+class LookAheadSelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
+    """SA controller that chooses the number of active workers by simulating the near future.
+
+    At every MAPE-K tick, the jobs spawned in the last horizon (already finished, so their durations are known)
+    are replayed as if they were spawned again in the next horizon. Each possible number of active workers
+    is evaluated in a fork of the simulation and the smallest number that keeps the max. delay under the
+    threshold is selected (all workers are activated if none does).
+    """
+
+    job_fields = {"spawn_ts", "duration"}
+
+    def __init__(self, simulation, horizon=600.0, max_delay=30.0):
+        self.simulation = simulation
+        self.horizon = horizon
+        self.max_delay = max_delay
+        self.recent = deque()  # jobs spawned in the last horizon
+
+    def init(self, ts, dispatcher, workers):
+        for worker in workers:
+            worker.set_attribute("active", False)
+        workers[0].set_attribute("active", True)
+
+    def _get_synthetic_jobs(self, ts):
+        """Recent finished jobs shifted by the horizon (copies, so the forks do not modify the original jobs)."""
+        while self.recent and self.recent[0].spawn_ts < ts - self.horizon:
+            self.recent.popleft()
+        return [replace(job, spawn_ts=job.spawn_ts + self.horizon, start_ts=0.0, finish_ts=0.0)
+                for job in self.recent if 0.0 < job.finish_ts <= ts]
+
+    def _evaluate(self, active, jobs, ts):
+        """Simulate given jobs with the first active workers, returns the max. delay."""
+        delay = JobDelayMetricsCollector()
+        fork = self.simulation.fork(metrics=[delay])
+        for idx, worker in enumerate(fork.workers):
+            worker.set_attribute("active", idx < active)
+        fork.run_batch(jobs)
+        fork.run(None)  # let all the jobs finish
+        return delay.max_delay
+
+    def do_adapt(self, ts, dispatcher, workers, job=None):
+        if job is not None:
+            self.recent.append(job)
+            return
+
+        jobs = self._get_synthetic_jobs(ts)
+        active = len(workers)
+        if not jobs:
+            active = 1
+        else:
+            for count in range(1, len(workers)):
+                if self._evaluate(count, jobs, ts) <= self.max_delay:
+                    active = count
+                    break
+
+        for idx, worker in enumerate(workers):
+            worker.set_attribute("active", idx < active)
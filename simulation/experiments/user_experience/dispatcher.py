@@ -1,14 +1,8 @@
 from interfaces import AbstractDispatcher
+from workers import WorkerIndex
 from jobs import JobDurationIndex
 
 
-def duration_filter(est_duration):
-    def fnc(w):
-        limit = w.get_attribute("limit")
-        return limit is None or limit >= est_duration
-    return fnc
-
-
 class JobCategoryDispatcher(AbstractDispatcher):
     """Dispatcher that tries to improve user experience by placing long jobs in a separate queue.
 
@@ -16,12 +10,14 @@ class JobCategoryDispatcher(AbstractDispatcher):
     (both regular and ref.). The SA strategy is responsible for filling data for the estimator.
     """
 
+    job_fields = {"exercise_id", "runtime_id", "limits"}
+
     def __init__(self):
         # the dispatching algorithm only reads the index, SA strategy is responsible for filling the data
         self.duration_index = JobDurationIndex()
 
     def init(self, ts, workers):
-        pass
+        self.index = WorkerIndex(workers)
 
     def dispatch(self, job, workers):
         # we need to estimate the duration of the job first (! no peeking to job.duration !)
@@ -29,18 +25,11 @@ class JobCategoryDispatcher(AbstractDispatcher):
         if estimate is None:
             estimate = job.limits / 2.0
 
-        # get all workers marked as active
-        active_workers = list(filter(lambda w: w.get_attribute("active"), workers))
-        if not active_workers:
+        # select the shortest active queue where the job would fit (estimate duration is under worker limit),
+        # the index falls back to all active workers if no worker passes the limit
+        target = self.index.get_shortest(estimate)
+        if target is None:
             raise RuntimeError("No active workers available, unable to dispatch job.")
-
-        # select workers where the job would fit (estimate duration is under worker limit)
-        best_workers = list(filter(duration_filter(estimate), active_workers))
-        if len(best_workers) == 0:
-            best_workers = active_workers  # fallback, if no worker passes the limit
-
-        best_workers.sort(key=lambda w: w.jobs_count())
-        target = best_workers[0]
         target.enqueue(job)
 
     def add_ref_job(self, job):
@@ -55,29 +44,24 @@ class OracleJobCategoryDispatcher(AbstractDispatcher):
     predict job durations precisely.
     """
 
+    job_fields = {"duration"}
+
     def __init__(self):
         # the dispatching algorithm only reads the index, SA strategy is responsible for filling the data
         self.duration_index = JobDurationIndex()
 
     def init(self, ts, workers):
-        pass
+        self.index = WorkerIndex(workers)
 
     def dispatch(self, job, workers):
         # the dispatcher is cheating here, the duration would not be available until the job is completed !!!
         estimate = job.duration
 
-        # get all workers marked as active
-        active_workers = list(filter(lambda w: w.get_attribute("active"), workers))
-        if not active_workers:
+        # select the shortest active queue where the job would fit (estimate duration is under worker limit),
+        # the index falls back to all active workers if no worker passes the limit
+        target = self.index.get_shortest(estimate)
+        if target is None:
             raise RuntimeError("No active workers available, unable to dispatch job.")
-
-        # select workers where the job would fit (estimate duration is under worker limit)
-        best_workers = list(filter(duration_filter(estimate), active_workers))
-        if len(best_workers) == 0:
-            best_workers = active_workers  # fallback, if no worker passes the limit
-
-        best_workers.sort(key=lambda w: w.jobs_count())
-        target = best_workers[0]
         target.enqueue(job)
 
     def add_ref_job(self, job):
@@ -9,14 +9,14 @@ class CategorySelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
     of incomming jobs.
     """
 
+    job_fields = {"exercise_id", "runtime_id", "duration", "compilation_ok"}
+
     def __init__(self, max_long_queues, ref_jobs):
         self.max_long_queues = max_long_queues
-        self.ref_jobs = ref_jobs[:]
-        self.ref_jobs.reverse()
+        self.ref_cursor = ref_jobs.cursor()  # ref. jobs are passed to the dispatcher when they are finished
 
     def _update_dispatcher(self, ts, dispatcher):
-        while len(self.ref_jobs) > 0 and self.ref_jobs[-1].spawn_ts + self.ref_jobs[-1].duration <= ts:
-            job = self.ref_jobs.pop()
+        for job in self.ref_cursor.advance(ts):
             if job.compilation_ok:
                 dispatcher.add_ref_job(job)
 
@@ -27,3 +27,8 @@ class CategorySelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
         self._update_dispatcher(ts, dispatcher)
         if (job and job.compilation_ok):
             dispatcher.add_ref_job(job)
+
+    def fast_forward(self, ts, dispatcher, workers):
+        # the periodic calls only pass ref. jobs finished so far to the dispatcher
+        self._update_dispatcher(ts, dispatcher)
+        return True
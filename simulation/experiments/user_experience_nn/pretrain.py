@@ -0,0 +1,84 @@
+#
+# Offline pretraining of the NN model -- performs the initial training of the strategy (on ref. jobs finished
+# before the first simulated job) and stores the state of the model in the weights cache, so the runs of
+# the experiment (e.g., in a sweep over thresholds or queue limits) load the weights instead of training.
+#
+# The simulation is initialized as main.py does it (same ID translation tables, IDs of the whole data are interned
+# from its cache, and the same cutoff), so the cached entry matches the runs. Invoke from the simulation directory:
+#
+#   python3 -m experiments.user_experience_nn.pretrain --config experiments/user_experience_nn.yaml \
+#       --refs ../data/release01-2021-12-29/ref-solutions.csv --weights-cache ./weights \
+#       ../data/release01-2021-12-29/data.csv.gz
+#
+
+import os
+import sys
+import time
+import argparse
+from main import get_configuration, load_reference_jobs
+from dataset_cache import ensure_cache, intern_dataset
+from jobs import JobReader, InternRegistry
+from simulation import Simulation
+
+
+def pretrain(configuration, args):
+    """Initialize the simulation at the first job of the data, returns the spawn time of the job (the cutoff)."""
+    registry = InternRegistry()
+    if args.interning and os.path.isfile(args.interning):
+        registry.load(args.interning)
+    ref_jobs = load_reference_jobs(args.refs, not args.no_cache, registry)
+    simulation = Simulation(configuration, ref_jobs, registry)
+
+    if not args.no_cache:
+        intern_dataset(args.input_file, registry, simulation.get_job_fields())
+
+    reader = JobReader(fields=simulation.get_job_fields(), registry=registry)
+    reader.open(args.input_file, not args.no_cache, args.from_ts)
+    job = next(reader, None)
+    reader.close()
+    if job is None:
+        raise RuntimeError("No jobs to be simulated in {}.".format(args.input_file))
+
+    simulation.start(job.spawn_ts)  # the strategy is initialized (and the weights are cached)
+    return job.spawn_ts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pretrain the NN model on ref. solutions and cache its weights.")
+    parser.add_argument("input_file", type=str,
+                        help="Path to the input .csv or .csv.gz file with jobs log (the first job sets the cutoff).")
+    parser.add_argument("--config", type=str, required=True, help="Path to yaml file with the NN experiment.")
+    parser.add_argument("--refs", type=str, required=True,
+                        help="Path to .csv or .csv.gz file with log with jobs of reference solutions.")
+    parser.add_argument("--weights-cache", type=str, required=False,
+                        help="Path to the directory with cached weights (overrides weights_cache of the strategy).")
+    parser.add_argument("--from-ts", type=float, required=False,
+                        help="The simulation starts with the first job spawned at or after this unix timestamp.")
+    parser.add_argument("--interning", type=str, required=False,
+                        help="Path to .json file with ID translation tables (same as for main.py).")
+    parser.add_argument("--no-cache", default=False, action="store_true",
+                        help="If present, binary caches of data files are not used (same as for main.py).")
+    args = parser.parse_args()
+
+    configuration = get_configuration(args.config)
+    strategy_args = configuration.get("sa_strategy", {}).get("args") if isinstance(
+        configuration.get("sa_strategy"), dict) else None
+    if not isinstance(strategy_args, dict):
+        print("The configuration must specify the NN strategy with named arguments.", file=sys.stderr)
+        exit(1)
+    if args.weights_cache:
+        strategy_args["weights_cache"] = args.weights_cache
+    if not strategy_args.get("weights_cache"):
+        print("No weights cache given (use --weights-cache or weights_cache argument of the strategy).",
+              file=sys.stderr)
+        exit(1)
+
+    # the domain sizes of the model are taken from the cache (see intern_dataset), as in the runs of main.py
+    for path in [args.input_file, args.refs]:
+        if not args.no_cache and ensure_cache(path):
+            print("Cache of {} was built.".format(path), file=sys.stderr)
+
+    start_time = time.perf_counter()
+    cutoff_ts = pretrain(configuration, args)
+    print("Model pretrained on ref. jobs finished before {} in {:.1f} s.".format(
+        cutoff_ts, time.perf_counter() - start_time))
@@ -1,3 +1,8 @@
+import os
+import json
+import pickle
+import hashlib
+import threading
 import tensorflow as tf
 import numpy as np
 from interfaces import AbstractSelfAdaptingStrategy
@@ -7,10 +12,9 @@ def _get_category_encoding_layer(size):
     return lambda feature: tf.one_hot(feature, size + 1)  # +1 since classes are labeled from 1
 
 
-def _prepare_inputs():
+def _prepare_inputs(domain_sizes):
     all_inputs = tf.keras.Input(shape=(2,), dtype='int32')
     encoded_features = []
-    domain_sizes = [1875, 20]
     for idx in range(0, 2):
         encoding_layer = _get_category_encoding_layer(domain_sizes[idx])
         encoded_col = encoding_layer(all_inputs[:, idx])
@@ -19,8 +23,8 @@ def _prepare_inputs():
     return all_inputs, encoded_features
 
 
-def _create_model(layers_widths):
-    all_inputs, encoded_features = _prepare_inputs()
+def _create_model(layers_widths, domain_sizes):
+    all_inputs, encoded_features = _prepare_inputs(domain_sizes)
 
     last_layer = tf.keras.layers.Concatenate()(encoded_features)
     for width in layers_widths:
@@ -34,61 +38,326 @@ def _create_model(layers_widths):
     return model
 
 
+def _get_optimizer_variables(optimizer):
+    variables = optimizer.variables
+    return variables() if callable(variables) else variables  # method in older versions of TensorFlow
+
+
+def _get_model_state(model):
+    """Get weights of the model and the state of its optimizer (as lists of NumPy arrays)."""
+    return {
+        "weights": model.get_weights(),
+        "optimizer": [variable.numpy() for variable in _get_optimizer_variables(model.optimizer)],
+    }
+
+
+def _set_model_state(model, state):
+    """Restore weights of the model and the state of its optimizer."""
+    model.set_weights(state["weights"])
+    if state["optimizer"]:
+        # optimizer variables are created lazily (on the first training step)
+        if hasattr(model.optimizer, "build"):
+            model.optimizer.build(model.trainable_variables)
+        else:
+            model.optimizer._create_all_weights(model.trainable_variables)
+        for variable, value in zip(_get_optimizer_variables(model.optimizer), state["optimizer"]):
+            variable.assign(value)
+
+
 def _jobs_to_tensors(jobs):
     x = list(map(lambda job: [job.exercise_id, job.runtime_id], jobs))
     y = list(map(lambda job: [job.duration], jobs))
     return tf.convert_to_tensor(x, dtype=tf.int32), tf.convert_to_tensor(y, dtype=tf.float32)
 
 
+class DurationPredictor:
+    """Estimates job durations by the model of the strategy (the object is set as predictor of the dispatcher).
+
+    The input space is small (exercise_id x runtime_id), so the predictions are memoized in a dense table.
+    Whenever the model is trained, the table is invalidated and the predictions of all pairs seen so far are
+    recomputed at once (in one batched call) when the next job is dispatched; a pair seen for the first time
+    is predicted on its own. The table grows when IDs beyond its size appear (e.g., IDs beyond the domain sizes
+    of the model, which are encoded as zero vectors, are memoized as well).
+    The compiled prediction function is created lazily, so the predictor can be pickled (in checkpoints).
+    """
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.predict_batch = None
+        self.table = None  # memoized predictions (NaN = not computed yet)
+        self.pairs = []  # (exercise_id, runtime_id) pairs seen so far
+        self.stale = True  # the model was trained since the table was computed
+
+    def __getstate__(self):
+        # the table is recomputed after restoring (only the seen pairs are saved)
+        return {"strategy": self.strategy, "predict_batch": None, "table": None, "pairs": self.pairs, "stale": True}
+
+    def invalidate(self):
+        """Mark memoized predictions as outdated (the model has changed)."""
+        self.stale = True
+
+    def _predict(self, x):
+        if self.predict_batch is None:
+            model = self.strategy.model
+
+            @tf.function(input_signature=[tf.TensorSpec(shape=[None, 2], dtype=tf.int32)])
+            def predict_batch(input):
+                return model(input, training=False)[:, 0]
+
+            self.predict_batch = predict_batch
+        return self.predict_batch(x).numpy()
+
+    def _grow(self, exercise_id, runtime_id):
+        """Enlarge the table so that given IDs fit in (the sizes are at least doubled)."""
+        rows, cols = self.table.shape
+        rows = max(exercise_id + 1, rows * 2) if exercise_id >= rows else rows
+        cols = max(runtime_id + 1, cols * 2) if runtime_id >= cols else cols
+        table = np.full((rows, cols), np.nan, dtype=np.float32)
+        table[:self.table.shape[0], :self.table.shape[1]] = self.table
+        self.table = table
+
+    def _refresh(self):
+        """Recompute the table for all seen pairs."""
+        sizes = self.strategy.domain_sizes
+        shape = [sizes[0] + 1, sizes[1] + 1]
+        if self.pairs:
+            pairs = np.array(self.pairs, dtype='int32')
+            shape = [max(shape[0], int(pairs[:, 0].max()) + 1), max(shape[1], int(pairs[:, 1].max()) + 1)]
+        self.table = np.full(shape, np.nan, dtype=np.float32)
+        if self.pairs:
+            self.table[pairs[:, 0], pairs[:, 1]] = self._predict(pairs)
+        self.stale = False
+
+    def __call__(self, job):
+        if self.stale:
+            self._refresh()
+
+        exercise_id, runtime_id = job.exercise_id, job.runtime_id
+        if exercise_id >= self.table.shape[0] or runtime_id >= self.table.shape[1]:
+            self._grow(exercise_id, runtime_id)
+
+        estimate = self.table[exercise_id, runtime_id]
+        if np.isnan(estimate):
+            estimate = self._predict(np.array([[exercise_id, runtime_id]], dtype='int32'))[0]
+            self.table[exercise_id, runtime_id] = estimate
+            self.pairs.append((exercise_id, runtime_id))
+        return float(estimate)
+
+
+class BackgroundTrainer:
+    """Trains a shadow copy of the model in a background thread.
+
+    The batches are trained one by one in the order of submission; the weights after each batch are kept until
+    they are taken by wait() (which blocks until the batch is trained), so the outcome does not depend on timing.
+    """
+
+    def __init__(self, layers_widths, domain_sizes, epochs, model_state, ready=None):
+        self.model = _create_model(layers_widths, domain_sizes)
+        _set_model_state(self.model, model_state)
+        self.epochs = epochs
+        self.ready = dict(ready or {})  # batch id -> weights of the model after the batch
+        self.queue = []  # submitted batches (id, x, y) that are not trained yet
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                batch_id, x, y = self.queue[0]
+            try:
+                self.model.fit(x, y, batch_size=len(y), epochs=self.epochs, verbose=False)
+                weights = self.model.get_weights()
+            except Exception as e:
+                weights = None
+                self.error = e
+            with self.condition:
+                self.queue.pop(0)
+                self.ready[batch_id] = weights
+                self.condition.notify_all()
+
+    def submit(self, batch_id, x, y):
+        with self.condition:
+            self.queue.append((batch_id, x, y))
+            self.condition.notify_all()
+
+    def wait(self, batch_id):
+        """Wait until given batch is trained, returns the weights of the model after that batch."""
+        with self.condition:
+            while batch_id not in self.ready:
+                self.condition.wait()
+            weights = self.ready.pop(batch_id)
+        if weights is None:
+            raise RuntimeError("Background training of the model failed: {}".format(self.error))
+        return weights
+
+    def get_state(self):
+        """Wait until all submitted batches are trained, returns the state for pickling (see __init__ args)."""
+        with self.condition:
+            while self.queue:
+                self.condition.wait()
+            return {"model_state": _get_model_state(self.model), "ready": dict(self.ready)}
+
+
 class CategorySelfAdaptingStrategy(AbstractSelfAdaptingStrategy):
     """Uses machine-learning neural-network regression model to predict the job duration.
 
     The model is trained in SA and used by dispatcher (via estimation function interface).
     The model is implemented in TensorFlow.
+
+    With async_training, the batches (except for the initial one) are trained by a shadow model in a background
+    thread and the simulation continues meanwhile. The weights trained on a batch are swapped into the model
+    used for predictions at the first MAPE-K tick that is at least swap_delay seconds (simulation time) after
+    the batch was submitted (the simulation waits for the training if necessary), so the results are reproducible.
+
+    If weights_cache (a directory) is given, the state of the model after the initial training (on ref. jobs
+    finished before the simulation starts) is cached there and loaded instead of training in subsequent runs
+    (see pretrain.py). The entries are keyed by the layers widths, number of epochs, domain sizes, the cutoff
+    timestamp, and a hash of the training data.
     """
 
-    def __init__(self, layers_widths=[64], batch_size=5000, batch_epochs=5, ref_jobs=None):
-        tf.config.threading.set_inter_op_parallelism_threads(8)
-        tf.config.threading.set_intra_op_parallelism_threads(8)
-        # tf.config.set_visible_devices([], 'GPU')
+    job_fields = {"exercise_id", "runtime_id", "duration", "compilation_ok"}
+
+    # sizes of exercise_id and runtime_id domains used when the IDs of the data are not known in advance
+    # (no registry is given or the data file has no cache, see intern_dataset in dataset_cache.py)
+    DEFAULT_DOMAIN_SIZES = [1875, 20]
 
+    def __init__(self, layers_widths=[64], batch_size=5000, batch_epochs=5, ref_jobs=None, registry=None,
+                 async_training=False, swap_delay=0.0, weights_cache=None):
+        self._configure_tf()
         self.layers_widths = layers_widths
         self.batch_size = batch_size
         self.batch_epochs = batch_epochs
-        self.ref_jobs = ref_jobs[:] if ref_jobs else None
+        self.async_training = async_training
+        self.swap_delay = swap_delay
+        self.weights_cache = weights_cache
+        self.trainer = None  # background trainer of the shadow model (async training)
+        self.batches = 0  # number of batches submitted to the trainer
+        self.swaps = []  # (ts, batch id) of the trained weights that are not swapped in yet
+        self.ref_cursor = ref_jobs.cursor() if ref_jobs is not None else None
+        self.registry = registry
         self.buffer = []
+        self.domain_sizes = None  # sizes of one-hot encoded inputs (fixed when the model is created)
         self.model = None
+        self.predictor = None
+
+    @staticmethod
+    def _configure_tf():
+        tf.config.threading.set_inter_op_parallelism_threads(8)
+        tf.config.threading.set_intra_op_parallelism_threads(8)
+        # tf.config.set_visible_devices([], 'GPU')
+
+    def __getstate__(self):
+        # Keras model cannot be pickled directly, its weights (and optimizer state) are saved instead
+        state = self.__dict__.copy()
+        state["model"] = _get_model_state(self.model) if self.model is not None else None
+        state["trainer"] = self.trainer.get_state() if self.trainer is not None else None
+        return state
+
+    def __setstate__(self, state):
+        self._configure_tf()
+        model_state = state["model"]
+        trainer_state = state["trainer"]
+        self.__dict__.update(state)
+        if model_state is not None:
+            self.model = _create_model(self.layers_widths, self.domain_sizes)
+            _set_model_state(self.model, model_state)
+        if trainer_state is not None:
+            self.trainer = BackgroundTrainer(self.layers_widths, self.domain_sizes, self.batch_epochs, **trainer_state)
 
     def _advance_ts(self, ts):
-        while len(self.ref_jobs) > 0 and self.ref_jobs[-1].spawn_ts + self.ref_jobs[-1].duration <= ts:
-            job = self.ref_jobs.pop()
-            if job.compilation_ok:
-                self.buffer.append(job)
+        if self.ref_cursor is not None:
+            self.buffer.extend(job for job in self.ref_cursor.advance(ts) if job.compilation_ok)
 
-    def _train_batch(self):
+    def _train_batch(self, ts):
         """Take the job buffer and use it as batch for training."""
         if len(self.buffer) > self.batch_size:
             x, y = _jobs_to_tensors(self.buffer)
-            self.model.fit(x, y, batch_size=len(self.buffer), epochs=self.batch_epochs, verbose=False)
+            if self.trainer is not None:
+                self.trainer.submit(self.batches, x, y)
+                self.swaps.append((ts + self.swap_delay, self.batches))
+                self.batches += 1
+            else:
+                self.model.fit(x, y, batch_size=len(self.buffer), epochs=self.batch_epochs, verbose=False)
+                if self.predictor is not None:
+                    self.predictor.invalidate()
             self.buffer = []  # reset the job buffer at the end
 
-    def init(self, ts, dispatcher, workers):
-        self.model = _create_model(self.layers_widths)
-        self._advance_ts(ts)
-        self._train_batch()
+    def _get_cache_path(self, ts, x, y):
+        """Path to the cached state of the model after the initial training on given data."""
+        h = hashlib.sha1()
+        h.update(json.dumps({
+            "layers_widths": [int(width) for width in self.layers_widths],
+            "batch_epochs": self.batch_epochs,
+            "domain_sizes": [int(size) for size in self.domain_sizes],
+            "cutoff_ts": ts,
+        }, sort_keys=True).encode("utf-8"))
+        h.update(x.numpy().tobytes())
+        h.update(y.numpy().tobytes())
+        return os.path.join(self.weights_cache, h.hexdigest() + ".pkl")
+
+    def _warm_up(self, ts):
+        """Initial training on the ref. jobs finished before ts (the state is taken from the cache if possible)."""
+        if self.weights_cache is None or len(self.buffer) <= self.batch_size:
+            self._train_batch(ts)
+            return
+
+        x, y = _jobs_to_tensors(self.buffer)
+        path = self._get_cache_path(ts, x, y)
+        if os.path.isfile(path):
+            with open(path, "rb") as fp:
+                _set_model_state(self.model, pickle.load(fp))
+            self.buffer = []
+            return
 
-        @tf.function
-        def predict_single(input):
-            return self.model(input, training=False)[0]
+        self._train_batch(ts)
+        os.makedirs(self.weights_cache, exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as fp:
+            pickle.dump(_get_model_state(self.model), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # concurrent runs (e.g., in a sweep) may share the cache
 
-        def predictor(job):
-            x = np.array([[job.exercise_id, job.runtime_id]], dtype='int32')
-            return predict_single(x).numpy()[0]
+    def _swap_weights(self, ts):
+        """Swap in the weights trained in background that are due at ts."""
+        while self.swaps and self.swaps[0][0] <= ts:
+            _, batch_id = self.swaps.pop(0)
+            self.model.set_weights(self.trainer.wait(batch_id))
+            self.predictor.invalidate()
 
-        dispatcher.set_predictor(predictor)
+    def _get_domain_sizes(self):
+        """Sizes of one-hot encoded inputs are taken from the registry if it holds all IDs of the data.
+
+        Otherwise, the IDs are interned as the jobs are read (the registry would hold only the IDs read so far),
+        so the fixed sizes are used (IDs beyond them are encoded as zero vectors).
+        """
+        if self.registry is None or not self.registry.complete:
+            return self.DEFAULT_DOMAIN_SIZES
+        return [self.registry.get_domain_size("exercise_id"), self.registry.get_domain_size("runtime_id")]
+
+    def init(self, ts, dispatcher, workers):
+        self.domain_sizes = self._get_domain_sizes()
+        self.model = _create_model(self.layers_widths, self.domain_sizes)
+        self._advance_ts(ts)
+        self._warm_up(ts)  # the initial batch is always trained synchronously
+        self.predictor = DurationPredictor(self)
+        dispatcher.set_predictor(self.predictor)
+        if self.async_training:
+            self.trainer = BackgroundTrainer(self.layers_widths, self.domain_sizes, self.batch_epochs,
+                                             _get_model_state(self.model))
 
     def do_adapt(self, ts, dispatcher, workers, job=None):
         self._advance_ts(ts)
+        if job is None and self.swaps:
+            self._swap_weights(ts)  # MAPE-K tick
         if job and job.compilation_ok:
             self.buffer.append(job)
-            self._train_batch()
+            self._train_batch(ts)
+
+    def fast_forward(self, ts, dispatcher, workers):
+        # the periodic calls only collect finished ref. jobs and swap weights (training is triggered by regular jobs)
+        self._advance_ts(ts)
+        self._swap_weights(ts)
+        return True
@@ -2,6 +2,10 @@
 # Base classes for important components and helper functions for dynamic loading and instantiation of their implementations.
 #
 
+import copy
+import json
+
+
 class AbstractMetricsCollector:
     """Base class for all metrics collectors.
 
@@ -9,12 +13,56 @@ class AbstractMetricsCollector:
     The job_finished() is invoked for every job after it is removed from the queue.
     """
 
+    # names of job fields the collector reads (None = all fields), other fields need not be loaded from the data
+    job_fields = None
+
     def snapshot(self, ts, workers):
         pass  # an empty placeholder that just declares the interface
 
     def job_finished(self, job):
         pass  # an empty placeholder that just declares the interface
 
+    def fast_forward(self, ts_from, ticks, period, workers):
+        """Replace a series of periodic snapshots (ts_from + i * period for i in range(ticks)) at once.
+
+        It is invoked when the simulation skips an idle span (all queues are empty and no job arrives).
+        The default implementation takes the snapshots one by one, collectors with cheaper (analytic)
+        means of accumulating the span should override it.
+        """
+        if type(self).snapshot is AbstractMetricsCollector.snapshot:
+            return  # snapshots are not collected, nothing to replay
+        for i in range(ticks):
+            self.snapshot(ts_from + i * period, workers)
+
+    def fork(self):
+        """Create a copy of the collector for a forked simulation (see Simulation.fork).
+
+        The default implementation makes a deep copy, collectors with large state may override it.
+        """
+        return copy.deepcopy(self)
+
+    def merge(self, other):
+        """Merge measurements of another collector of the same type (e.g., from an independent partition
+        of the simulation that ran over the same time span) into this one.
+        """
+        raise RuntimeError("Metrics collector {} does not support merging.".format(type(self).__name__))
+
+    def get_results(self):
+        """Return the measured values as a dict (name -> number) for further (machine) processing.
+
+        The machine-readable output of print() is derived from these values (see format_results).
+        """
+        return {}
+
+    def get_lower_bounds(self, total_jobs=None):
+        """Return lower bounds of the final results (a subset of get_results() keys) that hold regardless of the jobs
+        that are yet to come (used by SLO guards to abort the simulation early, see slo.py).
+
+        The total_jobs is the number of jobs of the whole simulation (None if unknown).
+        By default, nothing is known before the simulation ends.
+        """
+        return {}
+
     def print(self, machine=False, verbose=False):
         """Print the metrics to std. output.
 
@@ -31,6 +79,14 @@ class AbstractDispatcher:
     Dispatcher itslef runs a fixed algorithm, but its behavior may be altered in MAPE-K loop.
     """
 
+    # names of job fields the dispatcher reads (None = all fields), other fields need not be loaded from the data
+    job_fields = None
+
+    # True if the dispatcher always places a job into the shortest active queue (ties are broken the same way
+    # as by SimpleDispatcher), so the analytic engine may compute it; the flag is not inherited (a derived class
+    # that changes the behavior must not be computed analytically), see AnalyticEngine.is_supported
+    analytic = False
+
     def init(self, ts, workers):
         """Initialize the dispathcher before the first job."""
         pass
@@ -39,6 +95,26 @@ class AbstractDispatcher:
         """Assign given job to one of the workers."""
         raise NotImplementedError
 
+    def fork(self, ts, workers):
+        """Create a copy of the dispatcher for a forked simulation (see Simulation.fork) with given (forked) workers.
+
+        The default implementation makes a shallow copy (data of the dispatcher are shared with the original)
+        and invokes init() on it, so that the structures bound to the workers are rebuilt.
+        """
+        clone = copy.copy(self)
+        clone.init(ts, workers)
+        return clone
+
+    def dispatch_batch(self, jobs, workers):
+        """Assign a group of jobs spawned at the same time to the workers.
+
+        The default implementation dispatches the jobs one by one. The simulation passes the whole group only
+        if this method is overridden (and so is the do_adapt_batch() of the SA strategy, if present); in that case,
+        jobs of the group that take no time are not removed from the queues until the whole group is dispatched.
+        """
+        for job in jobs:
+            self.dispatch(job, workers)
+
 
 class AbstractSelfAdaptingStrategy:
     """Represents the controller used for self-adaptation of the system.
@@ -47,6 +123,9 @@ class AbstractSelfAdaptingStrategy:
     and for adaptation (modifying the system configuration).
     """
 
+    # names of job fields the strategy reads (None = all fields), other fields need not be loaded from the data
+    job_fields = None
+
     def init(self, ts, dispatcher, workers):
         """Called once when the simulation starts."""
         pass
@@ -63,6 +142,40 @@ class AbstractSelfAdaptingStrategy:
         """
         raise NotImplementedError
 
+    def fast_forward(self, ts, dispatcher, workers):
+        """Replace all periodic do_adapt() calls up to ts (inclusive) while the system is idle.
+
+        The method is called only when all queues are empty and no job arrives before ts.
+        It returns True if the strategy has handled the span so that the outcome is the same as if do_adapt()
+        was invoked periodically and it does not alter the workers (their state must remain constant).
+        If False is returned, nothing may be modified and the simulation proceeds in regular periodic steps.
+        """
+        return False  # conservative default, the simulation needs to invoke do_adapt periodically
+
+    def do_adapt_batch(self, ts, dispatcher, workers, jobs):
+        """Batch variant of do_adapt() invoked for a group of jobs spawned at the same time (ts).
+
+        The default implementation calls do_adapt() for each job. The simulation uses the batch variant only
+        if it is overridden (and so is the dispatch_batch() of the dispatcher); in that case, the strategy sees
+        the whole group before any of its jobs is dispatched.
+        """
+        for job in jobs:
+            self.do_adapt(ts, dispatcher, workers, job)
+
+
+def format_results(results):
+    """Format results of a metrics collector (dict returned by get_results) into a machine-readable line (JSON)."""
+    return json.dumps(results)
+
+
+def get_component_module(class_name):
+    """Import the module that holds the component of given (fully qualified) class name."""
+    components = class_name.split('.')
+    module = __import__('.'.join(components[:-1]))
+    for component in components[1:-1]:
+        module = getattr(module, component)
+    return module
+
 
 def create_component(class_name, constructor_args={}):
     """Create an instance of a component of given name.
@@ -71,11 +184,8 @@ def create_component(class_name, constructor_args={}):
     class_name - fully qualified name of the class (module.submodule.classname)
     constructor_args - optional dict or list with args passed to constructor
     """
-    components = class_name.split('.')
-    module = __import__('.'.join(components[:-1]))
-    for component in components[1:]:
-        module = getattr(module, component)
-    class_ = module
+    module = get_component_module(class_name)
+    class_ = getattr(module, class_name.split('.')[-1])
     if class_ is None:
         raise RuntimeError("Class {} not found.".format(class_name))
 
@@ -1,8 +1,43 @@
 import csv
+import json
 import gzip
-from dataclasses import dataclass
-
-
+import operator
+import time
+import queue
+import threading
+import multiprocessing
+from dataclasses import dataclass, fields
+import numpy as np
+from dataset_cache import load_cache
+from seek_index import load_index, open_at
+
+
+def _slotted(cls):
+    """Recreate a dataclass with __slots__ (instances have no __dict__, which saves memory and speeds up access).
+
+    This is what dataclass(slots=True) does in newer Pythons (the class has to be recreated since slots
+    conflict with class attributes that hold default values of the fields).
+    """
+    cls_dict = dict(cls.__dict__)
+    names = tuple(f.name for f in fields(cls))
+    cls_dict["__slots__"] = names
+    for name in names:
+        cls_dict.pop(name, None)  # remove default values (they are already in the generated __init__)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+def _enqueue_job(job, prev_job=None):
+    """Update start and finish times when the job is placed in a queue."""
+    if prev_job is None:
+        job.start_ts = job.spawn_ts  # job starts immediately as spawned
+    else:
+        job.start_ts = prev_job.finish_ts  # job starts right after previous job ends
+    job.finish_ts = job.start_ts + job.duration
+
+
+@_slotted
 @dataclass
 class Job:
     """Structure represenitng one job submitted to the system."""
@@ -29,15 +64,10 @@ class Job:
     start_ts: float = 0.0  # when the processing of the job actually started (simulation time)
     finish_ts: float = 0.0  # when the processing ended (start_ts + duration by default)
 
-    def enqueue(self, prev_job=None):
-        """Update start and finish times when the job is placed in a queue."""
-        if prev_job is None:
-            self.start_ts = self.spawn_ts  # job starts immediately as spawned
-        else:
-            self.start_ts = prev_job.finish_ts  # job starts right after previous job ends
-        self.finish_ts = self.start_ts + self.duration
+    enqueue = _enqueue_job
 
 
+@_slotted
 @dataclass
 class RefJob:
     """Structure representing a reference solution job.
@@ -59,6 +89,187 @@ class RefJob:
     duration: float  # how long the job took (according to logs)
 
 
+#
+# Columnar representation of jobs
+#
+
+
+class JobBatch:
+    """Struct-of-arrays representation of a sequence of jobs (or ref. jobs).
+
+    Each field is held in one NumPy array (strings in object arrays, fields that were not loaded are None).
+    The batch behaves like a read-only sequence -- indexing by int yields a lightweight row view that has the same
+    attributes as the corresponding item class (Job or RefJob), indexing by slice (or an index/mask array) yields
+    another batch (basic slices share the data). The start_ts and finish_ts fields of row views are writable,
+    so the views may be placed in worker queues instead of Job objects.
+    """
+
+    def __init__(self, item_class, columns):
+        self.item_class = item_class
+        self.columns = columns
+        self.length = 0
+        for column in columns.values():
+            if column is not None:
+                self.length = len(column)
+                break
+
+        self.view_class = _get_view_class(item_class)
+        if "start_ts" in self.view_class.field_names:
+            # extra fields filled by the simulation are always allocated
+            for name in ("start_ts", "finish_ts"):
+                if self.columns.get(name) is None:
+                    self.columns[name] = np.zeros(self.length)
+
+    @staticmethod
+    def from_jobs(item_class, jobs):
+        """Create a batch from a list of job objects (of given item class)."""
+        columns = {}
+        for field in fields(item_class):
+            columns[field.name] = _make_column(field, [getattr(job, field.name) for job in jobs])
+        return JobBatch(item_class, columns)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["view_class"]  # classes of views are created dynamically (cannot be pickled)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.view_class = _get_view_class(self.item_class)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += self.length
+            if key < 0 or key >= self.length:
+                raise IndexError("Job batch index out of range.")
+            return self.view_class(self, int(key))
+
+        return JobBatch(self.item_class, {name: (column[key] if column is not None else None)
+                                          for name, column in self.columns.items()})
+
+    def __iter__(self):
+        view_class = self.view_class
+        for idx in range(self.length):
+            yield view_class(self, idx)
+
+    def get_column(self, name):
+        """Get the NumPy array of given field (None if the field was not loaded)."""
+        return self.columns[name]
+
+    def to_jobs(self):
+        """Convert the batch into a list of job objects (of the item class)."""
+        names = [field.name for field in fields(self.item_class)]
+        values = [self.columns[name].tolist() if self.columns[name] is not None else [None] * self.length
+                  for name in names]
+        return [self.item_class(*row) for row in zip(*values)]
+
+
+def _make_column(field, values):
+    """Create a NumPy array of values of given (dataclass) field, None is returned if the field was not loaded."""
+    if values and values[0] is None:
+        return None
+    if field.type is str:
+        return np.array(values, dtype=object)
+    return np.array(values, dtype=field.type)
+
+
+def _make_view_property(name):
+    def getter(self):
+        column = self.batch.columns[name]
+        return column.item(self.index) if column is not None else None
+
+    def setter(self, value):
+        self.batch.columns[name][self.index] = value
+
+    return property(getter, setter)
+
+
+_view_classes = {}
+
+
+def _get_view_class(item_class):
+    """Get (create) a class of row views of JobBatch holding items of given class."""
+    if item_class not in _view_classes:
+        field_names = tuple(field.name for field in fields(item_class))
+        attrs = {name: _make_view_property(name) for name in field_names}
+        attrs["__slots__"] = ("batch", "index")
+        attrs["field_names"] = field_names
+        attrs["__init__"] = _view_init
+        attrs["__repr__"] = _view_repr
+        attrs["__reduce__"] = _view_reduce
+        if "start_ts" in field_names:
+            attrs["enqueue"] = _enqueue_job
+        _view_classes[item_class] = type(item_class.__name__ + "View", (), attrs)
+    return _view_classes[item_class]
+
+
+def _view_init(self, batch, index):
+    self.batch = batch
+    self.index = index
+
+
+def _view_reduce(self):
+    # view classes are created dynamically, so a pickled view is recreated by indexing the (pickled) batch
+    return (operator.getitem, (self.batch, self.index))
+
+
+def _view_repr(self):
+    return "{}({})".format(type(self).__name__, ", ".join(
+        "{}={!r}".format(name, getattr(self, name)) for name in self.field_names))
+
+
+class RefJobStore:
+    """Read-only columnar store of ref. jobs sorted by their completion time (spawn_ts + duration).
+
+    The store is loaded once and shared by all components (it is injected as @@ref_jobs). The components do not
+    copy the ref. jobs, they read them by cursors (see cursor()) that yield the jobs finished up to given time
+    as slices of the store (JobBatch views of the sorted columns). The whole sorted batch is available as jobs.
+    """
+
+    def __init__(self, jobs):
+        if not isinstance(jobs, JobBatch):
+            jobs = JobBatch.from_jobs(RefJob, list(jobs))
+        completion_ts = jobs.get_column("spawn_ts") + jobs.get_column("duration")
+        if len(completion_ts) and np.any(completion_ts[1:] < completion_ts[:-1]):
+            order = np.argsort(completion_ts, kind="stable")  # jobs finished at the same time keep their order
+            jobs = jobs[order]
+            completion_ts = completion_ts[order]
+
+        for column in list(jobs.columns.values()) + [completion_ts]:
+            if column is not None:
+                column.setflags(write=False)
+        self.jobs = jobs
+        self.completion_ts = completion_ts
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def cursor(self):
+        """Create a new cursor positioned at the beginning of the store."""
+        return RefJobCursor(self)
+
+
+class RefJobCursor:
+    """Position of one consumer in RefJobStore (the cursor only moves forward)."""
+
+    def __init__(self, store):
+        self.store = store
+        self.position = 0  # index of the first job that was not yielded yet
+
+    def advance(self, ts):
+        """Move the cursor to ts, returns a JobBatch (slice of the store) of jobs finished since the last call."""
+        end = int(np.searchsorted(self.store.completion_ts, ts, side="right"))
+        start = self.position
+        if end <= start:
+            return self.store.jobs[start:start]
+        self.position = end
+        return self.store.jobs[start:end]
+
+
 #
 # Input reader and its helper classes
 #
@@ -109,59 +320,294 @@ class HashConverter:
 
         return self.table[value]
 
+    def remap(self, values):
+        """Translate a list of identifiers (values of IDs 1, 2, ... assigned elsewhere) into IDs of this converter.
+
+        Returns a NumPy array, where the item at index i holds translation of ID i (item 0 is not used).
+        """
+        return np.array([0] + [self(value) for value in values], dtype=np.int64)
+
+
+class InternRegistry:
+    """Registry of ID translation tables (HashConverters) shared by readers.
+
+    Each domain (e.g., "exercise_id") has its own table. When the job reader and the ref. job reader share
+    the registry, the same identifier gets the same int ID in both Job and RefJob objects. The tables may be
+    saved and loaded, so the IDs remain stable across runs and processes.
+    The complete flag is set when all identifiers of the simulated data were interned in advance
+    (see intern_dataset in dataset_cache.py), so the domain sizes do not grow during the simulation.
+    """
+
+    def __init__(self):
+        self.domains = {}
+        self.complete = False
+
+    def get_converter(self, domain):
+        """Get translation table (HashConverter) of given domain (it is created if necessary)."""
+        if domain not in self.domains:
+            self.domains[domain] = HashConverter()
+        return self.domains[domain]
+
+    def get_domain_size(self, domain):
+        """Number of IDs in given domain (IDs are assigned from 1, so it is also the highest assigned ID)."""
+        return self.domains[domain].counter if domain in self.domains else 0
+
+    def get_domain_sizes(self):
+        """Return a dict with sizes of all domains."""
+        return {domain: converter.counter for domain, converter in self.domains.items()}
+
+    def _add_table(self, domain, values):
+        """Add identifiers (values of IDs 1, 2, ... assigned elsewhere), they must get the same IDs here."""
+        ids = self.get_converter(domain).remap(values)
+        if not np.array_equal(ids[1:], np.arange(1, len(ids))):
+            raise RuntimeError("Identifiers of domain '{}' have different IDs in the registry.".format(domain))
+
+    def merge(self, registry):
+        """Add all identifiers from another registry (in the order of their IDs).
+
+        This registry must hold a subset of the other one (e.g., the other one is a copy that was extended
+        in another process), so the IDs are the same in both registries (RuntimeError is raised otherwise).
+        """
+        for domain, converter in registry.domains.items():
+            self._add_table(domain, converter.table)
+
+    def save(self, path):
+        """Save the tables into a JSON file (identifiers of each domain are listed in the order of their IDs)."""
+        with open(path, "w") as fp:
+            json.dump({domain: list(converter.table) for domain, converter in self.domains.items()}, fp)
+
+    def load(self, path):
+        """Load the tables saved by save(). The registry must be empty or hold a subset of the saved IDs
+        (RuntimeError is raised if the IDs conflict).
+        """
+        with open(path, "r") as fp:
+            data = json.load(fp)
+        for domain, values in data.items():
+            self._add_table(domain, values)
+
 
 class ReaderBase:
-    """Reader for CSV data files with logs of job spawning."""
+    """Reader for CSV data files with logs of job spawning.
+
+    If a binary columnar cache of the data file exists (see dataset_cache.py), the rows are read from the cache
+    instead of parsing the CSV file (the values are identical).
+    The reader may be restricted to a subset of fields (columns), the remaining fields are set to None.
+    String identifiers are translated into int IDs by tables from given registry (if no registry is given,
+    the reader uses its own).
+    """
+
+    # how many rows are converted from cached columns at once
+    CACHE_CHUNK = 4096
+
+    # class of the items yielded by the reader (set by derived classes)
+    item_class = None
 
-    def __init__(self, delimiter=';'):
+    def __init__(self, delimiter=';', fields=None, registry=None):
         self.fp = None
         self.reader = None
         self.delimiter = delimiter
         self.converters = {}
-
-    def open(self, file):
-        """Open file for reading. Must be csv or GZIPed csv."""
+        self.registry = registry if registry is not None else InternRegistry()
+        self.fields = set(fields) if fields is not None else None  # projection (None = all fields are decoded)
+
+        # CSV header and the projection (list of tuples name, column index, converter)
+        self.header = None
+        self.projection = []
+        self.skipped = []  # names of fields that are not decoded
+
+        # cached columns (NumPy arrays) and their metadata (if the reader is backed by the cache)
+        self.columns = None
+        self.meta = None
+        self.position = 0  # index of the next row (first row that was not converted into buffer yet)
+        self.buffer = []  # rows converted in advance from the cached columns (in reversed order)
+        self.remaps = {}  # translations of cached IDs into IDs of the registry (per column)
+        self.pending = None  # raw CSV row that was read ahead when seeking
+
+    def _prepare_projection(self, header):
+        self.header = header
+        self.projection = []
+        self.skipped = []
+        for name in self.converters:
+            if self.fields is None or name in self.fields:
+                self.projection.append((name, header.index(name), self.converters[name]))
+            else:
+                self.skipped.append(name)
+
+    def open(self, file, use_cache=True, from_ts=None):
+        """Open file for reading. Must be csv or GZIPed csv.
+
+        If use_cache is True and a valid cache of the file exists, the rows are read from the cache.
+        If from_ts is given, the reader starts with the first row with spawn_ts >= from_ts (seek index is used
+        to skip the preceding rows without parsing them).
+        """
+        self.buffer = []
+        self.pending = None
+        if use_cache:
+            cached = load_cache(file, self)
+            if cached is not None:
+                self.columns, self.meta = cached
+                self._prepare_projection(list(self.columns))
+
+                # all identifiers of the file are interned at once (in the order of their first appearance)
+                self.remaps = {}
+                for name, _, converter in self.projection:
+                    interned = self.meta["columns"][name].get("interned")
+                    if interned is not None:
+                        self.remaps[name] = converter.remap(interned)
+                self.position = 0
+                if from_ts is not None:
+                    self.position = int(np.searchsorted(self.columns["spawn_ts"], from_ts, side="left"))
+                return
+
+        if from_ts is not None:
+            index = load_index(file, delimiter=self.delimiter)
+            self.fp = open_at(file, index, from_ts)
+            self.reader = csv.reader(self.fp, delimiter=self.delimiter)
+            self._prepare_projection(index["header"].rstrip("\r\n").split(self.delimiter))
+            ts_column = self.header.index("spawn_ts")
+            for row in self.reader:
+                if row and float(row[ts_column]) >= from_ts:
+                    self.pending = row
+                    break
+            return
 
         if file.endswith('.gz'):
             self.fp = gzip.open(file, mode='rt')
         else:
             self.fp = open(file, 'r')
-        self.reader = csv.DictReader(self.fp, delimiter=self.delimiter)
+        self.reader = csv.reader(self.fp, delimiter=self.delimiter)
+        self._prepare_projection(self.reader.__next__())
 
     def close(self):
-        self.fp.close()
+        if self.fp:
+            self.fp.close()
         self.fp = None
         self.reader = None
+        self.columns = None
+        self.meta = None
+        self.buffer = []
+
+    def is_cached(self):
+        """Whether the rows are read from the binary cache."""
+        return self.columns is not None
+
+    def get_header(self):
+        """Get list of column names of the opened file."""
+        return self.header
 
     def __iter__(self):
-        self.reader.__iter__()
         return self
 
+    def iter_rows(self):
+        """Iterate over converted rows (dicts of values) instead of job objects."""
+        while True:
+            try:
+                yield ReaderBase.__next__(self)
+            except StopIteration:
+                return
+
+    def _fill_buffer(self):
+        """Convert next chunk of rows from the cached columns."""
+        end = min(self.position + self.CACHE_CHUNK, self.meta["rows"])
+        if self.position >= end:
+            raise StopIteration
+
+        names = []
+        values = []
+        for name, _, _ in self.projection:
+            column = self.columns[name][self.position:end]
+            column = (self.remaps[name][column] if name in self.remaps else column).tolist()
+            vocabulary = self.meta["columns"][name].get("vocabulary")
+            if vocabulary:
+                column = [vocabulary[value] for value in column]
+            names.append(name)
+            values.append(column)
+        for name in self.skipped:
+            names.append(name)
+            values.append([None] * (end - self.position))
+
+        self.buffer = [dict(zip(names, row)) for row in zip(*values)]
+        self.buffer.reverse()
+        self.position = end
+
+    def read_batch(self, size=None):
+        """Read next rows (at most size rows, all remaining rows if size is None) into a JobBatch.
+
+        Cached columns are sliced directly (without converting individual values). An empty batch is returned
+        when there are no more rows.
+        """
+        if self.columns is None:
+            rows = []
+            for row in self.iter_rows():
+                rows.append(row)
+                if size is not None and len(rows) >= size:
+                    break
+            return _rows_to_batch(self.item_class, rows)
+
+        # rows that were converted into the buffer in advance are not read yet
+        start = self.position - len(self.buffer)
+        end = self.meta["rows"] if size is None else min(start + size, self.meta["rows"])
+        end = max(start, end)
+        self.buffer = []
+        self.position = end
+
+        columns = dict.fromkeys(self.skipped)
+        for name, _, _ in self.projection:
+            column = self.columns[name][start:end]
+            if name in self.remaps:
+                column = self.remaps[name][column]
+            vocabulary = self.meta["columns"][name].get("vocabulary")
+            if vocabulary:
+                column = np.array(vocabulary, dtype=object)[column]
+            columns[name] = column
+        return JobBatch(self.item_class, columns)
+
     def __next__(self):
         """Loads next item from the reader and converts it into Job object."""
 
-        row = self.reader.__next__()
-        if row is None:
-            return None
+        if self.columns is not None:
+            if not self.buffer:
+                self._fill_buffer()
+            return self.buffer.pop()
 
-        # ensure proper translation of all columns
-        converted = {}
-        for col in self.converters:
-            converted[col] = self.converters[col](row[col])
+        if self.pending is not None:
+            row = self.pending
+            self.pending = None
+        else:
+            row = self.reader.__next__()
+            while not row:
+                row = self.reader.__next__()  # skip empty lines
+
+        # ensure proper translation of all projected columns
+        converted = dict.fromkeys(self.skipped)
+        for name, idx, converter in self.projection:
+            converted[name] = converter(row[idx])
         return converted
 
 
+def _rows_to_batch(item_class, rows):
+    """Create JobBatch from converted rows (dicts) of the reader."""
+    columns = {}
+    for field in fields(item_class):
+        if field.name in ("start_ts", "finish_ts"):
+            continue
+        columns[field.name] = _make_column(field, [row[field.name] for row in rows])
+    return JobBatch(item_class, columns)
+
+
 class JobReader(ReaderBase):
-    def __init__(self, delimiter=';'):
-        super().__init__(delimiter)
+    item_class = Job
+
+    def __init__(self, delimiter=';', fields=None, registry=None):
+        super().__init__(delimiter, fields, registry)
         self.converters = {
-            "solution_id": HashConverter(),
-            "group_id": HashConverter(),
-            "tlgroup_id": HashConverter(),
-            "exercise_id": HashConverter(),
-            "runtime_id": HashConverter(),
+            "solution_id": self.registry.get_converter("solution_id"),
+            "group_id": self.registry.get_converter("group_id"),
+            "tlgroup_id": self.registry.get_converter("tlgroup_id"),
+            "exercise_id": self.registry.get_converter("exercise_id"),
+            "runtime_id": self.registry.get_converter("runtime_id"),
             "worker_group_id": str_passthru,
-            "user_id": HashConverter(),
+            "user_id": self.registry.get_converter("user_id"),
             "spawn_ts": FloatConverter(),
             "limits": FloatConverter(),
             "cpu_time": bool_converter,
@@ -176,12 +622,14 @@ class JobReader(ReaderBase):
 
 
 class RefJobReader(ReaderBase):
-    def __init__(self, delimiter=';'):
-        super().__init__(delimiter)
+    item_class = RefJob
+
+    def __init__(self, delimiter=';', fields=None, registry=None):
+        super().__init__(delimiter, fields, registry)
         self.converters = {
-            "solution_id": HashConverter(),
-            "exercise_id": HashConverter(),
-            "runtime_id": HashConverter(),
+            "solution_id": self.registry.get_converter("solution_id"),
+            "exercise_id": self.registry.get_converter("exercise_id"),
+            "runtime_id": self.registry.get_converter("runtime_id"),
             "worker_group_id": str_passthru,
             "spawn_ts": FloatConverter(),
             "correctness": FloatConverter(),
@@ -194,39 +642,278 @@ class RefJobReader(ReaderBase):
         return RefJob(**converted)
 
 
+#
+# Pipelined reader (jobs are read and decoded in background)
+#
+
+
+def _put_item(items_queue, item, stop_event, stats):
+    """Put an item into a bounded queue, the time when the queue is full is measured (returns False if stopped)."""
+    start = time.perf_counter()
+    while not stop_event.is_set():
+        try:
+            items_queue.put(item, timeout=0.1)
+            stats["blocked_time"] += time.perf_counter() - start
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce_batches(reader, file, use_cache, from_ts, batch_size, items_queue, stop_event):
+    """Body of the producer (thread or process) of PipelinedReader.
+
+    Batches (lists) of jobs are placed in the queue, the last item is a dict with producer statistics.
+    If the reader fails, the exception is passed through the queue instead.
+    """
+    stats = {"read_time": 0.0, "blocked_time": 0.0}
+    try:
+        reader.open(file, use_cache, from_ts)
+        try:
+            start = time.perf_counter()
+            batch = []
+            for job in reader:
+                batch.append(job)
+                if len(batch) >= batch_size:
+                    stats["read_time"] += time.perf_counter() - start
+                    if not _put_item(items_queue, batch, stop_event, stats):
+                        return
+                    batch = []
+                    start = time.perf_counter()
+        finally:
+            reader.close()  # also when the consumer stopped the producer or the reader failed
+        stats["read_time"] += time.perf_counter() - start
+        if batch and not _put_item(items_queue, batch, stop_event, stats):
+            return
+        stats["registry"] = reader.registry  # IDs assigned by the producer (if it runs in another process)
+        _put_item(items_queue, stats, stop_event, stats)
+    except Exception as e:
+        _put_item(items_queue, e, stop_event, stats)
+
+
+class PipelinedReader:
+    """Wrapper of a reader that reads and decodes jobs in a background thread or process.
+
+    The jobs are passed to the consumer (simulation) in batches through a bounded queue, the wrapper has the same
+    iterator interface as the readers. Timing counters reveal which of the stages is the bottleneck (if the
+    simulation waits for the data, the run is I/O-bound; if the reader waits for a free slot, it is simulation-bound).
+    """
+
+    def __init__(self, reader, batch_size=1000, queue_size=16, mode="thread"):
+        if mode not in ("thread", "process"):
+            raise RuntimeError("Unknown pipelined reader mode '{}'.".format(mode))
+        self.reader = reader
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.mode = mode
+        self.producer = None
+        self.items_queue = None
+        self.stop_event = None
+        self.batch = []  # current batch (in reversed order)
+        self.finished = False
+
+        # statistics
+        self.jobs = 0
+        self.batches = 0
+        self.wait_time = 0.0  # how long the consumer waited for the data
+        self.producer_stats = None  # received from the producer at the end
+
+    def open(self, file, use_cache=True, from_ts=None):
+        """Open the file and start the producer."""
+        if self.mode == "thread":
+            self.items_queue = queue.Queue(self.queue_size)
+            self.stop_event = threading.Event()
+            self.producer = threading.Thread(target=_produce_batches, daemon=True, args=(
+                self.reader, file, use_cache, from_ts, self.batch_size, self.items_queue, self.stop_event))
+        else:
+            self.items_queue = multiprocessing.Queue(self.queue_size)
+            self.stop_event = multiprocessing.Event()
+            self.producer = multiprocessing.Process(target=_produce_batches, daemon=True, args=(
+                self.reader, file, use_cache, from_ts, self.batch_size, self.items_queue, self.stop_event))
+        self.batch = []
+        self.finished = False
+        self.producer.start()
+
+    def close(self):
+        """Stop the producer (if it is still running)."""
+        if self.producer is None:
+            return
+        self.stop_event.set()
+        while self.producer.is_alive():
+            try:
+                self.items_queue.get(timeout=0.1)  # make sure the producer is not blocked
+            except queue.Empty:
+                pass
+        self.producer.join()
+        self.producer = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.batch:
+            if self.finished:
+                raise StopIteration
+
+            start = time.perf_counter()
+            item = self.items_queue.get()
+            self.wait_time += time.perf_counter() - start
+            if isinstance(item, Exception):
+                self.finished = True
+                raise item
+            if isinstance(item, dict):
+                registry = item.pop("registry")
+                if registry is not self.reader.registry:
+                    self.reader.registry.merge(registry)  # the producer was a separate process
+                self.producer_stats = item
+                self.finished = True
+                raise StopIteration
+
+            self.batch = item
+            self.batch.reverse()
+            self.batches += 1
+
+        self.jobs += 1
+        return self.batch.pop()
+
+    def get_stats(self):
+        """Return timing counters (in seconds) as a dict."""
+        stats = {
+            "jobs": self.jobs,
+            "batches": self.batches,
+            "wait_time": self.wait_time,
+            "read_time": None,
+            "blocked_time": None,
+        }
+        if self.producer_stats:
+            stats.update(self.producer_stats)
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print("Reader: {} jobs in {} batches, reading {} s, reader blocked {} s, simulation waiting {} s".format(
+            stats["jobs"], stats["batches"], stats["read_time"], stats["blocked_time"], stats["wait_time"]))
+
+
 class JobDurationIndex:
     """Structure that holds processed records of jobs divided into classes by exercise and runtime affiliations.
 
-    The structure is used to estimate durations of jobs (by their exercise and runtime).
+    The structure is used to estimate durations of jobs (by their exercise and runtime). The statistics (sum
+    and count of durations) are held in dense NumPy arrays indexed by the (interned) IDs, which grow when needed.
+
+    If decay is given (0 < decay < 1), the estimates are exponentially weighted averages -- the statistics
+    of a class are multiplied by the decay whenever a new job of the class is added, so the estimates follow
+    the drift of durations (a weight of a job is halved after log(0.5) / log(decay) newer jobs of its class).
     """
 
-    def __init__(self):
-        self.jobs = {}  # duration (sum and count) per exercise_id
-        self.jobs_runtimes = {}  # duration (sum and count) per exercise_id and runtime_id
+    def __init__(self, decay=None):
+        self.decay = decay
+        self.sums = np.zeros(0)  # duration sum per exercise_id
+        self.counts = np.zeros(0)  # duration count per exercise_id
+        self.runtime_sums = np.zeros((0, 0))  # duration sum per exercise_id and runtime_id
+        self.runtime_counts = np.zeros((0, 0))  # duration count per exercise_id and runtime_id
+
+    def _grow(self, max_exercise_id, max_runtime_id):
+        """Enlarge the arrays so that given IDs fit in (the sizes are at least doubled)."""
+        exercises, runtimes = self.runtime_sums.shape
+        if max_exercise_id < exercises and max_runtime_id < runtimes:
+            return
+        new_exercises = max(max_exercise_id + 1, exercises * 2) if max_exercise_id >= exercises else exercises
+        new_runtimes = max(max_runtime_id + 1, runtimes * 2) if max_runtime_id >= runtimes else runtimes
+
+        for name in ("sums", "counts"):
+            array = np.zeros(new_exercises)
+            array[:exercises] = getattr(self, name)
+            setattr(self, name, array)
+        for name in ("runtime_sums", "runtime_counts"):
+            array = np.zeros((new_exercises, new_runtimes))
+            array[:exercises, :runtimes] = getattr(self, name)
+            setattr(self, name, array)
 
     def add(self, job):
         """Add another job or ref. job into the index. Its values are immediately processed"""
-
-        if job.exercise_id not in self.jobs:
-            self.jobs[job.exercise_id] = {"sum": 0.0, "count": 0.0}
-        self.jobs[job.exercise_id]["sum"] += job.duration
-        self.jobs[job.exercise_id]["count"] += 1.0
-
-        if job.exercise_id not in self.jobs_runtimes:
-            self.jobs_runtimes[job.exercise_id] = {}
-        if job.runtime_id not in self.jobs_runtimes[job.exercise_id]:
-            self.jobs_runtimes[job.exercise_id][job.runtime_id] = {"sum": 0.0, "count": 0.0}
-        self.jobs_runtimes[job.exercise_id][job.runtime_id]["sum"] += job.duration
-        self.jobs_runtimes[job.exercise_id][job.runtime_id]["count"] += 1.0
+        exercise_id, runtime_id = job.exercise_id, job.runtime_id
+        if exercise_id >= len(self.sums) or runtime_id >= self.runtime_sums.shape[1]:
+            self._grow(exercise_id, runtime_id)
+
+        if self.decay is not None:
+            self.sums[exercise_id] *= self.decay
+            self.counts[exercise_id] *= self.decay
+            self.runtime_sums[exercise_id, runtime_id] *= self.decay
+            self.runtime_counts[exercise_id, runtime_id] *= self.decay
+        self.sums[exercise_id] += job.duration
+        self.counts[exercise_id] += 1.0
+        self.runtime_sums[exercise_id, runtime_id] += job.duration
+        self.runtime_counts[exercise_id, runtime_id] += 1.0
+
+    def _add_decayed(self, sums, counts, keys, durations):
+        """Bulk update of flattened statistics with decay (same as adding the values one by one)."""
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # number of later jobs of the same class (each one decays the weight of the job once more)
+        ends = np.searchsorted(sorted_keys, sorted_keys, side="right")
+        later = np.empty(len(keys), dtype=np.int64)
+        later[order] = ends - np.arange(len(keys)) - 1
+        weights = self.decay ** later
+
+        unique_keys, totals = np.unique(keys, return_counts=True)
+        sums[unique_keys] *= self.decay ** totals
+        counts[unique_keys] *= self.decay ** totals
+        np.add.at(sums, keys, durations * weights)
+        np.add.at(counts, keys, weights)
+
+    def add_many(self, jobs):
+        """Add a sequence of jobs (list or JobBatch) at once (the result is the same as if add() was invoked)."""
+        if len(jobs) == 0:
+            return
+        if isinstance(jobs, JobBatch):
+            exercise_ids = np.asarray(jobs.get_column("exercise_id"), dtype=np.int64)
+            runtime_ids = np.asarray(jobs.get_column("runtime_id"), dtype=np.int64)
+            durations = np.asarray(jobs.get_column("duration"), dtype=float)
+        else:
+            exercise_ids = np.array([job.exercise_id for job in jobs], dtype=np.int64)
+            runtime_ids = np.array([job.runtime_id for job in jobs], dtype=np.int64)
+            durations = np.array([job.duration for job in jobs], dtype=float)
+        self._grow(int(exercise_ids.max()), int(runtime_ids.max()))
+
+        # the 2D arrays are updated through flattened views (both are C-contiguous)
+        runtime_keys = exercise_ids * self.runtime_sums.shape[1] + runtime_ids
+        runtime_sums = self.runtime_sums.reshape(-1)
+        runtime_counts = self.runtime_counts.reshape(-1)
+        if self.decay is None:
+            # np.add.at accumulates the values in the order of the jobs (sums are the same as of add())
+            np.add.at(self.sums, exercise_ids, durations)
+            np.add.at(self.counts, exercise_ids, 1.0)
+            np.add.at(runtime_sums, runtime_keys, durations)
+            np.add.at(runtime_counts, runtime_keys, 1.0)
+        else:
+            self._add_decayed(self.sums, self.counts, exercise_ids, durations)
+            self._add_decayed(runtime_sums, runtime_counts, runtime_keys, durations)
 
     def estimate_duration(self, exercise_id, runtime_id):
         """Retrieve estimated duration from the index. None is returned, if there are not enough data for the estimate."""
-
-        if exercise_id in self.jobs_runtimes and runtime_id in self.jobs_runtimes[exercise_id]:
-            rec = self.jobs_runtimes[exercise_id][runtime_id]
-            return rec["sum"] / rec["count"]
-
-        if exercise_id in self.jobs:
-            return self.jobs[exercise_id]["sum"] / self.jobs[exercise_id]["count"]
-
-        return None
+        if exercise_id >= len(self.counts) or self.counts[exercise_id] == 0.0:
+            return None
+        if runtime_id < self.runtime_counts.shape[1] and self.runtime_counts[exercise_id, runtime_id] > 0.0:
+            return float(self.runtime_sums[exercise_id, runtime_id] / self.runtime_counts[exercise_id, runtime_id])
+        return float(self.sums[exercise_id] / self.counts[exercise_id])
+
+    def estimate_many(self, exercise_ids, runtime_ids):
+        """Vectorized estimate_duration() for arrays of IDs, NaN is returned where there are not enough data."""
+        exercise_ids = np.asarray(exercise_ids, dtype=np.int64)
+        runtime_ids = np.asarray(runtime_ids, dtype=np.int64)
+        exercises, runtimes = self.runtime_counts.shape
+        known = exercise_ids < exercises
+        known_runtime = known & (runtime_ids < runtimes)
+        exercise_ids = np.where(known, exercise_ids, 0)
+        runtime_ids = np.where(known_runtime, runtime_ids, 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if exercises == 0:
+                return np.full(len(exercise_ids), np.nan)
+            counts = self.counts[exercise_ids]
+            estimates = np.where(known & (counts > 0.0), self.sums[exercise_ids] / counts, np.nan)
+            runtime_counts = self.runtime_counts[exercise_ids, runtime_ids]
+            runtime_known = known_runtime & (runtime_counts > 0.0)
+            runtime_estimates = self.runtime_sums[exercise_ids, runtime_ids] / runtime_counts
+        return np.where(runtime_known, runtime_estimates, estimates)
@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import copy
+import bisect
+import time
 import argparse
+import itertools
+import multiprocessing
+import numpy as np
 import ruamel.yaml as yaml
-from jobs import JobReader, RefJobReader
-from simulation import Simulation
+from jobs import JobReader, RefJobReader, PipelinedReader, InternRegistry, JobBatch, RefJobStore
+from partitioned import PartitionedSimulation, create_simulation, is_partitioned
+from results_cache import ResultCache, get_run_key, get_entry, print_entry
+from checkpoint import save_checkpoint, load_checkpoint, dumps_state, loads_state
+from dataset_cache import count_jobs, ensure_cache, intern_dataset
+
+
+# how many jobs are passed to the simulation at once
+CHUNK_SIZE = 1000
+COLUMNAR_CHUNK_SIZE = 65536  # when whole columns are read (analytic engine)
 
 
 def get_configuration(config_file):
@@ -17,12 +32,192 @@ def get_configuration(config_file):
             exit()
 
 
-def load_reference_jobs(path):
-    reader = RefJobReader()
-    reader.open(path)
-    jobs = [job for job in reader]
+def get_scenarios(config_files):
+    """Load simulation configurations as a list of (name, configuration) pairs.
+
+    Each config file holds either one configuration or a list of them under the "scenarios" key. A scenario is
+    either an inline configuration (optionally with a "name") or a path to another config file (relative to the file
+    with scenarios).
+    """
+    scenarios = []
+    for config_file in config_files:
+        configuration = get_configuration(config_file)
+        if not isinstance(configuration, dict) or "scenarios" not in configuration:
+            scenarios.append((config_file, configuration))
+            continue
+
+        for idx, scenario in enumerate(configuration["scenarios"]):
+            if isinstance(scenario, str):
+                path = os.path.join(os.path.dirname(config_file), scenario)  # relative to the scenarios file
+                scenarios.append((path, get_configuration(path)))
+            elif isinstance(scenario, dict):
+                scenarios.append((scenario.get("name", "{}#{}".format(config_file, idx)), scenario))
+            else:
+                raise RuntimeError("Invalid scenario #{} in config file {}.".format(idx, config_file))
+    return scenarios
+
+
+def get_job_fields(simulations):
+    """Union of job fields used by all the simulations (None if all fields are needed)."""
+    fields = set()
+    for simulation in simulations:
+        sim_fields = simulation.get_job_fields()
+        if sim_fields is None:
+            return None
+        fields.update(sim_fields)
+    return fields
+
+
+def run_simulations(simulations, jobs):
+    """Pass a chunk of jobs to all the simulations, each one gets its own copies (the jobs are mutated)."""
+    copy_jobs = False
+    for simulation in simulations:
+        if simulation.slo_violation is not None:
+            continue  # aborted simulation ignores the jobs
+        if simulation.engine == "analytic" or (simulation.engine == "partitioned" and isinstance(jobs, JobBatch)):
+            simulation.run_batch(jobs)  # the jobs are only read (partitions get their own objects from a batch)
+        elif copy_jobs:
+            simulation.run_batch([copy.copy(job) for job in jobs])
+        else:
+            simulation.run_batch(jobs)
+            copy_jobs = True  # the original jobs are taken, the other simulations get copies
+
+
+class JobFeeder:
+    """Reads jobs in chunks and passes them to the simulations.
+
+    The feeding may be stopped at a given number of jobs or at a timestamp and continued later (jobs that were read
+    beyond the stop point are kept for the next call). If all simulations use the analytic engine and columnar
+    reading is allowed (the reader has read_batch), the jobs are read in large batches without creating objects.
+    """
+
+    def __init__(self, simulations, reader, columnar=True, progress=False, counter=0):
+        self.simulations = simulations
+        self.reader = reader
+        # analytic engine processes whole columns, so the jobs are read in large batches (without creating objects),
+        # partitioned simulation creates objects only for the jobs of its partitions
+        self.columnar = columnar and all(simulation.engine in ("analytic", "partitioned") for simulation in simulations)
+        self.chunk_size = COLUMNAR_CHUNK_SIZE if self.columnar else CHUNK_SIZE
+        self.progress = progress
+        self.backlog = None  # jobs read beyond the last stop point (list or JobBatch)
+        self.backlog_position = 0
+        self.counter = counter  # number of jobs passed to the simulations
+        self.last_ts = None  # spawn time of the last job passed to the simulations
+        self.last_ts_jobs = 0  # number of jobs passed to the simulations spawned at last_ts
+
+    def _read(self, size):
+        if self.backlog is not None and self.backlog_position < len(self.backlog):
+            jobs = self.backlog[self.backlog_position:self.backlog_position + size]
+            self.backlog_position += len(jobs)
+            return jobs
+        self.backlog = None
+        if self.columnar:
+            return self.reader.read_batch(size)
+        return list(itertools.islice(self.reader, size))
+
+    def _put_back(self, jobs, count):
+        """Return last count jobs of a chunk that was just read (they will be read again)."""
+        if self.backlog is not None:
+            self.backlog_position -= count
+        else:
+            self.backlog = jobs
+            self.backlog_position = len(jobs) - count
+
+    def _update_last_ts(self, jobs):
+        spawn_ts = jobs.get_column("spawn_ts") if self.columnar else [job.spawn_ts for job in jobs]
+        last_ts = float(spawn_ts[-1])
+        count = len(jobs) - bisect.bisect_left(spawn_ts, last_ts)
+        self.last_ts_jobs = count + (self.last_ts_jobs if self.last_ts == last_ts and count == len(jobs) else 0)
+        self.last_ts = last_ts
+
+    def feed(self, limit=None, to_ts=None):
+        """Pass jobs (spawned before to_ts) to the simulations until there are limit jobs simulated in total.
+
+        Returns True if the stop point was reached (or all simulations were aborted), False if there are no more jobs.
+        """
+        limit = limit if limit is not None else float("inf")
+        while self.counter < limit:
+            if all(simulation.slo_violation is not None for simulation in self.simulations):
+                return True  # all simulations violated their SLO, no need to read further
+            size = int(min(self.chunk_size, limit - self.counter))
+            jobs = self._read(size)
+            if not len(jobs):
+                return False
+
+            if to_ts is not None:
+                spawn_ts = jobs.get_column("spawn_ts") if self.columnar else [job.spawn_ts for job in jobs]
+                end = bisect.bisect_left(spawn_ts, to_ts)
+                if end < len(jobs):
+                    self._put_back(jobs, len(jobs) - end)
+                    jobs = jobs[:end]
+                    if not len(jobs):
+                        return True
+
+            run_simulations(self.simulations, jobs)
+            self._update_last_ts(jobs)
+            if self.progress:
+                sys.stdout.write('.' * ((self.counter + len(jobs)) // 1000 - self.counter // 1000))
+                sys.stdout.flush()
+            self.counter += len(jobs)
+            if to_ts is not None and len(jobs) < size:
+                return True  # end of the time window was reached
+        return True
+
+
+def simulate(simulations, reader, limit=None, to_ts=None, progress=False, columnar=True):
+    """Read jobs (spawned before to_ts, at most limit jobs) and pass them to the simulations in chunks.
+
+    Returns the number of simulated jobs.
+    """
+    feeder = JobFeeder(simulations, reader, columnar, progress)
+    feeder.feed(limit, to_ts)
+    return feeder.counter
+
+
+def _run_partition(task):
+    """Simulate one partition of a partitioned configuration (invoked in a pool process).
+
+    The process reads the data itself, returns the index of the partition, its pickled state, and the registry
+    (with IDs assigned in the process).
+    """
+    configuration, idx, args = task
+    registry = InternRegistry()
+    if args.interning and os.path.isfile(args.interning):
+        registry.load(args.interning)
+    ref_jobs = load_reference_jobs(args.refs, not args.no_cache, registry) if (args.refs) else None
+    simulation = PartitionedSimulation(configuration, ref_jobs, registry, partitions=[idx])
+    if not args.no_cache:
+        intern_dataset(args.input_file, registry, simulation.get_job_fields())
+    reader = JobReader(fields=simulation.get_job_fields(), registry=registry)
+    reader.open(args.input_file, not args.no_cache, args.from_ts)
+    simulate([simulation], reader, args.limit, args.to_ts)
+    reader.close()
+
+    partition = simulation.simulations[idx]
+    partition.run(None)
+    return idx, dumps_state(partition, {"@@ref_jobs": ref_jobs, "@@registry": registry}), registry
+
+
+def simulate_partitions(configuration, args, ref_jobs, registry, processes):
+    """Simulate partitions of given configuration in a pool of processes, returns concluded PartitionedSimulation."""
+    simulation = PartitionedSimulation(configuration, ref_jobs, registry, partitions=[])
+    injections = {"@@ref_jobs": ref_jobs, "@@registry": registry}
+    tasks = [(configuration, idx, args) for idx in range(len(simulation.partitions))]
+    with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+        for idx, state, partition_registry in pool.imap_unordered(_run_partition, tasks):
+            registry.merge(partition_registry)  # the processes read the same data, so they assign the same IDs
+            simulation.simulations[idx] = loads_state(state, injections)
+    simulation.conclude()
+    return simulation
+
+
+def load_reference_jobs(path, use_cache=True, registry=None):
+    """Load all ref. jobs into one read-only store (shared by all components that use them)."""
+    reader = RefJobReader(registry=registry)
+    reader.open(path, use_cache)
+    jobs = reader.read_batch()
     reader.close()
-    return jobs
+    return RefJobStore(jobs)
 
 
 if __name__ == "__main__":
@@ -30,41 +225,195 @@ if __name__ == "__main__":
     parser.add_argument("input_file", type=str, help="Path to the input .csv or .csv.gz file with jobs log.")
     parser.add_argument("--limit", type=int, default=1000000000,
                         help="Maximal number of jobs to be read from the input file.")
-    parser.add_argument("--config", type=str, required=True, help="Path to yaml file with simulation configuration.")
+    parser.add_argument("--from-ts", type=float, required=False,
+                        help="Only jobs spawned at or after this unix timestamp are simulated.")
+    parser.add_argument("--to-ts", type=float, required=False,
+                        help="Only jobs spawned before this unix timestamp are simulated.")
+    parser.add_argument("--config", type=str, required=False, action="append",
+                        help="Path to yaml file with simulation configuration. The option may be repeated "
+                        "(or the file may hold a list of scenarios) to simulate several configurations in one pass.")
     parser.add_argument("--refs", type=str, required=False,
                         help="Path to .csv or .csv.gz file with log with jobs of reference solutions.")
+    parser.add_argument("--interning", type=str, required=False,
+                        help="Path to .json file with ID translation tables, which are loaded at the beginning "
+                        "(if the file exists) and saved at the end (so the IDs are stable across runs).")
     parser.add_argument("--progress", default=False, action="store_true",
                         help="If present, progress visualization is on.")
+    parser.add_argument("--no-cache", default=False, action="store_true",
+                        help="If present, binary caches of data files (see dataset_cache.py) are not used.")
+    parser.add_argument("--pipeline", type=str, choices=["thread", "process"], required=False,
+                        help="Read and decode jobs in a background thread or process.")
+    parser.add_argument("--timing", default=False, action="store_true",
+                        help="If present, timing of the reader and the simulation is printed at the end.")
+    parser.add_argument("--machine", default=False, action="store_true",
+                        help="If present, the metrics are printed in machine-readable format (one JSON per collector, "
+                        "records of several scenarios hold the scenario name).")
+    parser.add_argument("--result-cache", type=str, required=False,
+                        help="Path to a directory where results of runs are cached (the simulation is skipped if "
+                        "the same configuration was already simulated on the same data by the same code).")
+    parser.add_argument("--refresh", default=False, action="store_true",
+                        help="If present, cached results are ignored (the simulation is executed and the cache updated).")
+    parser.add_argument("--evict", default=False, action="store_true",
+                        help="If present, cached results of the runs are removed (nothing is simulated).")
+    parser.add_argument("--checkpoint", type=str, required=False,
+                        help="Path to a file where the state of the simulation is saved (at the point given by "
+                        "--checkpoint-at-ts or --checkpoint-at-jobs), the simulation continues afterwards.")
+    parser.add_argument("--checkpoint-at-ts", type=float, required=False,
+                        help="The checkpoint is saved before the first job spawned at or after this unix timestamp.")
+    parser.add_argument("--checkpoint-at-jobs", type=int, required=False,
+                        help="The checkpoint is saved after given number of jobs is simulated.")
+    parser.add_argument("--partition-processes", type=int, required=False,
+                        help="If present, partitions of partitioned configurations (workers assigned to worker groups) "
+                        "are simulated in parallel by given number of processes (each one reads the data itself).")
+    parser.add_argument("--resume", type=str, required=False,
+                        help="Path to a checkpoint file, the simulation continues from the saved state "
+                        "(configuration is taken from the checkpoint).")
     args = parser.parse_args()
+    if not args.config and not args.resume:
+        parser.error("either --config or --resume must be given")
+    if args.checkpoint and args.checkpoint_at_ts is None and args.checkpoint_at_jobs is None:
+        parser.error("--checkpoint requires --checkpoint-at-ts or --checkpoint-at-jobs")
+    if args.checkpoint and args.partition_processes:
+        parser.error("--checkpoint cannot be used with --partition-processes")
+    if args.resume and args.result_cache:
+        parser.error("--result-cache cannot be used with --resume (the run key of a restored state is unknown)")
+    if args.checkpoint and args.pipeline == "process":
+        parser.error("--checkpoint cannot be used with --pipeline process (IDs are interned in another process)")
 
     # initialize the system
-    configuration = get_configuration(args.config)
-    ref_jobs = load_reference_jobs(args.refs) if (args.refs) else None
-    simulation = Simulation(configuration, ref_jobs)
-
-    reader = JobReader()
-    reader.open(args.input_file)
-
-    if args.progress:
-        sys.stdout.write("Simulation started ")
-        sys.stdout.flush()
-
-    # read data and run the simulation
-    limit = args.limit
-    counter = 0
-    for job in reader:
-        if limit <= counter:
-            break
-        simulation.run(job)
-        counter += 1
-        if args.progress and counter % 1000 == 0:
-            sys.stdout.write('.')
+    if args.resume:
+        # the simulations are restored, ref. jobs are loaded again (with restored ID translation tables)
+        injections = {}
+
+        def get_injections(header):
+            registry = header["registry"]
+            injections["@@registry"] = registry
+            injections["@@ref_jobs"] = load_reference_jobs(args.refs, not args.no_cache, registry) \
+                if (args.refs) else None
+            return injections
+
+        header, simulations = load_checkpoint(args.resume, get_injections)
+        scenarios = header["scenarios"]
+        registry = header["registry"]
+        position = header["position"]
+    else:
+        scenarios = get_scenarios(args.config)
+        position = None
+
+    # results of scenarios that were already simulated are taken from the cache
+    entries = [None] * len(scenarios)
+    if args.result_cache:
+        cache = ResultCache(args.result_cache)
+        keys = [get_run_key(configuration, args.input_file, args.refs, args.limit, args.from_ts, args.to_ts,
+                            args.interning) for _, configuration in scenarios]
+        if args.evict:
+            for (name, _), key in zip(scenarios, keys):
+                if cache.evict(key):
+                    print("Cached results of {} were removed.".format(name))
+            exit()
+        if not args.refresh:
+            entries = [cache.get(key) for key in keys]
+    pending = [idx for idx, entry in enumerate(entries) if entry is None]
+
+    # partitioned scenarios may be simulated in parallel (each partition reads the data in its own process)
+    parallel = []
+    if args.partition_processes and not args.resume:
+        parallel = [idx for idx in pending if is_partitioned(scenarios[idx][1])]
+        pending = [idx for idx in pending if idx not in parallel]
+
+    start_time = time.perf_counter()
+    if (pending or parallel) and not args.resume:
+        registry = InternRegistry()  # ID translation tables shared by all readers
+        if args.interning and os.path.isfile(args.interning):
+            registry.load(args.interning)
+        ref_jobs = load_reference_jobs(args.refs, not args.no_cache, registry) if (args.refs) else None
+
+    if pending:
+        if not args.resume:
+            simulations = [create_simulation(scenarios[idx][1], ref_jobs, registry) for idx in pending]
+            injections = {"@@ref_jobs": ref_jobs, "@@registry": registry}
+            if not args.no_cache:
+                # IDs of the whole data are known before the simulations start (e.g., for sizes of NN inputs)
+                intern_dataset(args.input_file, registry, get_job_fields(simulations))
+
+        # SLO guards of some bounds (e.g., average delay) need to know the number of jobs in advance
+        if not args.no_cache and any(simulation.slo_guards for simulation in simulations):
+            if position and position["last_ts"] is not None:
+                total_jobs = count_jobs(args.input_file, position["last_ts"], args.to_ts)
+                total_jobs = total_jobs + position["jobs"] - position["last_ts_jobs"] if total_jobs is not None else None
+            else:
+                total_jobs = count_jobs(args.input_file, args.from_ts, args.to_ts)
+            if total_jobs is not None:
+                for simulation in simulations:
+                    simulation.set_total_jobs(min(total_jobs, args.limit))
+
+        # only the fields used by the components are decoded (data are read once for all the simulations)
+        reader = JobReader(fields=get_job_fields(simulations), registry=registry)
+        if args.pipeline:
+            reader = PipelinedReader(reader, mode=args.pipeline)
+        if position and position["last_ts"] is not None:
+            # skip the jobs that were simulated before the checkpoint
+            reader.open(args.input_file, not args.no_cache, position["last_ts"])
+            for _ in itertools.islice(reader, position["last_ts_jobs"]):
+                pass
+        else:
+            reader.open(args.input_file, not args.no_cache, args.from_ts)
+        start_time = time.perf_counter()
+
+        if args.progress:
+            sys.stdout.write("Simulation started ")
             sys.stdout.flush()
 
-    print()
-    simulation.run(None)  # end the simulation
-    reader.close()
+        # read data and run the simulations
+        feeder = JobFeeder(simulations, reader, not args.pipeline, args.progress, position["jobs"] if position else 0)
+        if position:
+            feeder.last_ts, feeder.last_ts_jobs = position["last_ts"], position["last_ts_jobs"]
+        if args.checkpoint:
+            # run up to the checkpoint, save the state, and continue
+            limit = min(args.limit, args.checkpoint_at_jobs) if args.checkpoint_at_jobs is not None else args.limit
+            to_ts = args.to_ts
+            if args.checkpoint_at_ts is not None:
+                to_ts = min(to_ts, args.checkpoint_at_ts) if to_ts is not None else args.checkpoint_at_ts
+            feeder.feed(limit, to_ts)
+            header = {
+                "scenarios": [scenarios[idx] for idx in pending],
+                "registry": registry,
+                "position": {"jobs": feeder.counter, "last_ts": feeder.last_ts, "last_ts_jobs": feeder.last_ts_jobs},
+            }
+            save_checkpoint(args.checkpoint, header, simulations, injections)
+        feeder.feed(args.limit, args.to_ts)
+
+        if not args.machine:
+            print()
+        for simulation in simulations:
+            simulation.run(None)  # end the simulation
+        reader.close()
+        if args.interning:
+            registry.save(args.interning)
+
+        for idx, simulation in zip(pending, simulations):
+            entries[idx] = get_entry(simulation)
+            if args.result_cache:
+                cache.put(keys[idx], entries[idx])
+
+    if parallel:
+        # the processes memory-map the parsed data instead of parsing the files again
+        for path in [args.input_file, args.refs]:
+            if path and not args.no_cache and ensure_cache(path):
+                print("Cache of {} was built.".format(path), file=sys.stderr)
+        for idx in parallel:
+            simulation = simulate_partitions(scenarios[idx][1], args, ref_jobs, registry, args.partition_processes)
+            entries[idx] = get_entry(simulation)
+            if args.result_cache:
+                cache.put(keys[idx], entries[idx])
 
     # print out measured statistics
-    for metric in simulation.metrics:
-        metric.print()
+    for (name, _), entry in zip(scenarios, entries):
+        if len(scenarios) > 1 and not args.machine:
+            print("Scenario {}:".format(name))
+        print_entry(entry, args.machine, name if len(scenarios) > 1 else None)
+
+    if args.timing:
+        print("Total time: {} s".format(time.perf_counter() - start_time))
+        if args.pipeline and pending:
+            reader.print_stats()
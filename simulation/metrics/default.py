@@ -1,9 +1,12 @@
-from interfaces import AbstractMetricsCollector
+import numpy as np
+from interfaces import AbstractMetricsCollector, format_results
 
 
 class PowerMetricsCollector(AbstractMetricsCollector):
     """Metrics collector that computes total uptime of all workers (i.e., power consumption)."""
 
+    job_fields = set()
+
     def __init__(self):
         self.last_ts = None
         self.period = 0.0  # measured period of time
@@ -17,10 +20,27 @@ class PowerMetricsCollector(AbstractMetricsCollector):
             self.uptime += dt * float(active_workers)
         self.last_ts = ts
 
-    def print(self):
+    def fast_forward(self, ts_from, ticks, period, workers):
+        # workers do not change in idle spans, so one snapshot at the end accumulates the whole span
+        self.snapshot(ts_from + (ticks - 1) * period, workers)
+
+    def merge(self, other):
+        # the partitions are measured over the same span, their uptimes add up
+        self.period = max(self.period, other.period)
+        self.uptime += other.uptime
+        if other.last_ts and (not self.last_ts or other.last_ts > self.last_ts):
+            self.last_ts = other.last_ts
+
+    def print(self, machine=False, verbose=False):
+        if machine:
+            print(format_results(self.get_results()))
+            return
         print("Simulation time: {} s, relative workers uptime: {}".format(
             self.get_measured_period(), self.get_relative_uptime()))
 
+    def get_results(self):
+        return {"period": self.get_measured_period(), "relative_uptime": self.get_relative_uptime()}
+
     def get_measured_period(self):
         """Duration of the entire measurement."""
         return self.period
@@ -33,6 +53,8 @@ class PowerMetricsCollector(AbstractMetricsCollector):
 class JobDelayMetricsCollector(AbstractMetricsCollector):
     """Metrics collector that computes basic delay statistics (average, maximum) for all jobs."""
 
+    job_fields = {"spawn_ts"}
+
     def __init__(self):
         self.jobs = 0
         self.total_delay = 0.0
@@ -44,10 +66,35 @@ class JobDelayMetricsCollector(AbstractMetricsCollector):
         self.max_delay = max(self.max_delay, delay)
         self.jobs += 1
 
-    def print(self):
+    def add_delays(self, delays):
+        """Bulk variant of job_finished() that gets a NumPy array of delays (in the order of completion)."""
+        # accumulate sequentially, so the total is the same as if the jobs were added one by one
+        self.total_delay = float(np.cumsum(np.concatenate(([self.total_delay], delays)))[-1])
+        self.max_delay = max(self.max_delay, float(delays.max()))
+        self.jobs += len(delays)
+
+    def merge(self, other):
+        self.jobs += other.jobs
+        self.total_delay += other.total_delay
+        self.max_delay = max(self.max_delay, other.max_delay)
+
+    def print(self, machine=False, verbose=False):
+        if machine:
+            print(format_results(self.get_results()))
+            return
         print("Total jobs: {}, avg. delay: {}, max. delay: {}".format(
             self.get_jobs(), self.get_avg_delay(), self.get_max_delay()))
 
+    def get_results(self):
+        return {"jobs": self.get_jobs(), "avg_delay": self.get_avg_delay(), "max_delay": self.get_max_delay()}
+
+    def get_lower_bounds(self, total_jobs=None):
+        # delays are never negative, so the total delay cannot decrease
+        bounds = {"max_delay": self.max_delay}
+        if total_jobs:
+            bounds["avg_delay"] = self.total_delay / float(total_jobs)
+        return bounds
+
     def get_jobs(self):
         return self.jobs
 
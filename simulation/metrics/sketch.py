@@ -0,0 +1,187 @@
+import copy
+import math
+from interfaces import AbstractMetricsCollector, format_results
+from metrics.user_experience import UserExperienceMetricsCollector
+
+
+class QuantileSketch:
+    """Mergeable sketch of a distribution of non-negative values with bounded memory (in the manner of DDSketch).
+
+    Values are counted in logarithmic buckets (bucket i holds values in (gamma^(i-1), gamma^i]), so the quantiles
+    are estimated with the given relative accuracy. Values below min_value are counted separately (as zeros).
+    If the number of buckets exceeds max_bins, the lowest buckets are collapsed into one (the accuracy of low
+    quantiles is sacrificed, the high ones remain accurate). Sketches of the same accuracy can be merged.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048, min_value=1e-3):
+        if not 0.0 < relative_accuracy < 1.0:
+            raise RuntimeError("Relative accuracy of the sketch must be between 0 and 1.")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.min_value = min_value
+
+        self.bins = {}  # bucket index -> count
+        self.zeros = 0  # count of values below min_value
+        self.count = 0
+        self.min = None  # exact extremes (the estimates are clamped by them)
+        self.max = None
+
+    def get_key(self, value):
+        """Index of the bucket of given value (None for values below min_value)."""
+        if value < self.min_value:
+            return None
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def add(self, value):
+        """Add one value."""
+        self.add_key(value, self.get_key(value))
+
+    def add_key(self, value, key):
+        """Add one value whose bucket was already computed (by get_key of a sketch of the same accuracy)."""
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if key is None:
+            self.zeros += 1
+        elif key in self.bins:
+            self.bins[key] += 1
+        else:
+            self.bins[key] = 1
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        excess = keys[:len(keys) - self.max_bins + 1]
+        self.bins[excess[-1]] += sum(self.bins.pop(key) for key in excess[:-1])
+
+    def merge(self, other):
+        """Add all values of another sketch (of the same accuracy) into this one."""
+        if other.gamma != self.gamma or other.min_value != self.min_value:
+            raise RuntimeError("Only sketches of the same accuracy can be merged.")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zeros += other.zeros
+        self.count += other.count
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def get_quantiles(self, quantiles):
+        """Estimate given quantiles (list of numbers between 0 and 1), returns a list of values (0.0 if empty)."""
+        if not self.count:
+            return [0.0] * len(quantiles)
+
+        # the buckets are traversed once (quantiles in ascending order)
+        results = [None] * len(quantiles)
+        order = sorted(range(len(quantiles)), key=lambda idx: quantiles[idx])
+        keys = iter(sorted(self.bins))
+        seen = self.zeros
+        value = 0.0  # representative value of the last traversed bucket
+        for idx in order:
+            rank = quantiles[idx] * (self.count - 1)
+            while seen <= rank:
+                key = next(keys)
+                seen += self.bins[key]
+                value = 2.0 * self.gamma ** key / (self.gamma + 1.0)
+            results[idx] = min(max(value, self.min), self.max) if seen > self.zeros else self.min
+        return results
+
+
+class DelayDistributionMetricsCollector(AbstractMetricsCollector):
+    """Metrics collector that estimates quantiles of job delays (e.g., p50, p95, p99) by quantile sketches.
+
+    Besides the overall distribution, the delays are broken down by runtime_id, worker_group_id, and (if ref. jobs
+    are given) by user experience categories (ontime, delayed, late, see UserExperienceMetricsCollector).
+    The memory is bounded regardless of the number of jobs and the collectors of partitions can be merged.
+    If the registry is given, runtimes are reported by their original identifiers instead of int IDs.
+    """
+
+    def __init__(self, ref_jobs=None, thresholds=[1.0, 2.0], registry=None, quantiles=[0.5, 0.95, 0.99],
+                 relative_accuracy=0.01, max_bins=2048):
+        self.quantiles = quantiles
+        self.registry = registry
+        self.sketch = QuantileSketch(relative_accuracy, max_bins)
+        self.breakdowns = {"runtime_id": {}, "worker_group_id": {}, "category": {}}  # dimension -> value -> sketch
+
+        # categories are assigned by an embedded user experience collector
+        self.experience = UserExperienceMetricsCollector(ref_jobs, thresholds) if ref_jobs is not None else None
+        self.job_fields = {"spawn_ts", "runtime_id", "worker_group_id"}
+        if self.experience is not None:
+            self.job_fields = self.job_fields | self.experience.job_fields
+
+    def _add(self, dimension, value, delay, key):
+        sketches = self.breakdowns[dimension]
+        if value not in sketches:
+            sketches[value] = QuantileSketch(self.sketch.relative_accuracy, self.sketch.max_bins)
+        sketches[value].add_key(delay, key)
+
+    def job_finished(self, job):
+        delay = job.start_ts - job.spawn_ts
+        key = self.sketch.get_key(delay)  # all sketches have the same buckets
+        self.sketch.add_key(delay, key)
+        self._add("runtime_id", job.runtime_id, delay, key)
+        self._add("worker_group_id", job.worker_group_id, delay, key)
+        if self.experience is not None:
+            self._add("category", self.experience.job_finished(job), delay, key)
+
+    def fork(self):
+        # the registry is shared (it is not a part of the measured state)
+        return copy.deepcopy(self, {id(self.registry): self.registry})
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        for dimension, sketches in other.breakdowns.items():
+            for value, sketch in sketches.items():
+                if value in self.breakdowns[dimension]:
+                    self.breakdowns[dimension][value].merge(sketch)
+                else:
+                    self.breakdowns[dimension][value] = copy.deepcopy(sketch)
+        if self.experience is not None:
+            self.experience.merge(other.experience)
+
+    def _get_names(self, dimension):
+        """Translation of the values of given dimension into printed names (int IDs back to identifiers)."""
+        if self.registry is None or dimension not in self.registry.domains:
+            return {}
+        return {idx: name for name, idx in self.registry.get_converter(dimension).table.items()}
+
+    def _get_quantile_names(self):
+        return ["p{:g}".format(quantile * 100.0) for quantile in self.quantiles]  # e.g., p50, p99.9
+
+    def _get_quantiles(self, sketch):
+        results = {"jobs": sketch.count}
+        results.update(zip(self._get_quantile_names(), sketch.get_quantiles(self.quantiles)))
+        return results
+
+    def get_results(self):
+        results = self._get_quantiles(self.sketch)
+        for dimension, sketches in self.breakdowns.items():
+            if dimension == "category" and self.experience is None:
+                continue
+            names = self._get_names(dimension)
+            sketches = [(str(names.get(value, value)), sketch) for value, sketch in sketches.items()]
+            results[dimension] = {name: self._get_quantiles(sketch)
+                                  for name, sketch in sorted(sketches, key=lambda item: item[0])}
+        return results
+
+    def print(self, machine=False, verbose=False):
+        results = self.get_results()
+        if machine:
+            print(format_results(results))
+            return
+
+        def format_quantiles(values):
+            return ", ".join("{}: {:.3f}".format(name, values[name]) for name in self._get_quantile_names())
+
+        print("Total jobs: {}, delay {}".format(results["jobs"], format_quantiles(results)))
+        for dimension in self.breakdowns:
+            for name, values in results.get(dimension, {}).items():
+                print("  {} {}: jobs: {}, delay {}".format(dimension, name, values["jobs"], format_quantiles(values)))
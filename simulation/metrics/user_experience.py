@@ -1,4 +1,4 @@
-from interfaces import AbstractMetricsCollector
+from interfaces import AbstractMetricsCollector, format_results
 from jobs import JobDurationIndex
 
 
@@ -11,6 +11,8 @@ class UserExperienceMetricsCollector(AbstractMetricsCollector):
     All jobs are divided into 3 classes -- "ontime" :), "delayed" :|, and "late" :(
     """
 
+    job_fields = {"exercise_id", "runtime_id", "spawn_ts", "limits", "duration", "compilation_ok"}
+
     def _get_expected_duration(self, job):
         estimate = self.duration_index.estimate_duration(job.exercise_id, job.runtime_id)
         if estimate:
@@ -24,9 +26,8 @@ class UserExperienceMetricsCollector(AbstractMetricsCollector):
 
         # create an index structure for job duration estimation
         self.duration_index = JobDurationIndex()
-        for job in ref_jobs:
-            if job.compilation_ok:
-                self.duration_index.add(job)
+        jobs = ref_jobs.jobs  # all ref. jobs of the store (columnar)
+        self.duration_index.add_many(jobs[jobs.get_column("compilation_ok").astype(bool)])
 
         # category thresholds as multipliers of expected durations
         self.threshold_ontime, self.threshold_delayed = thresholds
@@ -37,24 +38,46 @@ class UserExperienceMetricsCollector(AbstractMetricsCollector):
         self.jobs_late = 0
 
     def job_finished(self, job):
+        """Count the job in its category, returns the category name (so the collector may be embedded in others)."""
         delay = job.start_ts - job.spawn_ts
         expected_duration = self._get_expected_duration(job)
         ontime = max(expected_duration * self.threshold_ontime, 10.0)  # ontime / delayed threshold must be at least 10s
         delayed = max(expected_duration * self.threshold_delayed, 30.0)  # delayed / late threshold must be at least 30s
         if delay <= ontime:
             self.jobs_ontime += 1
+            category = "ontime"
         elif delay <= delayed:
             self.jobs_delayed += 1
+            category = "delayed"
         else:
             self.jobs_late += 1
+            category = "late"
 
         # the metrics is adjusting the expectations of the job duration dynamically
         if job.compilation_ok:
             self.duration_index.add(job)
+        return category
 
     def get_total_jobs(self):
         return self.jobs_ontime + self.jobs_delayed + self.jobs_late
 
-    def print(self):
+    def get_results(self):
+        return {"jobs": self.get_total_jobs(), "ontime": self.jobs_ontime, "delayed": self.jobs_delayed,
+                "late": self.jobs_late}
+
+    def merge(self, other):
+        # only the counters are merged (the duration index remains as it is)
+        self.jobs_ontime += other.jobs_ontime
+        self.jobs_delayed += other.jobs_delayed
+        self.jobs_late += other.jobs_late
+
+    def get_lower_bounds(self, total_jobs=None):
+        # the counters never decrease
+        return {"ontime": self.jobs_ontime, "delayed": self.jobs_delayed, "late": self.jobs_late}
+
+    def print(self, machine=False, verbose=False):
+        if machine:
+            print(format_results(self.get_results()))
+            return
         print("Total jobs: {}, on time: {}, delayed: {}, late: {}".format(
             self.get_total_jobs(), self.jobs_ontime, self.jobs_delayed, self.jobs_late))
@@ -0,0 +1,167 @@
+#
+# Partitioned simulation -- disjoint pools of workers dedicated to groups of jobs (by their worker_group_id).
+#
+# Workers are assigned to groups by the worker_group attribute (one group id or a list of them), workers without
+# the attribute form a pool for jobs of all other groups:
+#
+#   workers:
+#     - active: true
+#       worker_group: long
+#     - active: true  # serves default, special1, ...
+#
+# Workers with the same groups form one partition that has its own instances of the dispatcher, SA strategy,
+# and metrics collectors, so the partitions are independent simulations over the same time span. The job stream
+# is split by worker_group_id, and the metrics of the partitions are merged (see merge() of the collectors)
+# when the simulation ends. Since the partitions are independent, they may be simulated in separate processes.
+#
+
+import copy
+import numpy as np
+from jobs import JobBatch
+from simulation import Simulation
+
+
+def _get_worker_groups(worker):
+    groups = worker.get("worker_group") if isinstance(worker, dict) else None
+    if groups is None:
+        return None
+    return frozenset([groups] if isinstance(groups, str) else groups)
+
+
+def is_partitioned(configuration):
+    """Whether the configuration assigns workers to groups of jobs."""
+    workers = configuration.get("workers")
+    return isinstance(workers, list) and any(_get_worker_groups(worker) is not None for worker in workers)
+
+
+def get_partitions(configuration):
+    """Split the configuration into partitions, returns a list of (groups, configuration) pairs.
+
+    The groups is a frozenset of worker group ids (None for the pool that serves all other groups).
+    """
+    if configuration.get("slo"):
+        raise RuntimeError("SLO guards are not supported by partitioned simulations.")
+
+    partitions = {}
+    for worker in configuration["workers"]:
+        partitions.setdefault(_get_worker_groups(worker), []).append(worker)
+
+    result = []
+    assigned = set()
+    for groups, workers in partitions.items():
+        if groups is not None:
+            if groups & assigned:
+                raise RuntimeError("Worker groups {} are served by different pools of workers.".format(
+                    ", ".join(sorted(groups & assigned))))
+            assigned |= groups
+        partition = copy.deepcopy(configuration)
+        partition["workers"] = copy.deepcopy(workers)
+        if partition.get("engine") == "analytic":
+            partition["engine"] = "scan"  # analytic engine cannot align the time spans of the partitions
+        result.append((groups, partition))
+    return result
+
+
+class PartitionedSimulation:
+    """Simulation of independent pools of workers, each one serves jobs of its worker groups.
+
+    It has the same interface as Simulation (run, run_batch, get_job_fields, metrics). The metrics are available
+    (merged) after the simulation ends. If partitions (list of indices) are given, only these partitions are
+    simulated (jobs of the other partitions are ignored), which is used to run partitions in separate processes.
+    """
+
+    engine = "partitioned"
+
+    def __init__(self, configuration, ref_jobs=None, registry=None, partitions=None):
+        self.partitions = get_partitions(configuration)
+        selected = partitions if partitions is not None else range(len(self.partitions))
+        self.simulations = {idx: Simulation(self.partitions[idx][1], ref_jobs, registry) for idx in selected}
+        self.routes = {}  # worker group id -> partition index (cached)
+
+        self.started = False
+        self.metrics = []  # merged metrics of the partitions (filled when the simulation ends)
+        self.slo_guards = []
+        self.slo_violation = None
+
+    def _route(self, group):
+        """Get index of the partition that serves given worker group."""
+        if group not in self.routes:
+            catch_all = None
+            for idx, (groups, _) in enumerate(self.partitions):
+                if groups is None:
+                    catch_all = idx
+                elif group in groups:
+                    self.routes[group] = idx
+                    break
+            else:
+                if catch_all is None:
+                    raise RuntimeError("No workers are available for worker group '{}'.".format(group))
+                self.routes[group] = catch_all
+        return self.routes[group]
+
+    def get_job_fields(self):
+        """Union of job fields of the partitions (plus the worker group used for routing)."""
+        fields = {"worker_group_id"}
+        for simulation in self.simulations.values():
+            sim_fields = simulation.get_job_fields()
+            if sim_fields is None:
+                return None
+            fields.update(sim_fields)
+        return fields
+
+    def run_batch(self, jobs):
+        """Split a sequence of jobs (list or JobBatch sorted by spawn_ts) among the partitions.
+
+        All partitions start at the spawn time of the first job. Jobs in a JobBatch are not modified (the partitions
+        get job objects created from the batch), jobs in a list are passed to the partitions as they are.
+        """
+        if len(jobs) == 0:
+            return
+        if not self.started:
+            self.started = True
+            for simulation in self.simulations.values():
+                simulation.start(float(jobs[0].spawn_ts))
+
+        if isinstance(jobs, JobBatch):
+            groups, inverse = np.unique(jobs.get_column("worker_group_id"), return_inverse=True)
+            targets = np.array([self._route(group) for group in groups], dtype=int)[inverse]
+            for idx, simulation in self.simulations.items():
+                selected = jobs[targets == idx]
+                if len(selected):
+                    simulation.run_batch(selected.to_jobs())
+        else:
+            selected = {idx: [] for idx in self.simulations}
+            for job in jobs:
+                target = selected.get(self._route(job.worker_group_id))
+                if target is not None:
+                    target.append(job)
+            for idx, simulation in self.simulations.items():
+                simulation.run_batch(selected[idx])
+
+    def run(self, job):
+        """Add one job to its partition, or conclude the simulation if job is None (see Simulation.run)."""
+        if job:
+            self.run_batch([job])
+            return
+        for simulation in self.simulations.values():
+            simulation.run(None)
+        self.conclude()
+
+    def conclude(self):
+        """Align the ends of the finished partitions and merge their metrics."""
+        simulations = [self.simulations[idx] for idx in sorted(self.simulations)]
+        end_ts = max(simulation.ts for simulation in simulations)
+        for simulation in simulations:
+            simulation.advance(end_ts)  # periodic snapshots continue until the last partition ends
+
+        self.metrics = list(simulations[0].metrics)  # the collectors of the first partition accumulate the rest
+        for simulation in simulations[1:]:
+            for metric, other in zip(self.metrics, simulation.metrics):
+                metric.merge(other)
+
+
+def create_simulation(configuration, ref_jobs=None, registry=None):
+    """Create a simulation of given configuration (partitioned if workers are assigned to groups)."""
+    if is_partitioned(configuration):
+        return PartitionedSimulation(configuration, ref_jobs, registry)
+    return Simulation(configuration, ref_jobs, registry)
@@ -0,0 +1,129 @@
+#
+# Content-addressed cache of simulation results.
+#
+# A run is identified by a hash of everything that affects its results -- the resolved configuration, contents
+# of the data files (the hashes are taken from their caches when possible, see get_source_hash in dataset_cache.py),
+# the options restricting the simulated jobs, and the source code of the simulation core (all modules in this
+# directory) and the modules of the components (the modules imported by the components indirectly are not covered).
+# The cache is a directory of .json files (one per run) that hold the results of the metrics collectors
+# (get_results() dicts) and their printed (human-readable) output.
+#
+
+import io
+import os
+import glob
+import json
+import hashlib
+import contextlib
+from dataset_cache import get_file_hash, get_source_hash
+from interfaces import get_component_module, format_results
+
+CACHE_VERSION = 1
+
+def get_component_classes(configuration):
+    """Get fully qualified class names of all components in the configuration."""
+    specs = [configuration.get("dispatcher"), configuration.get("sa_strategy")] + list(configuration.get("metrics", []))
+    names = []
+    for spec in specs:
+        if isinstance(spec, dict):
+            spec = spec.get("class")
+        if isinstance(spec, str):
+            names.append(spec)
+    return names
+
+
+def get_sources_hash(configuration):
+    """Compute hash of the source code of the simulation core and the modules of the configured components."""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = glob.glob(os.path.join(base_dir, "*.py"))  # all modules of the simulation itself
+    for class_name in get_component_classes(configuration):
+        paths.append(os.path.abspath(get_component_module(class_name).__file__))
+
+    h = hashlib.sha1()
+    for path in sorted(set(paths)):
+        h.update(os.path.relpath(path, base_dir).encode("utf-8"))
+        h.update(get_file_hash(path).encode("utf-8"))
+    return h.hexdigest()
+
+
+def get_run_key(configuration, input_file, refs=None, limit=None, from_ts=None, to_ts=None, interning=None):
+    """Compute the key (hex string) that identifies results of a simulation run."""
+    descriptor = {
+        "version": CACHE_VERSION,
+        "configuration": configuration,
+        "input": get_source_hash(input_file),
+        "refs": get_source_hash(refs) if refs else None,
+        "interning": get_file_hash(interning) if interning and os.path.isfile(interning) else None,
+        "limit": limit,
+        "from_ts": from_ts,
+        "to_ts": to_ts,
+        "sources": get_sources_hash(configuration),
+    }
+    return hashlib.sha1(json.dumps(descriptor, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_entry(simulation):
+    """Create a cache entry from the metrics collectors of a finished simulation."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for metric in simulation.metrics:
+            metric.print()
+    results = [{"collector": type(metric).__name__, "results": metric.get_results()} for metric in simulation.metrics]
+    return {"results": results, "output": output.getvalue(), "slo_violation": simulation.slo_violation}
+
+
+def print_entry(entry, machine=False, scenario=None):
+    """Print the results of a run the same way the metrics collectors do (and the violated SLO if any).
+
+    If the scenario name is given, it is added to each machine-readable record (the output remains one JSON per line).
+    """
+    violation = entry.get("slo_violation")
+    if machine:
+        prefix = {"scenario": scenario} if scenario is not None else {}
+        for collector in entry["results"]:
+            print(format_results(dict(prefix, **collector["results"])))
+        if violation:
+            print(format_results(dict(prefix, slo_violation=violation)))
+    else:
+        print(entry["output"], end="")
+        if violation:
+            print("SLO violated (simulation aborted): {}".format(violation))
+
+
+class ResultCache:
+    """Directory with stored results of simulation runs (addressed by run keys)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def get(self, key):
+        """Get stored entry of given run (None if the run is not cached).
+
+        The entry is a dict with "results" (list of dicts with "collector" name and "results" of each collector),
+        "output" (printed output of the collectors), and "slo_violation" (message or None).
+        """
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r") as fp:
+            return json.load(fp)
+
+    def put(self, key, entry):
+        """Store an entry of given run (replaces the previous one)."""
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_path, path)  # the entry is replaced atomically (concurrent runs may share the cache)
+
+    def evict(self, key):
+        """Remove the entry of given run, returns True if it existed."""
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            return False
+        os.remove(path)
+        return True
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+#
+# Seek index that allows readers to jump (close) to a given spawn timestamp without parsing preceding rows.
+#
+# The index is a list of checkpoints (spawn_ts, compressed offset, uncompressed offset) taken every few rows.
+# It is stored next to the data file (with ".idx" suffix) in JSON format and built automatically on first use
+# (it is validated by the size and modification time of the data file, see check_source in dataset_cache.py).
+# For plain CSV files, the reader seeks directly to the offset. Regular (single-member) gzip files cannot be
+# entered in the middle, so the reader has to inflate (but not parse) the data before the checkpoint.
+# Alternatively, the data file may be recompressed into a block variant, where each block of rows is
+# a separate gzip member, so the reader can jump straight to the compressed offset of the checkpoint.
+#
+
+import io
+import os
+import json
+import gzip
+import argparse
+from dataset_cache import get_file_hash, get_file_stamp, check_source
+
+INDEX_VERSION = 1
+
+
+def get_index_path(path):
+    """Path to the seek index of given data file."""
+    return path + ".idx"
+
+
+def _get_spawn_ts(line, ts_column, delimiter):
+    return float(line.decode("utf-8").split(delimiter)[ts_column])
+
+
+def build_index(path, every=1000, delimiter=';'):
+    """Build seek index of given data file (checkpoint is taken every given number of rows) and save it."""
+    fp = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    header = fp.readline()
+    ts_column = header.decode("utf-8").rstrip("\r\n").split(delimiter).index("spawn_ts")
+    offset = len(header)
+    checkpoints = []
+    row = 0
+    for line in fp:
+        if row % every == 0:
+            checkpoints.append([_get_spawn_ts(line, ts_column, delimiter), None, offset])
+        offset += len(line)
+        row += 1
+    fp.close()
+
+    return _save_index(path, header, checkpoints, False)
+
+
+def recompress(path, out_path, every=1000, delimiter=';'):
+    """Recompress the data file into block gzip (each block of rows is separate gzip member) and build its index."""
+    fp = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+    header = fp.readline()
+    ts_column = header.decode("utf-8").rstrip("\r\n").split(delimiter).index("spawn_ts")
+    checkpoints = []
+    with open(out_path, "wb") as out:
+        out.write(gzip.compress(header))
+        offset = len(header)
+        block = []
+        for line in fp:
+            if not block:
+                checkpoints.append([_get_spawn_ts(line, ts_column, delimiter), out.tell(), offset])
+            block.append(line)
+            offset += len(line)
+            if len(block) >= every:
+                out.write(gzip.compress(b"".join(block)))
+                block = []
+        if block:
+            out.write(gzip.compress(b"".join(block)))
+    fp.close()
+
+    return _save_index(out_path, header, checkpoints, True)
+
+
+def _save_index(path, header, checkpoints, blocks):
+    index = {
+        "version": INDEX_VERSION,
+        "source_hash": get_file_hash(path),
+        "source_stamp": get_file_stamp(path),
+        "header": header.decode("utf-8"),
+        "blocks": blocks,
+        "checkpoints": checkpoints,
+    }
+    _write_index(path, index)
+    return index
+
+
+def _write_index(path, index):
+    index_path = get_index_path(path)
+    tmp_path = "{}.{}.tmp".format(index_path, os.getpid())
+    with open(tmp_path, "w") as fp:
+        json.dump(index, fp)
+    os.replace(tmp_path, index_path)
+
+
+def load_index(path, build=True, delimiter=';', verify=False):
+    """Load seek index of given file, the index is built if it does not exist or it is outdated (and build is set).
+
+    The data file is hashed only if its modification time has changed or verify is set (see check_source).
+    """
+    index_path = get_index_path(path)
+    if os.path.isfile(index_path):
+        with open(index_path, "r") as fp:
+            index = json.load(fp)
+        stamp = index.get("source_stamp")
+        if index.get("version") == INDEX_VERSION and check_source(index, path, verify):
+            if index["source_stamp"] != stamp:
+                _write_index(path, index)
+            return index
+
+    return build_index(path, delimiter=delimiter) if build else None
+
+
+def open_at(path, index, ts):
+    """Open the data file as text positioned at the beginning of a row which is at or before the first row
+    with spawn_ts >= ts. The header is not included (it is in the index).
+    """
+    start = None  # last checkpoint that is strictly before ts (rows with the same ts may precede the checkpoint)
+    for checkpoint in index["checkpoints"]:
+        if checkpoint[0] >= ts:
+            break
+        start = checkpoint
+    header_length = len(index["header"].encode("utf-8"))
+
+    if path.endswith(".gz") and index["blocks"]:
+        raw = open(path, "rb")
+        if start is None:
+            fp = gzip.GzipFile(fileobj=raw)
+            fp.seek(header_length)
+        else:
+            raw.seek(start[1])
+            fp = gzip.GzipFile(fileobj=raw)
+    else:
+        fp = gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+        fp.seek(start[2] if start is not None else header_length)
+
+    return io.TextIOWrapper(fp)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build seek index (by spawn timestamp) of data files.")
+    parser.add_argument("input_file", type=str, help="Path to .csv or .csv.gz data file.")
+    parser.add_argument("--every", type=int, default=1000, help="How many rows are between two checkpoints.")
+    parser.add_argument("--recompress", type=str, required=False,
+                        help="Path to a new .csv.gz file where the data are recompressed into separate blocks "
+                        "(so the reader can jump directly to a checkpoint).")
+    args = parser.parse_args()
+
+    if args.recompress:
+        index = recompress(args.input_file, args.recompress, args.every)
+        print("{}: recompressed into {} blocks".format(args.recompress, len(index["checkpoints"])))
+    else:
+        index = build_index(args.input_file, args.every)
+        print("{}: {} checkpoints".format(args.input_file, len(index["checkpoints"])))
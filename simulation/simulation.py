@@ -1,19 +1,46 @@
-from workers import WorkerQueue
-from interfaces import create_component
+import copy
+import math
+from workers import WorkerQueue, CompletionHeap
+from interfaces import AbstractDispatcher, AbstractSelfAdaptingStrategy, create_component
+from slo import get_guards
 
 
-def _create_instance(config, ref_jobs):
+def count_ticks(ts_from, ts_to, period):
+    """Number of periodic ticks (ts_from + i * period) in the [ts_from, ts_to) interval."""
+    ticks = int(math.ceil((ts_to - ts_from) / period))
+    while ticks > 0 and ts_from + (ticks - 1) * period >= ts_to:
+        ticks -= 1
+    while ts_from + ticks * period < ts_to:
+        ticks += 1
+    return ticks
+
+
+def _inject(value, injections):
+    """Replace injected argument (string prefixed with @@) with its value."""
+    if isinstance(value, str) and value.startswith("@@"):
+        if value not in injections:
+            raise RuntimeError("Unknown injected argument '{}'.".format(value))
+        return injections[value]
+    return value
+
+
+def _overrides(obj, base_class, method):
+    """Check whether the object overrides given method of the base class."""
+    return getattr(type(obj), method, None) is not getattr(base_class, method)
+
+
+def _create_instance(config, injections):
     """Helper function that creates instance of a component from configuration."""
     if isinstance(config, dict):
         # Basic type checks
         if ("class" not in config or "args" not in config):
             raise RuntimeError("Component configuration descriptor must have 'class' and 'args' properties.")
 
-        # argument "@@ref_jobs" is replaced with ref_jobs list (special injection)
+        # injected arguments (e.g., "@@ref_jobs") are replaced with actual values
         if isinstance(config["args"], dict):
-            args = {key: ref_jobs if val == "@@ref_jobs" else val for key, val in config["args"].items()}
+            args = {key: _inject(val, injections) for key, val in config["args"].items()}
         elif isinstance(config["args"], list):
-            args = [ref_jobs if arg == "@@ref_jobs" else arg for arg in config["args"]]
+            args = [_inject(arg, injections) for arg in config["args"]]
         else:
             raise RuntimeError("Invalid component constructor args given in configuration descriptor.")
 
@@ -25,19 +52,39 @@ def _create_instance(config, ref_jobs):
 class Simulation:
     """Main simulation class. Wraps the algorithm and acts as component container."""
 
-    def __init__(self, configuration, ref_jobs=None):
+    # job fields that are used by the simulation itself (and the worker queues)
+    CORE_JOB_FIELDS = {"spawn_ts", "duration", "limits"}
+
+    def __init__(self, configuration, ref_jobs=None, registry=None):
+        # values of injected arguments of the components
+        injections = {
+            "@@ref_jobs": ref_jobs,
+            "@@registry": registry,
+            "@@simulation": self,  # components may fork the simulation (look-ahead)
+        }
+
         # load parameters from configuration and instantiate necessary components
         self.metrics = []
         if "metrics" in configuration:
             for metric in configuration["metrics"]:
-                self.metrics.append(_create_instance(metric, ref_jobs))
+                self.metrics.append(_create_instance(metric, injections))
+
+        # guards of service level objectives, the simulation is aborted when any of them is violated
+        self.slo_guards = get_guards(configuration, self.metrics)
+        self.slo_violation = None  # message describing the violated objective
+        self.total_jobs = None  # number of jobs of the whole simulation (if known, tightens the guards)
 
-        self.dispatcher = _create_instance(configuration["dispatcher"], ref_jobs)
+        self.dispatcher = _create_instance(configuration["dispatcher"], injections)
         if "sa_strategy" in configuration:
-            self.sa_strategy = _create_instance(configuration["sa_strategy"], ref_jobs)
+            self.sa_strategy = _create_instance(configuration["sa_strategy"], injections)
         else:
             self.sa_strategy = None  # strategy can be empty (i.e., no MAPE-K) for baseline ref. measurements
 
+        # groups of jobs spawned at the same time are passed to the components at once only if all of them
+        # implement the batch interface (otherwise, they are processed one by one)
+        self.batch_hooks = _overrides(self.dispatcher, AbstractDispatcher, "dispatch_batch") and (
+            self.sa_strategy is None or _overrides(self.sa_strategy, AbstractSelfAdaptingStrategy, "do_adapt_batch"))
+
         # how often MAPE-K is called (in seconds)
         self.sa_period = float(configuration["period"]) if "period" in configuration else 60.0  # one minute is default
 
@@ -53,15 +100,114 @@ class Simulation:
             for i in range(int(configuration["workers"])):
                 self.workers.append(WorkerQueue())
 
+        # whether idle spans (no jobs in queues) may be skipped at once instead of invoking MAPE-K periodically
+        self.fast_forward = bool(configuration["fast_forward"]) if "fast_forward" in configuration else True
+
+        # simulation engine that determines which jobs have finished when the time advances
+        # "scan" engine checks all worker queues, "event" engine uses a heap of the nearest finish timestamps,
+        # "analytic" engine computes static configurations over whole blocks of jobs (falls back to "scan")
+        self.engine = configuration["engine"] if "engine" in configuration else "scan"
+        self.analytic = None
+        if self.engine == "analytic":
+            from analytic import AnalyticEngine  # imported lazily (the engine depends on this module)
+            if AnalyticEngine.is_supported(self):
+                self.analytic = AnalyticEngine(self)
+                self.completions = None
+            else:
+                self.engine = "scan"
+
+        if self.engine == "scan":
+            self.completions = None
+        elif self.engine == "event":
+            self.completions = CompletionHeap(self.workers)
+        elif self.engine != "analytic":
+            raise RuntimeError("Unknown simulation engine '{}'.".format(self.engine))
+
         # remaining simulation variables
         self.ts = 0.0  # simulation time
         self.next_mapek_ts = 0.0  # when the next MAPE-K call is scheduled
 
+    def fork(self, metrics=None, sa_strategy=None):
+        """Create a lightweight copy of the simulation that may be run forward (e.g., on synthetic jobs).
+
+        The forked worker queues share the jobs with the original queues (copy-on-write), the dispatcher is
+        copied by its fork() method. Metrics are forked by their fork() method, or the given (fresh) collectors
+        are used instead (an initial snapshot is taken). The fork runs without SA strategy unless one is given
+        (it gets initialized). Jobs passed to the fork are modified (start_ts, finish_ts), so they must not be
+        shared with the original simulation. Changes of the fork do not affect the original simulation.
+        """
+        if self.analytic:
+            raise RuntimeError("Analytic engine does not support forking of the simulation.")
+
+        fork = copy.copy(self)
+        fork.workers = [worker.fork() for worker in self.workers]
+        fork.completions = CompletionHeap(fork.workers) if self.completions is not None else None
+        fork.dispatcher = self.dispatcher.fork(self.ts, fork.workers)
+        fork.sa_strategy = sa_strategy
+        if sa_strategy:
+            sa_strategy.init(self.ts, fork.dispatcher, fork.workers)
+        fork.batch_hooks = _overrides(fork.dispatcher, AbstractDispatcher, "dispatch_batch") and (
+            sa_strategy is None or _overrides(sa_strategy, AbstractSelfAdaptingStrategy, "do_adapt_batch"))
+
+        fork.slo_guards = []  # objectives apply only to the original simulation
+        fork.slo_violation = None
+        if metrics is None:
+            fork.metrics = [metric.fork() for metric in self.metrics]
+        else:
+            fork.metrics = list(metrics)
+            for metric in fork.metrics:
+                metric.snapshot(self.ts, fork.workers)
+        return fork
+
+    def start(self, ts):
+        """Start the simulation at given time (otherwise it starts when the first job arrives)."""
+        if self.analytic:
+            raise RuntimeError("Analytic engine does not support explicit start of the simulation.")
+        if self.ts == 0.0:
+            self.__start_simulation(ts)
+
+    def advance(self, ts):
+        """Advance the simulation time up to ts without adding new jobs (e.g., to run a fork forward)."""
+        if self.analytic:
+            raise RuntimeError("Analytic engine does not support explicit advancing of the simulation.")
+        if ts > self.ts:
+            self.__advance_time(ts)
+
+    def set_total_jobs(self, total_jobs):
+        """Set the number of jobs of the whole simulation (so the SLO guards may detect violations sooner)."""
+        self.total_jobs = total_jobs
+
+    def check_slo(self, final=False):
+        """Check the SLO guards, returns True if the simulation was aborted (an objective is violated).
+
+        Unless final is set, only the violations that are certain regardless of the future jobs are detected.
+        """
+        if self.slo_violation is None:
+            for guard in self.slo_guards:
+                self.slo_violation = guard.check_final() if final else guard.check(self.total_jobs)
+                if self.slo_violation is not None:
+                    break
+        return self.slo_violation is not None
+
     def register_metrics(self, *metrics):
         """Additional metrics components may be registered via this method (mainly for debugging purposes)."""
         for m in metrics:
             self.metrics.append(m)
 
+    def get_job_fields(self):
+        """Get the names of job fields used by the simulation and its components (None if all fields are needed).
+
+        Components declare the fields they read in job_fields attribute, so the reader may skip the other ones.
+        """
+        fields = set(self.CORE_JOB_FIELDS)
+        for component in [self.dispatcher, self.sa_strategy] + self.metrics:
+            if component is None:
+                continue
+            if component.job_fields is None:
+                return None
+            fields.update(component.job_fields)
+        return fields
+
     def __start_simulation(self, ts):
         """Just-in-time initialization."""
         self.ts = ts
@@ -77,18 +223,54 @@ class Simulation:
             metric.snapshot(self.ts, self.workers)
 
     def __advance_time_in_workers(self):
+        if self.completions is not None:
+            # event engine, only queues with finished jobs are touched (jobs are reported in worker order)
+            for job in self.completions.advance_time(self.ts):
+                for metric in self.metrics:
+                    metric.job_finished(job)
+            return
+
         for worker in self.workers:
             done = worker.advance_time(self.ts)
             for job in done:
                 for metric in self.metrics:
                     metric.job_finished(job)
 
+    def __is_idle(self):
+        if self.completions is not None:
+            return self.completions.get_next_finish_ts() is None
+        return all(worker.jobs_count() == 0 for worker in self.workers)
+
+    def __fast_forward(self, ts):
+        """Try to skip all MAPE-K invocations from the current time up to ts at once.
+
+        This is possible only when the system is idle (all queues are empty) and the SA strategy agrees.
+        Returns True if the span was skipped.
+        """
+        # number of periodic invocations in [self.ts, ts)
+        ticks = count_ticks(self.ts, ts, self.sa_period)
+
+        if ticks < 2 or not self.__is_idle():
+            return False
+
+        last_ts = self.ts + (ticks - 1) * self.sa_period
+        if self.sa_strategy and not self.sa_strategy.fast_forward(last_ts, self.dispatcher, self.workers):
+            return False
+
+        for metric in self.metrics:
+            metric.fast_forward(self.ts, ticks, self.sa_period, self.workers)
+        self.ts = last_ts
+        self.next_mapek_ts = last_ts + self.sa_period
+        return True
+
     def __advance_time(self, ts):
         """Advance the simulation to given point in time, invoking MAPE-K periodically."""
         if self.metrics or self.sa_strategy:
             while self.next_mapek_ts < ts:
                 self.ts = self.next_mapek_ts
                 self.__advance_time_in_workers()
+                if self.fast_forward and self.__fast_forward(ts):
+                    continue
 
                 # take a measurement for statistics
                 for metric in self.metrics:
@@ -102,12 +284,73 @@ class Simulation:
         self.ts = ts
         self.__advance_time_in_workers()
 
+    def __run_group(self, jobs):
+        """Process a group of jobs spawned at the same time (the time is advanced only once)."""
+        if self.ts == 0.0:
+            self.__start_simulation(jobs[0].spawn_ts)
+        self.__advance_time(jobs[0].spawn_ts)
+
+        if self.batch_hooks:
+            if self.sa_strategy:
+                self.sa_strategy.do_adapt_batch(self.ts, self.dispatcher, self.workers, jobs)
+            self.dispatcher.dispatch_batch(jobs, self.workers)
+            return  # jobs that take no time are finished when the time advances next (as after run() of the last job)
+
+        last = len(jobs) - 1
+        for idx, job in enumerate(jobs):
+            if self.sa_strategy:
+                self.sa_strategy.do_adapt(self.ts, self.dispatcher, self.workers, job)
+            self.dispatcher.dispatch(job, self.workers)
+            if idx < last and job.finish_ts <= self.ts:
+                # job that takes no time is finished before the next job of the group (as run() of the next job
+                # advances the time), the last one is finished when the time advances next
+                self.__advance_time_in_workers()
+
+    def run_batch(self, jobs):
+        """Advance the simulation over a sequence of jobs (list or JobBatch sorted by spawn_ts).
+
+        The outcome is the same as if run() was invoked for each job; however, the jobs spawned at the same time
+        form a group that pays the time-advance cost only once. The groups are passed to the dispatch_batch()
+        and do_adapt_batch() hooks if the components implement them.
+        Once an SLO is violated (checked after each batch), the jobs are ignored.
+        """
+        if self.slo_violation is not None:
+            return
+
+        if self.analytic:
+            self.analytic.add_jobs(jobs)
+            if self.slo_guards:
+                self.check_slo()
+            return
+
+        start = 0
+        while start < len(jobs):
+            ts = jobs[start].spawn_ts
+            end = start + 1
+            while end < len(jobs) and jobs[end].spawn_ts == ts:
+                end += 1
+            self.__run_group(jobs[start:end])
+            start = end
+        if self.slo_guards:
+            self.check_slo()
+
     def run(self, job):
         """Advance the simulation up to the point when new job is being spawned and add it to the queues.
 
         The simulation may perform many internal steps (e.g., invoke MAPE-K multiple times) in one run invocation.
         If job is None, the run will perform final steps and conclude the simulation.
+        Once an SLO is violated, the simulation is aborted (the jobs are ignored and it is not concluded).
         """
+        if self.slo_violation is not None:
+            return
+
+        if self.analytic:
+            if job:
+                self.analytic.add_jobs([job])
+            else:
+                self.analytic.finish()
+                self.check_slo(final=True)
+            return
 
         # first run, initialize simulation
         if self.ts == 0.0:
@@ -127,3 +370,4 @@ class Simulation:
                 if worker_end_ts:
                     end_ts = max(end_ts, worker.get_finish_ts())
             self.__advance_time(end_ts + self.sa_period)
+            self.check_slo(final=True)
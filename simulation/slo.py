@@ -0,0 +1,73 @@
+#
+# Guards of service level objectives (SLO) that allow a simulation to be aborted early.
+#
+# The objectives are given in the configuration as upper bounds of the results of the metrics collectors,
+# the results are addressed by the collector class name and the result key (as in get_results()):
+#
+#   slo:
+#     JobDelayMetricsCollector.avg_delay: 30.0  # absolute bound
+#     UserExperienceMetricsCollector.late: 5%  # bound relative to the number of jobs (of the same collector)
+#
+# A collector may provide lower bounds of its final results at any point of the simulation (get_lower_bounds()),
+# so a violated objective is detected as soon as the bound is certainly exceeded, regardless of the jobs to come.
+#
+
+
+class SLOGuard:
+    """Guard of one objective (upper bound of a result of a metrics collector)."""
+
+    def __init__(self, name, bound, metrics):
+        self.name = name
+        if "." not in name:
+            raise RuntimeError("SLO '{}' must be in the form CollectorClass.result_key.".format(name))
+        class_name, self.key = name.rsplit(".", 1)
+
+        self.metric = None
+        for metric in metrics:
+            if type(metric).__name__ == class_name:
+                self.metric = metric
+                break
+        if self.metric is None or self.key not in self.metric.get_results():
+            raise RuntimeError("SLO '{}' does not refer to a result of any configured metrics collector.".format(name))
+
+        # bound given in percents is relative to the number of jobs
+        self.relative = isinstance(bound, str) and bound.strip().endswith("%")
+        self.bound = float(bound.strip()[:-1]) / 100.0 if self.relative else float(bound)
+        if self.relative and "jobs" not in self.metric.get_results():
+            raise RuntimeError("SLO '{}' is relative, but the collector does not count jobs.".format(name))
+
+    def _get_limit(self, jobs):
+        if not self.relative:
+            return self.bound
+        return self.bound * jobs if jobs is not None else None
+
+    def _format(self, value, limit):
+        return "{} = {} exceeds {}".format(self.name, value, limit)
+
+    def check(self, total_jobs=None):
+        """Check whether the objective is certainly violated, returns a message or None.
+
+        The total_jobs is the number of jobs of the whole simulation (None if unknown, some bounds cannot be
+        established then).
+        """
+        value = self.metric.get_lower_bounds(total_jobs).get(self.key)
+        limit = self._get_limit(total_jobs)
+        if value is not None and limit is not None and value > limit:
+            return "{} (at least)".format(self._format(value, limit))
+        return None
+
+    def check_final(self):
+        """Check the objective at the end of the simulation (all jobs are finished), returns a message or None."""
+        results = self.metric.get_results()
+        value = results[self.key]
+        limit = self._get_limit(results.get("jobs"))
+        if value > limit:
+            return self._format(value, limit)
+        return None
+
+
+def get_guards(configuration, metrics):
+    """Create the guards of the objectives given in the configuration (empty list if there are none)."""
+    if not configuration.get("slo"):
+        return []
+    return [SLOGuard(name, bound, metrics) for name, bound in configuration["slo"].items()]
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+#
+# Parameter sweep runner. A sweep file holds a base configuration and a grid of values of selected configuration
+# parameters; the simulation is executed for every combination of the values on a pool of processes.
+#
+# The parameters are addressed by dotted paths in the configuration (list items are addressed by their index,
+# "*" stands for all items of a list), several paths separated by commas receive the same value:
+#
+#   base: user_experience.yaml  # path relative to the sweep file (or inline configuration)
+#   grid:
+#     period: [30, 60, 120]
+#     sa_strategy.args.0: [1, 2, 3]  # max. number of long queues
+#     workers.1.limit,workers.2.limit,workers.3.limit: [20.0, 30.0]
+#
+# The data files are converted into binary caches (see dataset_cache.py) before the runs start, so the workers
+# only memory-map the parsed columns (the pages are shared by all processes) instead of parsing the files again.
+#
+
+import os
+import sys
+import csv
+import copy
+import time
+import argparse
+import itertools
+import multiprocessing
+from main import get_configuration, load_reference_jobs, get_job_fields, simulate
+from dataset_cache import ensure_cache, count_jobs, intern_dataset
+from jobs import JobReader, InternRegistry
+from partitioned import create_simulation
+from results_cache import ResultCache, get_run_key, get_entry
+
+try:
+    import resource
+except ImportError:
+    resource = None  # peak memory is not measured on platforms without resource module
+
+
+def set_parameter(configuration, path, value):
+    """Set a value in the configuration addressed by a dotted path (list indices are numbers, * means all items)."""
+    nodes = [configuration]
+    keys = path.split(".")
+    for key in keys[:-1]:
+        nodes = [child for node in nodes for child in _get_children(node, key, path)]
+    for node in nodes:
+        if isinstance(node, list):
+            if keys[-1] == "*":
+                node[:] = [copy.deepcopy(value) for _ in node]
+            else:
+                node[int(keys[-1])] = copy.deepcopy(value)
+        else:
+            node[keys[-1]] = copy.deepcopy(value)
+
+
+def _get_children(node, key, path):
+    if isinstance(node, list):
+        return node if key == "*" else [node[int(key)]]
+    if not isinstance(node, dict) or key not in node:
+        raise RuntimeError("Parameter path '{}' does not exist in the configuration.".format(path))
+    return [node[key]]
+
+
+def expand_grid(base, grid):
+    """Generate (parameters, configuration) pairs for all combinations of the grid values."""
+    names = list(grid)
+    for values in itertools.product(*[grid[name] for name in names]):
+        configuration = copy.deepcopy(base)
+        for name, value in zip(names, values):
+            for path in name.split(","):
+                set_parameter(configuration, path.strip(), value)
+        yield dict(zip(names, values)), configuration
+
+
+def get_sweep(sweep_file):
+    """Load the sweep file, returns base configuration and the grid."""
+    sweep = get_configuration(sweep_file)
+    if "base" not in sweep or "grid" not in sweep:
+        raise RuntimeError("Sweep file must have 'base' and 'grid' properties.")
+    base = sweep["base"]
+    if isinstance(base, str):
+        base = get_configuration(os.path.join(os.path.dirname(sweep_file), base))
+    return base, sweep["grid"]
+
+
+def get_metric_results(collectors):
+    """Collect results of all metrics collectors (cache entry "results") into one dict.
+
+    The keys are prefixed by the collector class names.
+    """
+    results = {}
+    for idx, collector in enumerate(collectors):
+        prefix = collector["collector"]
+        if any(other["collector"] == prefix for other in collectors[:idx]):
+            prefix += "#{}".format(idx)  # more collectors of the same type
+        for key, value in collector["results"].items():
+            results[prefix + "." + key] = value
+    return results
+
+
+def run_task(task):
+    """Execute one simulation of the sweep (invoked in a pool process)."""
+    idx, configuration, args = task
+    start_time = time.perf_counter()
+
+    entry = None
+    if args.result_cache:
+        cache = ResultCache(args.result_cache)
+        key = get_run_key(configuration, args.input_file, args.refs, args.limit, args.from_ts, args.to_ts)
+        entry = cache.get(key) if not args.refresh else None
+
+    if entry is None:
+        registry = InternRegistry()
+        ref_jobs = load_reference_jobs(args.refs, registry=registry) if args.refs else None
+        simulation = create_simulation(configuration, ref_jobs, registry)
+        intern_dataset(args.input_file, registry, get_job_fields([simulation]))
+        total_jobs = count_jobs(args.input_file, args.from_ts, args.to_ts)
+        if total_jobs is not None and simulation.slo_guards:
+            simulation.set_total_jobs(min(total_jobs, args.limit))  # SLO guards may abort the run sooner
+        reader = JobReader(fields=get_job_fields([simulation]), registry=registry)
+        reader.open(args.input_file, from_ts=args.from_ts)
+        simulate([simulation], reader, args.limit, args.to_ts)
+        simulation.run(None)
+        reader.close()
+
+        entry = get_entry(simulation)
+        if args.result_cache:
+            cache.put(key, entry)
+
+    results = get_metric_results(entry["results"])
+    if entry.get("slo_violation"):
+        results["slo_violation"] = entry["slo_violation"]
+    results["wall_time"] = time.perf_counter() - start_time
+    if resource is not None:
+        # the process runs only this task, so its peak is the peak of the simulation (ru_maxrss is in kB)
+        results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return idx, results
+
+
+def write_table(fp, rows):
+    """Write the results (list of dicts) as a CSV table."""
+    columns = []
+    for row in rows:
+        columns.extend(name for name in row if name not in columns)
+    writer = csv.DictWriter(fp, fieldnames=columns, delimiter=';', lineterminator="\n")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({name: (value if not isinstance(value, (list, dict)) else str(value))
+                         for name, value in row.items()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run simulations for all combinations of parameter values.")
+    parser.add_argument("input_file", type=str, help="Path to the input .csv or .csv.gz file with jobs log.")
+    parser.add_argument("--sweep", type=str, required=True, help="Path to yaml file with the sweep (base and grid).")
+    parser.add_argument("--refs", type=str, required=False,
+                        help="Path to .csv or .csv.gz file with log with jobs of reference solutions.")
+    parser.add_argument("--limit", type=int, default=1000000000,
+                        help="Maximal number of jobs to be read from the input file.")
+    parser.add_argument("--from-ts", type=float, required=False,
+                        help="Only jobs spawned at or after this unix timestamp are simulated.")
+    parser.add_argument("--to-ts", type=float, required=False,
+                        help="Only jobs spawned before this unix timestamp are simulated.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(),
+                        help="Number of simulations running in parallel (all cores by default).")
+    parser.add_argument("--output", type=str, required=False,
+                        help="Path to .csv file where the table of results is saved (printed to std. output if missing).")
+    parser.add_argument("--result-cache", type=str, required=False,
+                        help="Path to a directory where results of runs are cached (see main.py).")
+    parser.add_argument("--refresh", default=False, action="store_true",
+                        help="If present, cached results are ignored (the simulations are executed again).")
+    args = parser.parse_args()
+
+    base, grid = get_sweep(args.sweep)
+    points = list(expand_grid(base, grid))
+
+    # parsed data are shared via memory-mapped caches
+    for path in [args.input_file, args.refs]:
+        if path and ensure_cache(path):
+            print("Cache of {} was built.".format(path), file=sys.stderr)
+
+    # each task runs in a fresh process, so the peak memory of each run is measured separately
+    rows = [None] * len(points)
+    tasks = [(idx, configuration, args) for idx, (_, configuration) in enumerate(points)]
+    with multiprocessing.Pool(args.processes, maxtasksperchild=1) as pool:
+        for idx, results in pool.imap_unordered(run_task, tasks):
+            rows[idx] = dict(points[idx][0], **results)
+            print("Run {} of {} finished in {:.1f} s.".format(idx + 1, len(points), results["wall_time"]),
+                  file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            write_table(fp, rows)
+    else:
+        write_table(sys.stdout, rows)
@@ -1,3 +1,26 @@
+import heapq
+from bisect import bisect_right
+
+
+class WorkerQueueObserver:
+    """Base class for objects that need to be notified about changes in worker queues.
+
+    Observers are registered via WorkerQueue.add_observer(); all methods are empty placeholders,
+    so the derived classes override only the notifications they are interested in.
+    """
+
+    def job_enqueued(self, worker, job):
+        """Called right after a job was placed at the end of the worker queue."""
+        pass
+
+    def jobs_removed(self, worker, jobs):
+        """Called right after finished jobs were removed from the front of the worker queue."""
+        pass
+
+    def attribute_changed(self, worker, name, old_value):
+        """Called right after an attribute of the worker was set (old_value is None if it did not exist)."""
+        pass
+
 
 class WorkerQueue:
     """Main abstraction that represents jobs waiting for a particular worker.
@@ -8,8 +31,43 @@ class WorkerQueue:
 
     def __init__(self, **attributes):
         """The constructor gets initial attributes as named parameters."""
+        # The jobs are kept in a list where the front of the queue is at self.head index.
+        # Finished jobs are not removed one by one, the list is compacted once the head gets far enough.
         self.jobs = []
+        self.finish_ts = []  # finish timestamps of the jobs (parallel to self.jobs, used for binary search)
+        self.head = 0
+        self.limits_sum = 0.0  # running sum of limits of the jobs in the queue
         self.attributes = attributes
+        self.observers = []
+        self.shared = False  # whether the lists are shared with a fork (copied before they are modified)
+
+    def fork(self):
+        """Create a copy of the queue (without observers) for a forked simulation.
+
+        The copy shares the lists of jobs with this queue until one of them is modified (copy-on-write),
+        so forking is cheap even if the queues are long. The jobs themselves are shared.
+        """
+        clone = WorkerQueue.__new__(WorkerQueue)
+        clone.jobs = self.jobs
+        clone.finish_ts = self.finish_ts
+        clone.head = self.head
+        clone.limits_sum = self.limits_sum
+        clone.attributes = dict(self.attributes)
+        clone.observers = []
+        clone.shared = True
+        self.shared = True
+        return clone
+
+    def _unshare(self):
+        """Take private copies of the lists (only the jobs that are still in the queue)."""
+        self.jobs = self.jobs[self.head:]
+        self.finish_ts = self.finish_ts[self.head:]
+        self.head = 0
+        self.shared = False
+
+    def add_observer(self, observer):
+        """Register an observer (WorkerQueueObserver) which is notified about changes of this queue."""
+        self.observers.append(observer)
 
     def get_attribute(self, name):
         """Safe getter that returns attribute of given name or None if the attribute does not exist."""
@@ -19,31 +77,215 @@ class WorkerQueue:
 
     def set_attribute(self, name, value):
         """Setter for attributes. This method is expected to be used by self-adapting algorithm."""
+        old_value = self.attributes.get(name)
         self.attributes[name] = value
+        for observer in self.observers:
+            observer.attribute_changed(self, name, old_value)
 
     def jobs_count(self):
         """Length of the queue."""
-        return len(self.jobs)
+        return len(self.jobs) - self.head
+
+    def get_head_finish_ts(self):
+        """Get finish timestamp of the first (running) job in the queue, None if the queue is empty."""
+        return self.finish_ts[self.head] if self.head < len(self.jobs) else None
 
     def get_finish_ts(self):
         """Get finish timestamp of last job in the queue, None if the queue is empty."""
-        return self.jobs[-1].finish_ts if self.jobs else None
+        return self.finish_ts[-1] if self.head < len(self.jobs) else None
+
+    def get_remaining_work(self, ts):
+        """Total time (in seconds) the worker needs to process all jobs in the queue (from given timestamp)."""
+        return max(self.finish_ts[-1] - ts, 0.0) if self.head < len(self.jobs) else 0.0
+
+    def get_limits_sum(self):
+        """Sum of time limits of all jobs in the queue."""
+        return self.limits_sum
 
     # Methods used by the simulation to manage jobs
 
     def enqueue(self, job):
         """Place another job at the end of the queue."""
-        job.enqueue(self.jobs[-1] if self.jobs else None)
+        if self.shared:
+            self._unshare()
+        job.enqueue(self.jobs[-1] if self.head < len(self.jobs) else None)
         self.jobs.append(job)
+        self.finish_ts.append(job.finish_ts)
+        self.limits_sum += job.limits
+        for observer in self.observers:
+            observer.job_enqueued(self, job)
 
     def advance_time(self, ts):
         """Advance time to a certain timestamp. Finished jobs are removed from the queue and returned."""
-        res = []
-        if self.jobs:
-            i = 0
-            while i < len(self.jobs) and self.jobs[i].finish_ts <= ts:
-                i += 1
-            res = self.jobs[:i]  # jobs that are finished (after ts)
-            self.jobs = self.jobs[i:]  # remaining jobs
+        end = bisect_right(self.finish_ts, ts, self.head)
+        if end == self.head:
+            return []
+
+        res = self.jobs[self.head:end]  # jobs that are finished (after ts)
+        if end == len(self.jobs):
+            # the queue is empty, start over (this also resets accumulated rounding errors)
+            self.jobs = []
+            self.finish_ts = []
+            self.head = 0
+            self.limits_sum = 0.0
+            self.shared = False
+        else:
+            for job in res:
+                self.limits_sum -= job.limits
+            self.head = end
+            if self.head > 64 and self.head * 2 > len(self.jobs):
+                # compact the list when finished jobs occupy more than half of it
+                if self.shared:
+                    self._unshare()
+                else:
+                    del self.jobs[:self.head]
+                    del self.finish_ts[:self.head]
+                    self.head = 0
+
+        for observer in self.observers:
+            observer.jobs_removed(self, res)
+        return res
+
+
+class CompletionHeap(WorkerQueueObserver):
+    """Global min-heap of the finish timestamps of the front (running) jobs of all worker queues.
+
+    It is used by the event-driven simulation engine, so that only the queues where a job has actually
+    finished are touched when the simulation time advances. Each queue has at most one record in the heap
+    (its front job), the record is refreshed whenever the front job is removed or an empty queue gets a job.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.heap = []  # records (finish_ts, worker_index)
+        self.indices = {}  # worker -> index of the worker (used for deterministic tie-breaking)
+        for idx, worker in enumerate(workers):
+            self.indices[worker] = idx
+            worker.add_observer(self)
+            self._push(idx)
 
+    def _push(self, idx):
+        finish_ts = self.workers[idx].get_head_finish_ts()
+        if finish_ts is not None:
+            heapq.heappush(self.heap, (finish_ts, idx))
+
+    def job_enqueued(self, worker, job):
+        if worker.jobs_count() == 1:  # the queue was empty, new job is running right away
+            heapq.heappush(self.heap, (job.finish_ts, self.indices[worker]))
+
+    def get_next_finish_ts(self):
+        """Finish timestamp of the job that will be completed first (None if all queues are empty)."""
+        return self.heap[0][0] if self.heap else None
+
+    def advance_time(self, ts):
+        """Remove all jobs finished before or at ts from the queues and return them.
+
+        The jobs are returned in the order of the workers (and of the queues), the same order in which they are
+        reported when all the queues are scanned (metrics may depend on the order of finished jobs).
+        """
+        indices = []
+        while self.heap and self.heap[0][0] <= ts:
+            indices.append(heapq.heappop(self.heap)[1])  # each queue has one record (its front job)
+
+        res = []
+        for idx in sorted(indices):
+            res.extend(self.workers[idx].advance_time(ts))
+            self._push(idx)
         return res
+
+
+class WorkerIndex(WorkerQueueObserver):
+    """Index of active workers that allows dispatchers to find the shortest eligible queue in O(log W).
+
+    Active workers are partitioned by their `limit` attribute (None = no limit) and each partition is kept
+    in a min-heap keyed by the queue length (key="jobs") or by the finish timestamp of the queue backlog
+    (key="backlog"). Ties are broken by the order of the workers, so the selection is the same as sorting
+    the list of workers. The heaps are updated lazily -- every change pushes a new record and outdated records
+    are discarded when they reach the top.
+    """
+
+    def __init__(self, workers, key="jobs"):
+        if key not in ("jobs", "backlog"):
+            raise RuntimeError("Unknown worker index key '{}'.".format(key))
+        self.workers = workers
+        self.key = key
+        self.partitions = {}  # limit -> heap of records (key, worker index, version)
+        self.sizes = {}  # limit -> number of active workers in the partition
+        self.indices = {}  # worker -> index of the worker
+        self.versions = [0] * len(workers)  # only the latest record of each worker is valid
+        self.limits = [None] * len(workers)  # partition (limit) of each active worker
+        self.active = [False] * len(workers)
+        for idx, worker in enumerate(workers):
+            self.indices[worker] = idx
+            worker.add_observer(self)
+            self._update(idx)
+
+    def _get_key(self, worker):
+        if self.key == "jobs":
+            return worker.jobs_count()
+        finish_ts = worker.get_finish_ts()
+        return finish_ts if finish_ts is not None else float("-inf")
+
+    def _update(self, idx):
+        """Refresh the record of given worker (after its queue or attributes have changed)."""
+        worker = self.workers[idx]
+        self.versions[idx] += 1
+        if self.active[idx]:
+            self.sizes[self.limits[idx]] -= 1
+
+        self.active[idx] = bool(worker.get_attribute("active"))
+        if not self.active[idx]:
+            return
+
+        limit = worker.get_attribute("limit")
+        self.limits[idx] = limit
+        self.sizes[limit] = self.sizes.get(limit, 0) + 1
+        heap = self.partitions.setdefault(limit, [])
+        if len(heap) > 4 * self.sizes[limit] + 16:
+            # too many outdated records, rebuild the heap
+            heap[:] = [rec for rec in heap if self._is_valid(rec, limit)]
+            heapq.heapify(heap)
+        heapq.heappush(heap, (self._get_key(worker), idx, self.versions[idx]))
+
+    def _is_valid(self, record, limit):
+        _, idx, version = record
+        return self.versions[idx] == version and self.active[idx] and self.limits[idx] == limit
+
+    def _get_top(self, limit):
+        """Return the best valid record of given partition (or None if the partition is empty)."""
+        heap = self.partitions[limit]
+        while heap and not self._is_valid(heap[0], limit):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def job_enqueued(self, worker, job):
+        self._update(self.indices[worker])
+
+    def jobs_removed(self, worker, jobs):
+        self._update(self.indices[worker])
+
+    def attribute_changed(self, worker, name, old_value):
+        if name in ("active", "limit"):
+            self._update(self.indices[worker])
+
+    def get_shortest(self, est_duration=None):
+        """Get the active worker with the shortest queue that accepts a job of given estimated duration.
+
+        A worker accepts the job if it has no limit or its limit is not lower than the estimate.
+        If est_duration is None or no active worker accepts the job, all active workers are considered.
+        None is returned if there are no active workers at all.
+        """
+        best = None
+        fallback = None
+        for limit in self.partitions:
+            top = self._get_top(limit)
+            if top is None:
+                continue
+            if est_duration is None or limit is None or limit >= est_duration:
+                best = top if best is None or top < best else best
+            else:
+                fallback = top if fallback is None or top < fallback else fallback
+
+        if best is None:
+            best = fallback
+        return self.workers[best[1]] if best is not None else None